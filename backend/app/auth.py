@@ -6,6 +6,7 @@ from functools import lru_cache
 from fastapi import Depends, HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from .config import get_settings
+from . import llm_clients
 
 http_bearer = HTTPBearer(auto_error=False)
 
@@ -117,24 +118,23 @@ async def get_current_user(creds: Optional[HTTPAuthorizationCredentials] = Depen
             "Accept": "application/json",
         }
         try:
-            with httpx.Client(timeout=8) as client:
-                resp = client.get(url, headers=headers)
-                if resp.status_code == 200:
-                    data = resp.json() or {}
-                    uid = data.get("id") or data.get("user", {}).get("id")
-                    if uid:
-                        # Decode without verification to extract claims fields if needed
-                        try:
-                            decoded = jwt.decode(token, options={"verify_signature": False})
-                            decoded.setdefault("sub", uid)
-                            return decoded
-                        except Exception:
-                            return {"sub": uid}
-                # Trace failure once
-                try:
-                    print(f"[auth] Fallback /auth/v1/user failed status={resp.status_code}: {resp.text[:120]}")
-                except Exception:
-                    pass
+            resp = await llm_clients.async_http_client().get(url, headers=headers, timeout=8)
+            if resp.status_code == 200:
+                data = resp.json() or {}
+                uid = data.get("id") or data.get("user", {}).get("id")
+                if uid:
+                    # Decode without verification to extract claims fields if needed
+                    try:
+                        decoded = jwt.decode(token, options={"verify_signature": False})
+                        decoded.setdefault("sub", uid)
+                        return decoded
+                    except Exception:
+                        return {"sub": uid}
+            # Trace failure once
+            try:
+                print(f"[auth] Fallback /auth/v1/user failed status={resp.status_code}: {resp.text[:120]}")
+            except Exception:
+                pass
         except Exception:
             pass
         # If both JWKS and fallback fail, reject
@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+
+from .metrics import Histogram, LATENCY_MS_BUCKETS, BATCH_SIZE_BUCKETS
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class MicroBatcher(Generic[T, R]):
+    """
+    Collects items submitted concurrently (from request threads or the event loop)
+    for up to `window_ms` or until `max_batch` items are pending, then runs `fn`
+    once on the whole batch in a background thread and hands each caller its result.
+    `fn` must return one result per input item, in order.
+    """
+    def __init__(self, fn: Callable[[List[T]], List[R]], *, max_batch: int = 32, window_ms: float = 5.0, name: str = "batcher") -> None:
+        self._fn = fn
+        self.max_batch = max(1, int(max_batch))
+        self.window_s = max(0.0, float(window_ms)) / 1000.0
+        self.name = name
+        self._cond = threading.Condition()
+        self._pending: List[Tuple[T, Future, float]] = []
+        self._thread: Optional[threading.Thread] = None
+        self._closed = False
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.latency_ms = Histogram(LATENCY_MS_BUCKETS)
+
+    def submit(self, item: T) -> "Future[R]":
+        fut: Future = Future()
+        with self._cond:
+            closed = self._closed
+            if not closed:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._loop, name=f"{self.name}-worker", daemon=True)
+                    self._thread.start()
+                self._pending.append((item, fut, time.perf_counter()))
+                self._cond.notify()
+        if closed:
+            # late callers of a closed batcher (e.g. after a settings reload) run unbatched
+            try:
+                fut.set_result(self._fn([item])[0])
+            except BaseException as e:
+                fut.set_exception(e)
+        return fut
+
+    def run(self, item: T, timeout: Optional[float] = None) -> R:
+        return self.submit(item).result(timeout=timeout)
+
+    async def arun(self, item: T) -> R:
+        return await asyncio.wrap_future(self.submit(item))
+
+    def close(self) -> None:
+        """Stop the worker once pending items are flushed."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _next_batch(self) -> List[Tuple[T, Future, float]]:
+        with self._cond:
+            while not self._pending:
+                if self._closed:
+                    return []
+                self._cond.wait()
+            deadline = time.monotonic() + self.window_s
+            while len(self._pending) < self.max_batch and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            return batch
+
+    def _loop(self) -> None:
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            items = [b[0] for b in batch]
+            try:
+                results = self._fn(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"{self.name}: expected {len(items)} results, got {len(results)}")
+            except BaseException as e:  # deliver the failure to every waiter
+                logging.getLogger("rag").warning("[RAG] %s batch of %d failed: %s", self.name, len(items), e)
+                for _, fut, _t in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            done_at = time.perf_counter()
+            self.batch_sizes.observe(len(items))
+            for (_, fut, enq), res in zip(batch, results):
+                self.latency_ms.observe((done_at - enq) * 1000.0)
+                if not fut.done():
+                    fut.set_result(res)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            pending = len(self._pending)
+        return {
+            "max_batch": self.max_batch,
+            "window_ms": self.window_s * 1000.0,
+            "pending": pending,
+            "batch_size": self.batch_sizes.snapshot(),
+            "latency_ms": self.latency_ms.snapshot(),
+        }
@@ -0,0 +1,212 @@
+"""
+Conversation memory for /rag/stream threads: each turn keeps the user query and the
+best snippet it was answered from, and later turns of the same `thread_id` get the
+most recent snippets back as extra context, as many as fit `chat_memory_context_tokens`.
+
+Memory stays bounded: a thread keeps at most `chat_memory_max_turns` turns, snippets
+are truncated to `chat_memory_snippet_chars`, threads idle for longer than
+`chat_memory_ttl_seconds` are dropped, and past `chat_memory_max_threads` the least
+recently used threads are evicted. With `chat_memory_persist` the turns live in
+store_dir/chat_memory.sqlite3, so threads survive restarts and are shared by every
+uvicorn worker on the host; otherwise they are kept in process.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from .tokens import estimate_tokens
+
+_SWEEP_INTERVAL_S = 60.0
+
+
+class ConversationStore:
+    def __init__(self, path: Optional[str] = None, *, max_threads: int = 10_000, max_turns: int = 20,
+                 ttl_seconds: float = 86_400, snippet_chars: int = 2000) -> None:
+        self.path = path
+        self.max_threads = max(1, int(max_threads))
+        self.max_turns = max(1, int(max_turns))
+        self.ttl = float(ttl_seconds)
+        self.snippet_chars = max(1, int(snippet_chars))
+        self._lock = threading.Lock()
+        self._threads: "OrderedDict[str, Tuple[float, Deque[Tuple[str, str, int]]]]" = OrderedDict()
+        self._db: Optional[sqlite3.Connection] = None
+        self._last_sweep = 0.0
+        self._evicted = {"ttl": 0, "capacity": 0}
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            db = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+            db.execute("pragma journal_mode=wal")
+            db.execute("pragma synchronous=normal")
+            db.executescript(
+                """
+                create table if not exists threads (
+                  thread_id text primary key,
+                  last_used_at real not null
+                );
+                create index if not exists idx_threads_used on threads(last_used_at);
+                create table if not exists turns (
+                  id integer primary key autoincrement,
+                  thread_id text not null,
+                  query text,
+                  snippet text,
+                  tokens int not null,
+                  created_at real
+                );
+                create index if not exists idx_turns_thread on turns(thread_id, id);
+                """
+            )
+            self._db = db
+
+    # -------- Reads --------
+    def window(self, thread_id: str, max_tokens: int) -> List[str]:
+        """Most recent snippets of the thread that fit `max_tokens`, oldest first."""
+        self._sweep()
+        now = time.time()
+        with self._lock:
+            if self._db is not None:
+                row = self._db.execute("select last_used_at from threads where thread_id=?", (thread_id,)).fetchone()
+                if row is None or now - row[0] > self.ttl:
+                    return []
+                turns = self._db.execute("select snippet, tokens from turns where thread_id=? order by id desc limit ?",
+                                         (thread_id, self.max_turns)).fetchall()
+            else:
+                item = self._threads.get(thread_id)
+                if item is None or now - item[0] > self.ttl:
+                    return []
+                turns = [(snippet, tokens) for _q, snippet, tokens in reversed(item[1])]
+        out: List[str] = []
+        used = 0
+        for snippet, tokens in turns:
+            if not snippet:
+                continue
+            if used + tokens > max_tokens:
+                break
+            out.append(snippet)
+            used += tokens
+        out.reverse()
+        return out
+
+    # -------- Writes --------
+    def append(self, thread_id: str, query: str, snippet: str) -> None:
+        """Record a turn; trims the thread to max_turns and evicts threads over max_threads."""
+        snippet = (snippet or "")[: self.snippet_chars]
+        tokens = estimate_tokens(snippet) if snippet else 0
+        now = time.time()
+        with self._lock:
+            if self._db is not None:
+                db = self._db
+                db.execute("begin immediate")
+                try:
+                    new = db.execute("select 1 from threads where thread_id=?", (thread_id,)).fetchone() is None
+                    db.execute("insert into threads(thread_id, last_used_at) values (?, ?) "
+                               "on conflict(thread_id) do update set last_used_at=excluded.last_used_at", (thread_id, now))
+                    db.execute("insert into turns(thread_id, query, snippet, tokens, created_at) values (?,?,?,?,?)",
+                               (thread_id, query, snippet, tokens, now))
+                    db.execute("delete from turns where thread_id=? and id not in "
+                               "(select id from turns where thread_id=? order by id desc limit ?)",
+                               (thread_id, thread_id, self.max_turns))
+                    if new:
+                        extra = db.execute("select count(*) from threads").fetchone()[0] - self.max_threads
+                        if extra > 0:
+                            self._delete_threads_locked(
+                                [r[0] for r in db.execute("select thread_id from threads order by last_used_at limit ?", (extra,))])
+                            self._evicted["capacity"] += extra
+                    db.execute("commit")
+                except BaseException:
+                    db.execute("rollback")
+                    raise
+            else:
+                item = self._threads.pop(thread_id, None)
+                turns = item[1] if item is not None else deque(maxlen=self.max_turns)
+                turns.append((query, snippet, tokens))
+                self._threads[thread_id] = (now, turns)
+                while len(self._threads) > self.max_threads:
+                    self._threads.popitem(last=False)
+                    self._evicted["capacity"] += 1
+
+    def clear(self, thread_id: str) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.execute("begin immediate")
+                self._delete_threads_locked([thread_id])
+                self._db.execute("commit")
+            else:
+                self._threads.pop(thread_id, None)
+
+    def _delete_threads_locked(self, thread_ids: List[str]) -> None:
+        for tid in thread_ids:
+            self._db.execute("delete from turns where thread_id=?", (tid,))
+            self._db.execute("delete from threads where thread_id=?", (tid,))
+
+    def _sweep(self) -> None:
+        """Drop idle threads; runs at most once per _SWEEP_INTERVAL_S."""
+        now = time.time()
+        if now - self._last_sweep < _SWEEP_INTERVAL_S:
+            return
+        with self._lock:
+            self._last_sweep = now
+            cutoff = now - self.ttl
+            if self._db is not None:
+                db = self._db
+                db.execute("begin immediate")
+                try:
+                    stale = [r[0] for r in db.execute("select thread_id from threads where last_used_at<?", (cutoff,))]
+                    self._delete_threads_locked(stale)
+                    db.execute("commit")
+                except BaseException:
+                    db.execute("rollback")
+                    raise
+            else:
+                # OrderedDict is in last-use order, so idle threads are at the front
+                stale = []
+                for tid, (used, _turns) in self._threads.items():
+                    if used >= cutoff:
+                        break
+                    stale.append(tid)
+                for tid in stale:
+                    del self._threads[tid]
+            self._evicted["ttl"] += len(stale)
+
+    def stats(self) -> Dict[str, Any]:
+        self._sweep()
+        with self._lock:
+            if self._db is not None:
+                threads = self._db.execute("select count(*) from threads").fetchone()[0]
+                turns = self._db.execute("select count(*) from turns").fetchone()[0]
+            else:
+                threads = len(self._threads)
+                turns = sum(len(t) for _u, t in self._threads.values())
+            return {
+                "persistent": self._db is not None,
+                "threads": int(threads),
+                "turns": int(turns),
+                "max_threads": self.max_threads,
+                "max_turns": self.max_turns,
+                "ttl_seconds": self.ttl,
+                "evicted": dict(self._evicted),
+            }
+
+
+_store: Optional[ConversationStore] = None
+_store_key: Optional[Tuple[Any, ...]] = None
+_lock = threading.Lock()
+
+
+def get_store(settings: Any) -> ConversationStore:
+    """Process-wide store for the current settings; a settings reload that changes them replaces it."""
+    global _store, _store_key
+    path = os.path.join(settings.store_dir, "chat_memory.sqlite3") if settings.chat_memory_persist else None
+    key = (path, settings.chat_memory_max_threads, settings.chat_memory_max_turns,
+           settings.chat_memory_ttl_seconds, settings.chat_memory_snippet_chars)
+    with _lock:
+        if _store is None or _store_key != key:
+            _store = ConversationStore(path, max_threads=key[1], max_turns=key[2], ttl_seconds=key[3], snippet_chars=key[4])
+            _store_key = key
+        return _store
+
+
+def stats() -> Optional[Dict[str, Any]]:
+    return _store.stats() if _store is not None else None
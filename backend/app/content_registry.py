@@ -0,0 +1,102 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+
+class ContentRegistry:
+    """
+    SQLite registry of uploaded file contents keyed by sha256, kept in store_dir.
+    Records where an identical file already lives in Storage, its `analyze_file`
+    result, and which documents have its chunks indexed per vector store scope
+    ("<backend>:<collection>"), so a duplicate upload/import can reuse all three
+    instead of re-uploading, re-analyzing and re-embedding.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("pragma journal_mode=wal")
+        self._conn.execute("pragma synchronous=normal")
+        self._conn.executescript(
+            """
+            create table if not exists contents (
+              sha256 text primary key,
+              size int,
+              mime text,
+              file_path text,
+              file_url text,
+              analysis text,
+              created_at real,
+              last_used_at real
+            );
+            create table if not exists indexed (
+              scope text not null,
+              document_id text not null,
+              sha256 text not null,
+              indexed_at real,
+              primary key (scope, document_id)
+            );
+            create index if not exists idx_indexed_sha on indexed(scope, sha256);
+            """
+        )
+        self._conn.commit()
+
+    def lookup(self, sha256: str) -> Optional[Dict[str, Any]]:
+        """Known content: {sha256, size, mime, file_path, file_url, analysis}, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "select sha256, size, mime, file_path, file_url, analysis from contents where sha256=?", (sha256,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("update contents set last_used_at=? where sha256=?", (time.time(), sha256))
+            self._conn.commit()
+        return {
+            "sha256": row[0], "size": row[1], "mime": row[2], "file_path": row[3], "file_url": row[4],
+            "analysis": json.loads(row[5]) if row[5] else None,
+        }
+
+    def record_upload(self, sha256: str, *, size: int, mime: Optional[str], file_path: str, file_url: Optional[str]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "insert into contents(sha256, size, mime, file_path, file_url, created_at, last_used_at) values (?,?,?,?,?,?,?) "
+                "on conflict(sha256) do update set file_path=excluded.file_path, file_url=excluded.file_url, last_used_at=excluded.last_used_at",
+                (sha256, int(size), mime, file_path, file_url, now, now))
+            self._conn.commit()
+
+    def record_analysis(self, sha256: str, analysis: Dict[str, Any]) -> None:
+        with self._lock:
+            self._conn.execute("update contents set analysis=? where sha256=?",
+                               (json.dumps(analysis, ensure_ascii=False, default=str), sha256))
+            self._conn.commit()
+
+    def record_indexed(self, scope: str, document_id: str, sha256: str) -> None:
+        """A document holds exactly one content: re-indexing it replaces the old entry."""
+        with self._lock:
+            self._conn.execute("insert or replace into indexed(scope, document_id, sha256, indexed_at) values (?,?,?,?)",
+                               (scope, str(document_id), sha256, time.time()))
+            self._conn.commit()
+
+    def indexed_documents(self, scope: str, sha256: str) -> List[str]:
+        """Documents whose chunks for this content are in the store, most recent first."""
+        with self._lock:
+            return [r[0] for r in self._conn.execute(
+                "select document_id from indexed where scope=? and sha256=? order by indexed_at desc", (scope, sha256))]
+
+    def forget_document(self, document_id: str, scope: Optional[str] = None) -> None:
+        with self._lock:
+            if scope is None:
+                self._conn.execute("delete from indexed where document_id=?", (str(document_id),))
+            else:
+                self._conn.execute("delete from indexed where scope=? and document_id=?", (scope, str(document_id)))
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            contents, size = self._conn.execute("select count(*), coalesce(sum(size), 0) from contents").fetchone()
+            indexed = self._conn.execute("select count(*) from indexed").fetchone()[0]
+        return {"path": self.path, "contents": int(contents), "bytes": int(size), "indexed_documents": int(indexed)}
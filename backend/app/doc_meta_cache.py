@@ -0,0 +1,89 @@
+import logging
+from typing import Any, Dict, Iterable, List, Optional
+
+from .query_cache import TTLLRUCache
+
+# Columns used to enrich Supabase retrieval hits with document metadata
+DOC_META_COLUMNS = "id,author,tags,created_at,file_url,subject_id,name,file_path"
+
+
+class DocumentMetaCache:
+    """
+    Process-local cache of `documents` rows used by retrieval enrichment, keyed by
+    document id (as string). Entries expire after a TTL and are dropped explicitly
+    when the documents/imports routers change a row. Ids not found in the table are
+    cached as empty rows so repeated misses do not hit PostgREST either.
+    """
+    def __init__(self, max_entries: int = 5000, ttl_seconds: float = 300.0) -> None:
+        self.configure(max_entries, ttl_seconds)
+
+    def configure(self, max_entries: int, ttl_seconds: float) -> None:
+        if getattr(self, "_config", None) == (int(max_entries), float(ttl_seconds)):
+            return
+        self._config = (int(max_entries), float(ttl_seconds))
+        self._rows = TTLLRUCache(max_entries, ttl_seconds)
+        # subjects bulk-loaded within the TTL
+        self._subjects = TTLLRUCache(1024, ttl_seconds)
+
+    def _put(self, doc_id: str, row: Dict[str, Any]) -> None:
+        self._rows.set(doc_id, row, tags=(f"doc:{doc_id}",))
+
+    def get_many(self, doc_ids: Iterable[Any], *, subject_id: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """Rows for `doc_ids` (missing documents are omitted). On a miss with a known
+        subject, the whole subject is prefetched in one query."""
+        keys = list(dict.fromkeys(str(d) for d in doc_ids if d is not None))
+        found: Dict[str, Dict[str, Any]] = {}
+        missing: List[str] = []
+        for k in keys:
+            row = self._rows.get(k)
+            if row is None:
+                missing.append(k)
+            elif row:
+                found[k] = row
+        if missing and subject_id and self._subjects.get(str(subject_id)) is None:
+            self.prefetch_subject(subject_id)
+            still: List[str] = []
+            for k in missing:
+                row = self._rows.get(k)
+                if row is None:
+                    still.append(k)
+                elif row:
+                    found[k] = row
+            missing = still
+        if missing:
+            from .supabase_client import get_supabase
+            res = get_supabase().table("documents").select(DOC_META_COLUMNS).in_("id", missing).execute()
+            for row in res.data or []:
+                self._put(str(row["id"]), row)
+                found[str(row["id"])] = row
+            for k in missing:
+                if k not in found:
+                    self._put(k, {})
+        return found
+
+    def prefetch_subject(self, subject_id: str) -> int:
+        """Load every document row of a subject into the cache."""
+        from .supabase_client import get_supabase
+        try:
+            res = get_supabase().table("documents").select(DOC_META_COLUMNS).eq("subject_id", subject_id).execute()
+        except Exception as e:
+            logging.getLogger("rag").warning("[RAG] Document metadata prefetch failed subject=%s err=%s", subject_id, e)
+            return 0
+        rows = res.data or []
+        for row in rows:
+            self._put(str(row["id"]), row)
+        self._subjects.set(str(subject_id), True)
+        return len(rows)
+
+    def invalidate(self, doc_ids: Iterable[Any]) -> None:
+        self._rows.invalidate_tags([f"doc:{d}" for d in doc_ids if d is not None])
+
+    def clear(self) -> None:
+        self._rows.clear()
+        self._subjects.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return self._rows.stats()
+
+
+doc_meta_cache = DocumentMetaCache()
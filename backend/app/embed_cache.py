@@ -0,0 +1,121 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache keyed by (embed_provider, model name, sha256 of text).
+    Vectors are stored as float32 blobs in a SQLite file under RAGSettings.store_dir.
+    Once the cache grows past max_entries, the least recently used rows are evicted.
+    """
+    def __init__(self, path: str, max_entries: int = 200_000) -> None:
+        self.path = path
+        self.max_entries = max(1, int(max_entries))
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("pragma journal_mode=wal")
+        self._conn.execute("pragma synchronous=normal")
+        self._conn.execute(
+            "create table if not exists embeddings ("
+            " provider text not null,"
+            " model text not null,"
+            " text_hash text not null,"
+            " dim int not null,"
+            " vec blob not null,"
+            " last_access real not null,"
+            " primary key (provider, model, text_hash))"
+        )
+        self._conn.execute("create index if not exists idx_embeddings_last_access on embeddings(last_access)")
+        self._conn.commit()
+        self._size = self._conn.execute("select count(*) from embeddings").fetchone()[0]
+
+    def get_many(self, provider: str, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Return cached vectors aligned with texts (None for misses) and refresh their LRU stamp."""
+        hashes = [text_hash(t) for t in texts]
+        found: Dict[str, List[float]] = {}
+        uniq = list(dict.fromkeys(hashes))
+        with self._lock:
+            # SQLite caps bound parameters; look up in slices
+            for i in range(0, len(uniq), 500):
+                part = uniq[i:i + 500]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"select text_hash, vec from embeddings where provider=? and model=? and text_hash in ({marks})",
+                    [provider, model, *part],
+                ).fetchall()
+                for h, blob in rows:
+                    vec = array("f")
+                    vec.frombytes(blob)
+                    found[h] = vec.tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "update embeddings set last_access=? where provider=? and model=? and text_hash=?",
+                    [(now, provider, model, h) for h in found],
+                )
+                self._conn.commit()
+            out = [found.get(h) for h in hashes]
+            hits = sum(1 for v in out if v is not None)
+            self._hits += hits
+            self._misses += len(out) - hits
+        return out
+
+    def put_many(self, provider: str, model: str, texts: List[str], vectors: List[List[float]]) -> None:
+        now = time.time()
+        rows: List[Tuple[str, str, str, int, bytes, float]] = []
+        for t, v in zip(texts, vectors):
+            rows.append((provider, model, text_hash(t), len(v), array("f", v).tobytes(), now))
+        if not rows:
+            return
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "insert or ignore into embeddings(provider, model, text_hash, dim, vec, last_access) values (?,?,?,?,?,?)",
+                rows,
+            )
+            self._size += self._conn.total_changes - before
+            if self._size > self.max_entries:
+                self._evict_locked()
+            self._conn.commit()
+
+    def _evict_locked(self) -> None:
+        # Trim to 90% of capacity so eviction does not run on every insert
+        target = int(self.max_entries * 0.9)
+        excess = self._size - target
+        if excess <= 0:
+            return
+        cur = self._conn.execute(
+            "delete from embeddings where rowid in (select rowid from embeddings order by last_access asc limit ?)",
+            (excess,),
+        )
+        removed = cur.rowcount if cur.rowcount is not None and cur.rowcount >= 0 else excess
+        self._evictions += removed
+        self._size = self._conn.execute("select count(*) from embeddings").fetchone()[0]
+        logging.getLogger("rag").info("[RAG] Embedding cache evicted rows=%s size=%s", removed, self._size)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "path": self.path,
+                "entries": self._size,
+                "max_entries": self.max_entries,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "hit_rate": round(self._hits / total, 4) if total else None,
+            }
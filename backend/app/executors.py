@@ -0,0 +1,96 @@
+"""
+Bounded thread pools behind the async facade of RAGEngine (aretrieve).
+
+`async def` handlers run on the event loop, so a blocking call there (vector search,
+Supabase) stalls every other request of the uvicorn worker. The facade hands that
+work to a small named pool instead (separate pools keep one kind of blocking work
+from starving another), and `stats()` shows per pool how long calls queued for a
+thread and how long they ran.
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from .metrics import Histogram, LATENCY_MS_BUCKETS
+
+
+class BoundedExecutor:
+    def __init__(self, name: str, max_workers: int) -> None:
+        self.name = name
+        self.max_workers = max(1, int(max_workers))
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"async-{name}")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.wait_ms = Histogram(LATENCY_MS_BUCKETS)
+        self.run_ms = Histogram(LATENCY_MS_BUCKETS + (30_000, 60_000))
+
+    async def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Await `fn(*args, **kwargs)` on this pool (context variables are carried over)."""
+        ctx = contextvars.copy_context()
+        call = functools.partial(ctx.run, fn, *args, **kwargs)
+        submitted = time.perf_counter()
+
+        def timed() -> Any:
+            started = time.perf_counter()
+            self.wait_ms.observe((started - submitted) * 1000.0)
+            try:
+                return call()
+            finally:
+                self.run_ms.observe((time.perf_counter() - started) * 1000.0)
+
+        with self._lock:
+            self._in_flight += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, timed)
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def shutdown(self) -> None:
+        # calls already running finish on their own; queued ones are dropped
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            in_flight = self._in_flight
+        return {
+            "max_workers": self.max_workers,
+            "in_flight": in_flight,
+            "queued": max(0, in_flight - self.max_workers),
+            "wait_ms": self.wait_ms.snapshot(),
+            "run_ms": self.run_ms.snapshot(),
+        }
+
+
+_executors: Dict[str, BoundedExecutor] = {}
+_lock = threading.Lock()
+
+
+def get_executor(name: str, max_workers: int) -> BoundedExecutor:
+    """Process-wide pool `name`; a different size (settings reload) replaces it."""
+    with _lock:
+        ex = _executors.get(name)
+        if ex is None or ex.max_workers != max(1, int(max_workers)):
+            if ex is not None:
+                ex.shutdown()
+            ex = BoundedExecutor(name, max_workers)
+            _executors[name] = ex
+            logging.getLogger("rag").info("[RAG] Executor %s started max_workers=%d", name, ex.max_workers)
+        return ex
+
+
+def shutdown() -> None:
+    with _lock:
+        for ex in _executors.values():
+            ex.shutdown()
+        _executors.clear()
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        return {name: ex.stats() for name, ex in _executors.items()}
@@ -0,0 +1,92 @@
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from . import llm_clients
+
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com"
+# batchEmbedContents accepts at most 100 requests per call
+GEMINI_MAX_BATCH = 100
+
+def _retry_delay(attempt: int, resp: Optional[httpx.Response]) -> float:
+    if resp is not None:
+        ra = resp.headers.get("retry-after")
+        if ra:
+            try:
+                return min(60.0, float(ra))
+            except ValueError:
+                pass
+    # exponential backoff with full jitter, capped
+    return random.uniform(0, min(30.0, 0.5 * (2 ** attempt)))
+
+
+def _embed_batch(client: httpx.Client, url: str, api_key: str, model: str, texts: List[str], max_retries: int) -> List[List[float]]:
+    body = {"requests": [{"model": model, "content": {"parts": [{"text": t}]}} for t in texts]}
+    headers = {"x-goog-api-key": api_key, "Content-Type": "application/json"}
+    attempt = 0
+    while True:
+        resp: Optional[httpx.Response] = None
+        try:
+            resp = client.post(url, json=body, headers=headers)
+        except httpx.TransportError as e:
+            if attempt >= max_retries:
+                raise RuntimeError(f"Gemini batchEmbedContents request failed: {e}")
+        else:
+            if resp.status_code == 200:
+                break
+            if resp.status_code != 429 and resp.status_code < 500:
+                raise RuntimeError(f"Gemini batchEmbedContents HTTP {resp.status_code}: {resp.text[:500]}")
+            if attempt >= max_retries:
+                raise RuntimeError(f"Gemini batchEmbedContents HTTP {resp.status_code} after {attempt + 1} attempts: {resp.text[:500]}")
+        delay = _retry_delay(attempt, resp)
+        logging.getLogger("rag").warning(
+            "[RAG] Gemini embed retry %d/%d in %.2fs (status=%s)",
+            attempt + 1, max_retries, delay, resp.status_code if resp is not None else "transport",
+        )
+        time.sleep(delay)
+        attempt += 1
+
+    data: Dict[str, Any] = resp.json()
+    embs = data.get("embeddings") or []
+    if len(embs) != len(texts):
+        raise RuntimeError(f"Gemini batchEmbedContents returned {len(embs)} embeddings for {len(texts)} inputs")
+    out: List[List[float]] = []
+    for e in embs:
+        vec = e.get("values") if isinstance(e, dict) else None
+        if not isinstance(vec, list):
+            raise RuntimeError("Gemini batchEmbedContents returned unexpected shape")
+        out.append([float(x) for x in vec])
+    return out
+
+
+def gemini_batch_embed(texts: List[str], *,
+                       api_key: str,
+                       model: str,
+                       base_url: str = GEMINI_BASE_URL,
+                       batch_size: int = GEMINI_MAX_BATCH,
+                       concurrency: int = 4,
+                       max_retries: int = 4,
+                       client: Optional[httpx.Client] = None) -> List[List[float]]:
+    """Embed texts with Gemini's batchEmbedContents REST endpoint.
+    Texts are split into batches of at most 100, sent over a bounded thread pool,
+    and 429/5xx responses are retried with backoff. Output order matches input order.
+    `base_url` can point at a local stub server for testing.
+    """
+    if not texts:
+        return []
+    model_path = model if model.startswith(("models/", "tunedModels/")) else f"models/{model}"
+    url = f"{base_url.rstrip('/')}/v1beta/{model_path}:batchEmbedContents"
+    size = max(1, min(int(batch_size), GEMINI_MAX_BATCH))
+    batches = [texts[i:i + size] for i in range(0, len(texts), size)]
+    http = client or llm_clients.http_client()
+    if len(batches) == 1:
+        return _embed_batch(http, url, api_key, model_path, batches[0], max_retries)
+    workers = max(1, min(int(concurrency), len(batches)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gemini-embed") as pool:
+        # map() yields results in submission order, preserving output order
+        results = list(pool.map(lambda b: _embed_batch(http, url, api_key, model_path, b, max_retries), batches))
+    return [vec for batch in results for vec in batch]
@@ -0,0 +1,229 @@
+"""
+Durable indexing queue: routers enqueue, a bounded pool of worker threads runs
+`RAGEngine.index_document`. Jobs live in the JobStore SQLite table (rag_jobs.py),
+so queued work survives restarts and is shared by every uvicorn worker on the host;
+a job whose worker died is picked up again once its lease expires.
+
+File bytes are spooled to store_dir/index_spool until the job finishes; jobs
+without a spool file (or whose spool was lost) download `file_url` instead.
+"""
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from .metrics import Histogram, LATENCY_MS_BUCKETS
+from .rag_jobs import QueueFull, job_store  # noqa: F401  (QueueFull re-exported for routers)
+
+_WAIT_S_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+
+class IndexQueue:
+    def __init__(self) -> None:
+        self._threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._wake = threading.Condition()
+        self._stop = threading.Event()
+        self._running = 0
+        self.wait_s = Histogram(_WAIT_S_BUCKETS)
+        self.run_ms = Histogram(LATENCY_MS_BUCKETS + (30_000, 60_000, 300_000))
+        self.outcomes: Dict[str, int] = {"done": 0, "retried": 0, "failed": 0, "cancelled": 0}
+
+    # -------- Settings --------
+    @staticmethod
+    def _settings() -> Any:
+        from .rag import get_engine
+        return get_engine().settings
+
+    def _spool_dir(self) -> str:
+        path = os.path.join(self._settings().store_dir, "index_spool")
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    # -------- Producer side --------
+    def enqueue_index(self, *, document_id: str, subject_id: Optional[str], user_id: Optional[str], file_name: str,
+                      extra_metadata: Optional[Dict[str, Any]] = None, replace: bool = True,
+                      content: Optional[bytes] = None, file_url: Optional[str] = None) -> str:
+        """Queue (re)indexing of a document; see JobStore.enqueue for the idempotency rules.
+        Raises QueueFull when index_queue_max jobs are already waiting."""
+        s = self._settings()
+        spool = None
+        if content is not None:
+            spool = os.path.join(self._spool_dir(), f"{document_id}-{hashlib.sha256(content).hexdigest()[:16]}.bin")
+            if not os.path.exists(spool):
+                tmp = spool + ".tmp"
+                with open(tmp, "wb") as f:
+                    f.write(content)
+                os.replace(tmp, spool)
+        payload = {
+            "document_id": str(document_id),
+            "subject_id": subject_id,
+            "user_id": user_id,
+            "file_name": file_name,
+            "extra_metadata": extra_metadata or {},
+            "replace": bool(replace),
+            "spool": spool,
+            "file_url": file_url,
+        }
+        try:
+            outcome = job_store.enqueue(str(document_id), payload, max_attempts=max(1, s.index_max_attempts), max_depth=s.index_queue_max)
+        except QueueFull:
+            if spool:
+                self._drop_spool(spool)
+            raise
+        logging.getLogger("rag").info("[RAG] Index job %s doc_id=%s depth=%s", outcome, document_id, job_store.depth()["queued"])
+        self.start()
+        with self._wake:
+            self._wake.notify()
+        return outcome
+
+    def cancel(self, document_id: str) -> None:
+        """Stop (re)indexing a deleted document: drops its queued, retrying or deferred job
+        and their spool files. A run already in progress removes its chunks when it ends."""
+        for payload in job_store.cancel(str(document_id)):
+            self._drop_spool(payload.get("spool"))
+
+    # -------- Workers --------
+    def start(self) -> None:
+        """Start the worker threads (idempotent); also resumes jobs persisted by a previous run."""
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            want = max(1, int(self._settings().index_workers))
+            self._stop.clear()
+            while len(self._threads) < want:
+                t = threading.Thread(target=self._worker, name=f"index-worker-{len(self._threads)}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def stop(self) -> None:
+        self._stop.set()
+        with self._wake:
+            self._wake.notify_all()
+
+    def _worker(self) -> None:
+        log = logging.getLogger("rag")
+        while not self._stop.is_set():
+            try:
+                job = job_store.claim()
+            except Exception as e:
+                log.warning("[RAG] Index queue claim failed: %s", e)
+                job = None
+            if job is None:
+                # other processes enqueue too, so poll as well as wait for a local wake-up
+                with self._wake:
+                    self._wake.wait(timeout=2.0)
+                continue
+            doc_id, payload, attempt, waited = job
+            self.wait_s.observe(waited)
+            with self._lock:
+                self._running += 1
+            t0 = time.perf_counter()
+            try:
+                self._run(doc_id, payload, attempt)
+            finally:
+                self.run_ms.observe((time.perf_counter() - t0) * 1000.0)
+                with self._lock:
+                    self._running -= 1
+
+    def _run(self, doc_id: str, payload: Dict[str, Any], attempt: int) -> None:
+        log = logging.getLogger("rag")
+        s = self._settings()
+        if not self._document_exists(doc_id):
+            log.info("[RAG] Index job skipped doc_id=%s: document was deleted", doc_id)
+            job_store.cancel(doc_id)
+            self._end_cancelled(doc_id, payload, has_chunks=False)
+            return
+        try:
+            res = self._index(payload)
+        except Exception as e:
+            if job_store.is_cancelled(doc_id):
+                self._end_cancelled(doc_id, payload)
+                return
+            delay = min(900.0, s.index_retry_base_seconds * (2 ** (attempt - 1))) * random.uniform(0.8, 1.2)
+            retried = job_store.retry_or_fail(doc_id, str(e), delay)
+            self.outcomes["retried" if retried else "failed"] += 1
+            log.exception("[RAG] Index job failed doc_id=%s attempt=%d retry=%s: %s", doc_id, attempt, retried, e)
+        else:
+            if job_store.is_cancelled(doc_id):
+                # the document was deleted while this run was storing its chunks
+                self._end_cancelled(doc_id, payload)
+                return
+            ok = bool((res or {}).get("ok"))
+            # ok=False means no extractable text: retrying the same file cannot help
+            job_store.complete(doc_id, ok=ok, error=None if ok else (res or {}).get("message"))
+            self.outcomes["done" if ok else "failed"] += 1
+        self._drop_spool(payload.get("spool"))
+
+    @staticmethod
+    def _document_exists(doc_id: str) -> bool:
+        """Whether the `documents` row is still there (assumed yes if Supabase can't be reached)."""
+        try:
+            from .supabase_client import get_supabase
+            resp = get_supabase().table("documents").select("id").eq("id", doc_id).limit(1).execute()
+            return bool(resp.data)
+        except Exception as e:
+            logging.getLogger("rag").warning("[RAG] Index job doc_id=%s: document lookup failed, indexing anyway: %s", doc_id, e)
+            return True
+
+    def _end_cancelled(self, doc_id: str, payload: Dict[str, Any], has_chunks: bool = True) -> None:
+        if has_chunks:
+            from .rag import get_engine
+            try:
+                get_engine().delete_document(doc_id)
+            except Exception as e:
+                logging.getLogger("rag").warning("[RAG] Cleanup of cancelled index job doc_id=%s failed: %s", doc_id, e)
+        job_store.complete(doc_id, ok=False)
+        self.outcomes["cancelled"] += 1
+        self._drop_spool(payload.get("spool"))
+
+    def _index(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        from .rag import get_engine
+        content = None
+        spool = payload.get("spool")
+        if spool and os.path.exists(spool):
+            with open(spool, "rb") as f:
+                content = f.read()
+        elif payload.get("file_url"):
+            from . import llm_clients
+            resp = llm_clients.http_client().get(payload["file_url"], timeout=60, follow_redirects=True)
+            resp.raise_for_status()
+            content = resp.content
+        if content is None:
+            raise RuntimeError("file content unavailable (spool missing and no file_url)")
+        return get_engine().index_document(
+            document_id=payload["document_id"],
+            subject_id=payload.get("subject_id"),
+            user_id=payload.get("user_id"),
+            file_bytes=content,
+            file_name=payload.get("file_name") or "file.bin",
+            extra_metadata=payload.get("extra_metadata") or None,
+            replace=bool(payload.get("replace", True)),
+        )
+
+    @staticmethod
+    def _drop_spool(path: Optional[str]) -> None:
+        # the same file may be spooled for a retry or a deferred re-run of the document
+        if path and not job_store.payload_in_use(os.path.basename(path)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            workers = sum(1 for t in self._threads if t.is_alive())
+            running = self._running
+        return {
+            **job_store.depth(),
+            "workers": workers,
+            "running_here": running,
+            "outcomes": dict(self.outcomes),
+            "wait_s": self.wait_s.snapshot(),
+            "run_ms": self.run_ms.snapshot(),
+        }
+
+
+index_queue = IndexQueue()
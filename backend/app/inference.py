@@ -0,0 +1,219 @@
+"""
+CPU inference backends for the local embedding and rerank models (RAGSettings.inference_backend).
+
+- torch:       plain sentence-transformers, float32 (default)
+- torch-int8:  same model with dynamic int8 quantization of nn.Linear layers
+- onnx:        ONNX Runtime session over a one-time export cached under store_dir/models
+- onnx-int8:   the ONNX export with ONNX Runtime dynamic int8 weight quantization
+
+All backends keep the model's own tokenizer, mean pooling and normalization, so
+query vectors stay cosine-compatible with chunks indexed by the torch backend.
+Loaders return objects exposing the subset of the SentenceTransformer / CrossEncoder
+API the engine uses (`encode(...)` / `predict(...)`).
+"""
+import json
+import logging
+import os
+import re
+import threading
+from typing import Any, List, Optional, Sequence, Tuple
+
+INFERENCE_BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+_export_lock = threading.Lock()
+
+
+def configure_threads(threads: int) -> None:
+    """Pin intra-op thread counts explicitly instead of relying on library defaults."""
+    if threads <= 0:
+        return
+    os.environ.setdefault("OMP_NUM_THREADS", str(threads))
+    try:
+        import torch
+        torch.set_num_threads(threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # can only be set before the first parallel op; ignore on reload
+            pass
+    except ImportError:
+        pass
+
+
+def _artefact_dir(cache_dir: str, model_name: str, kind: str) -> str:
+    safe = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+    return os.path.join(cache_dir, "models", f"{safe}-{kind}")
+
+
+def _onnx_session(path: str, threads: int) -> Any:
+    import onnxruntime as ort
+    so = ort.SessionOptions()
+    so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if threads > 0:
+        so.intra_op_num_threads = threads
+        so.inter_op_num_threads = 1
+    return ort.InferenceSession(path, so, providers=["CPUExecutionProvider"])
+
+
+def _quantized_copy(path: str) -> str:
+    out = path.replace(".onnx", ".int8.onnx")
+    if not os.path.exists(out):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(path, out, weight_type=QuantType.QInt8)
+    return out
+
+
+def _export(model: Any, tokenizer: Any, out_dir: str, output_name: str, meta: dict) -> str:
+    """Export a HF transformer to ONNX once; later loads reuse the cached file."""
+    import torch
+    path = os.path.join(out_dir, "model.onnx")
+    with _export_lock:
+        if os.path.exists(path):
+            return path
+        os.makedirs(out_dir, exist_ok=True)
+        sample = tokenizer(["export"], ["sample"] if output_name == "logits" else None, return_tensors="pt")
+        input_names = [k for k in ("input_ids", "attention_mask", "token_type_ids") if k in sample]
+        dynamic = {k: {0: "batch", 1: "seq"} for k in input_names}
+        dynamic[output_name] = {0: "batch", 1: "seq"} if output_name == "last_hidden_state" else {0: "batch"}
+        model.eval()
+        tmp = path + ".tmp"
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                tuple(sample[k] for k in input_names),
+                tmp,
+                input_names=input_names,
+                output_names=[output_name],
+                dynamic_axes=dynamic,
+                opset_version=14,
+            )
+        tokenizer.save_pretrained(out_dir)
+        with open(os.path.join(out_dir, "export.json"), "w", encoding="utf-8") as f:
+            json.dump({**meta, "input_names": input_names}, f)
+        os.replace(tmp, path)
+        logging.getLogger("rag").info("[RAG] Exported ONNX model to %s", path)
+    return path
+
+
+class OnnxEmbedder:
+    def __init__(self, model_name: str, *, cache_dir: str, threads: int = 0, quantize: bool = False) -> None:
+        from transformers import AutoTokenizer
+        out_dir = _artefact_dir(cache_dir, model_name, "embed-onnx")
+        path = os.path.join(out_dir, "model.onnx")
+        if not os.path.exists(path):
+            from sentence_transformers import SentenceTransformer
+            st = SentenceTransformer(model_name, device="cpu")
+            pooling = st[1] if len(st) > 1 else None
+            if pooling is None or not getattr(pooling, "pooling_mode_mean_tokens", False):
+                raise RuntimeError(f"{model_name}: only mean-pooling models can be served via ONNX")
+            transformer = st[0]
+            path = _export(transformer.auto_model, transformer.tokenizer, out_dir, "last_hidden_state",
+                           {"max_seq_length": int(transformer.max_seq_length), "pooling": "mean"})
+        with open(os.path.join(out_dir, "export.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if quantize:
+            path = _quantized_copy(path)
+        self.max_seq_length = int(meta.get("max_seq_length") or 256)
+        self.input_names: List[str] = list(meta.get("input_names") or ["input_ids", "attention_mask"])
+        self.tokenizer = AutoTokenizer.from_pretrained(out_dir)
+        self.session = _onnx_session(path, threads)
+
+    def encode(self, texts: Sequence[str], normalize_embeddings: bool = True, batch_size: int = 32, **_: Any) -> Any:
+        import numpy as np
+        outs = []
+        for i in range(0, len(texts), max(1, batch_size)):
+            enc = self.tokenizer(list(texts[i:i + batch_size]), padding=True, truncation=True,
+                                 max_length=self.max_seq_length, return_tensors="np")
+            feeds = {k: enc[k].astype(np.int64) for k in self.input_names if k in enc}
+            hidden = self.session.run(None, feeds)[0]
+            mask = enc["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if normalize_embeddings:
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            outs.append(pooled.astype(np.float32))
+        dim = outs[0].shape[1] if outs else 0
+        return np.vstack(outs) if outs else np.zeros((0, dim), dtype=np.float32)
+
+
+class OnnxCrossEncoder:
+    def __init__(self, model_name: str, *, cache_dir: str, threads: int = 0, quantize: bool = False) -> None:
+        from transformers import AutoTokenizer
+        out_dir = _artefact_dir(cache_dir, model_name, "rerank-onnx")
+        path = os.path.join(out_dir, "model.onnx")
+        if not os.path.exists(path):
+            from sentence_transformers import CrossEncoder
+            ce = CrossEncoder(model_name, device="cpu")
+            path = _export(ce.model, ce.tokenizer, out_dir, "logits",
+                           {"max_length": int(ce.max_length or 512), "num_labels": int(ce.config.num_labels)})
+        with open(os.path.join(out_dir, "export.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if quantize:
+            path = _quantized_copy(path)
+        self.max_length = int(meta.get("max_length") or 512)
+        self.num_labels = int(meta.get("num_labels") or 1)
+        self.input_names: List[str] = list(meta.get("input_names") or ["input_ids", "attention_mask"])
+        self.tokenizer = AutoTokenizer.from_pretrained(out_dir)
+        self.session = _onnx_session(path, threads)
+
+    def predict(self, pairs: Sequence[Tuple[str, str]], batch_size: int = 32, **_: Any) -> Any:
+        import numpy as np
+        scores = []
+        for i in range(0, len(pairs), max(1, batch_size)):
+            batch = pairs[i:i + batch_size]
+            enc = self.tokenizer([p[0] for p in batch], [p[1] for p in batch], padding=True, truncation=True,
+                                 max_length=self.max_length, return_tensors="np")
+            feeds = {k: enc[k].astype(np.int64) for k in self.input_names if k in enc}
+            logits = self.session.run(None, feeds)[0]
+            if self.num_labels == 1:
+                # CrossEncoder's default activation for single-label models
+                scores.append(1.0 / (1.0 + np.exp(-logits[:, 0])))
+            else:
+                scores.append(logits)
+        return np.concatenate(scores) if scores else np.zeros((0,), dtype=np.float32)
+
+
+def _quantize_torch(module: Any) -> Any:
+    import torch
+    return torch.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_embedder(model_name: str, *, backend: str = "torch", cache_dir: str, threads: int = 0) -> Any:
+    """The embedder carries `backend_label`: the backend actually loaded, which differs
+    from `backend` when the ONNX export fails and torch is used instead."""
+    backend = (backend or "torch").lower()
+    configure_threads(threads)
+    if backend in ("onnx", "onnx-int8"):
+        try:
+            model = OnnxEmbedder(model_name, cache_dir=cache_dir, threads=threads, quantize=backend == "onnx-int8")
+            model.backend_label = backend
+            return model
+        except Exception as e:
+            logging.getLogger("rag").warning("[RAG] ONNX embedder unavailable (%s); falling back to torch", e)
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(model_name, device="cpu" if backend != "torch" else None)
+    if backend == "torch-int8":
+        model = _quantize_torch(model)
+    model.backend_label = "torch-int8" if backend == "torch-int8" else "torch"
+    return model
+
+
+def load_cross_encoder(model_name: str, *, backend: str = "torch", cache_dir: str, threads: int = 0) -> Any:
+    backend = (backend or "torch").lower()
+    configure_threads(threads)
+    if backend in ("onnx", "onnx-int8"):
+        try:
+            return OnnxCrossEncoder(model_name, cache_dir=cache_dir, threads=threads, quantize=backend == "onnx-int8")
+        except Exception as e:
+            logging.getLogger("rag").warning("[RAG] ONNX cross-encoder unavailable (%s); falling back to torch", e)
+    from sentence_transformers import CrossEncoder
+    ce = CrossEncoder(model_name, device="cpu" if backend != "torch" else None)
+    if backend == "torch-int8":
+        ce.model = _quantize_torch(ce.model)
+    return ce
+
+
+def backend_label(backend: Optional[str]) -> str:
+    b = (backend or "torch").lower()
+    if b not in INFERENCE_BACKENDS:
+        raise ValueError(f"Unsupported inference_backend '{backend}' (expected one of {', '.join(INFERENCE_BACKENDS)})")
+    return b
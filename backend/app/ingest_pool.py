@@ -0,0 +1,237 @@
+"""
+Process pool for the CPU-bound ingestion stages: text extraction, sentence splitting,
+keyword extraction (`analyze_file`) and local-model embedding.
+
+These are pure Python / model code that hold the GIL, so running them on threads of
+the API process stalls every request handled by the same uvicorn worker. One pool is
+shared by everything in the process (index queue workers, uploads, PDF page ranges
+from pdf_extract.py) and sized by `ingest_workers`. Workers are spawned (forking a
+process that runs uvicorn/model threads is not safe), run at a lower CPU priority,
+can be capped with RLIMIT_AS (`ingest_memory_limit_mb`) and are recycled after
+`ingest_max_tasks_per_child` tasks so leaked parser/model memory is returned.
+
+Tasks write progress straight into `job_store` (SQLite, shared across processes) and
+return plain picklable results (chunks of a whole file go through a spool file, large
+PDFs are split window by window); the caller stores chunks and vectors itself, since
+the vector stores are not safe to write from several processes.
+"""
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .metrics import Histogram, LATENCY_MS_BUCKETS
+
+_lock = threading.Lock()
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_config: Optional[Tuple[int, int, int]] = None
+_config: Tuple[int, int, int] = (0, 100, 0)  # (workers, max_tasks_per_child, memory_limit_mb)
+_IN_WORKER = False
+
+_task_ms = Histogram(LATENCY_MS_BUCKETS + (30_000, 60_000, 300_000))
+_outcomes: Dict[str, int] = {"ok": 0, "error": 0, "broken": 0}
+
+
+def resolve_workers(workers: int) -> int:
+    """0 = one less than the CPU count, capped at 4."""
+    if workers and workers > 0:
+        return int(workers)
+    return max(1, min(4, (os.cpu_count() or 2) - 1))
+
+
+def configure(*, workers: int = 0, max_tasks_per_child: int = 100, memory_limit_mb: int = 0) -> None:
+    """Set the pool shape; a running pool with another shape is replaced on next use."""
+    global _config
+    with _lock:
+        _config = (resolve_workers(workers), max(0, int(max_tasks_per_child)), max(0, int(memory_limit_mb)))
+
+
+def size() -> int:
+    return _config[0]
+
+
+def in_worker() -> bool:
+    """True inside a pool worker (where nested pools must not be started)."""
+    return _IN_WORKER
+
+
+def _init_worker(memory_limit_mb: int) -> None:
+    global _IN_WORKER
+    _IN_WORKER = True
+    try:
+        # leave the CPU to the API process when both are busy
+        os.nice(5)
+    except (AttributeError, OSError):
+        pass
+    if memory_limit_mb > 0:
+        try:
+            import resource
+            limit = memory_limit_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ImportError, ValueError, OSError) as e:
+            logging.getLogger("rag").warning("[RAG] Ingest worker memory limit not applied: %s", e)
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool, _pool_config
+    with _lock:
+        if _pool is None or _pool_config != _config:
+            if _pool is not None:
+                # tasks already running on the old pool finish; nothing new is sent to it
+                _pool.shutdown(wait=False)
+            workers, max_tasks, memory_mb = _config
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(memory_mb,),
+                max_tasks_per_child=max_tasks or None,
+            )
+            _pool_config = _config
+            logging.getLogger("rag").info("[RAG] Ingest pool started workers=%d max_tasks_per_child=%s memory_limit_mb=%s",
+                                          workers, max_tasks or "unlimited", memory_mb or "unlimited")
+        return _pool
+
+
+def reset(pool: Optional[ProcessPoolExecutor] = None) -> None:
+    """Drop a broken pool (only if it is still `pool`, when given); the next use starts a fresh one."""
+    global _pool
+    with _lock:
+        if _pool is not None and (pool is None or pool is _pool):
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def shutdown() -> None:
+    reset()
+
+
+def submit(fn: Callable[..., Any], *args: Any) -> Future:
+    return get_pool().submit(fn, *args)
+
+
+def run(fn: Callable[..., Any], *args: Any) -> Any:
+    """Run `fn(*args)` in the pool and wait for the result (call from a thread, not the event loop).
+    A worker that died (crash, memory limit) raises RuntimeError and the pool is replaced."""
+    pool = get_pool()
+    t0 = time.perf_counter()
+    try:
+        result = pool.submit(fn, *args).result()
+    except BrokenProcessPool as e:
+        _outcomes["broken"] += 1
+        reset(pool)
+        raise RuntimeError(f"ingest worker died running {fn.__name__} (memory limit?): {e}") from e
+    except Exception:
+        _outcomes["error"] += 1
+        raise
+    finally:
+        _task_ms.observe((time.perf_counter() - t0) * 1000.0)
+    _outcomes["ok"] += 1
+    return result
+
+
+def stats() -> Dict[str, Any]:
+    workers, max_tasks, memory_mb = _config
+    return {
+        "running": _pool is not None,
+        "workers": workers,
+        "max_tasks_per_child": max_tasks,
+        "memory_limit_mb": memory_mb,
+        "outcomes": dict(_outcomes),
+        "task_ms": _task_ms.snapshot(),
+    }
+
+
+# -------- Worker tasks (module-level so they pickle by reference) --------
+_engines: Dict[str, Any] = {}
+
+
+def _worker_engine(settings_json: str) -> Any:
+    """Store-less engine for the worker's settings, kept for the life of the worker so
+    the embedding model loads once per process."""
+    engine = _engines.get(settings_json)
+    if engine is None:
+        from .rag import RAGEngine, RAGSettings
+        engine = RAGEngine.for_worker(RAGSettings.model_validate_json(settings_json))
+        _engines[settings_json] = engine
+    return engine
+
+
+def split_document(settings_json: str, document_id: str, file_bytes: bytes, file_name: str, out_path: str) -> Tuple[int, int]:
+    """Extract and split a file, streaming the chunks to `out_path` as JSON lines
+    ([chunk, start_page, end_page]) so neither side holds the whole document's chunks.
+    Returns (page count, chunk count)."""
+    from .rag_jobs import job_store
+    engine = _worker_engine(settings_json)
+    total, pages = engine._open_pages(file_bytes=file_bytes, file_name=file_name)
+    done = [0]
+    last = [time.monotonic()]
+
+    def counted() -> Any:
+        for item in pages:
+            yield item
+            done[0] += 1
+            if time.monotonic() - last[0] >= 1.0:
+                last[0] = time.monotonic()
+                try:
+                    job_store.update(document_id, stage="chunking", progress=10 + (25 * done[0]) // max(1, total),
+                                     message=f"Đang trích xuất nội dung (trang {done[0]}/{total})")
+                except Exception:
+                    pass
+
+    n = 0
+    tmp = out_path + ".tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8") as f:
+            for chunk in engine._split_pages(counted()):
+                f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+                n += 1
+        os.replace(tmp, out_path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return total, n
+
+
+def read_chunk_spool(path: str) -> Iterator[Tuple[str, Optional[int], Optional[int]]]:
+    """Chunks written by `split_document`, read lazily; the file is removed once consumed."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                chunk, page, page_end = json.loads(line)
+                yield chunk, page, page_end
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def split_window(splitter: Any, pages: List[Tuple[Optional[int], str]], final: bool
+                 ) -> Tuple[List[Tuple[str, Optional[int], Optional[int]]], Any]:
+    """Split one window of pages, continuing from `splitter` (a rag._Splitter); returns the
+    finished chunks and the state to pass with the next window."""
+    chunks = list(splitter.feed(pages))
+    if final:
+        chunks.extend(splitter.finish())
+    return chunks, splitter
+
+
+def analyze_file(settings_json: str, file_bytes: bytes, file_name: str) -> Dict[str, Any]:
+    return _worker_engine(settings_json).analyze_file(file_bytes=file_bytes, file_name=file_name)
+
+
+def embed_local(settings_json: str, texts: List[str]) -> List[List[float]]:
+    return _worker_engine(settings_json)._embed_uncached(texts)
+
+
+def embed_backend(settings_json: str) -> str:
+    return _worker_engine(settings_json)._loaded_backend()
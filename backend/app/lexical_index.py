@@ -0,0 +1,214 @@
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def fold_accents(s: str) -> str:
+    """Strip Vietnamese diacritics so 'quyết định' also matches 'quyet dinh'."""
+    s = s.replace("đ", "d").replace("Đ", "D")
+    return "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
+
+
+def tokenize(text: str) -> List[str]:
+    """Vietnamese-aware terms: syllables, syllable bigrams (multi-syllable words such as
+    'quyết_định'), plus accent-folded variants of both for queries typed without diacritics.
+    Codes and numbers ('it3040', '123') stay whole syllables."""
+    s = unicodedata.normalize("NFC", text or "").lower()
+    sylls = [w for w in _WORD_RE.findall(s) if w != "_"]
+    terms: List[str] = list(sylls)
+    terms.extend(f"{a}_{b}" for a, b in zip(sylls, sylls[1:]))
+    folded = [fold_accents(t) for t in terms]
+    terms.extend(f for f, t in zip(folded, terms) if f != t)
+    return terms
+
+
+class LexicalIndex:
+    """
+    Incrementally maintained BM25 inverted index over chunk texts, persisted in SQLite
+    next to the vector store. Chunks carry their metadata so lexical hits can be
+    filtered and cited like vector hits.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._stats: Optional[Tuple[int, float]] = None
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("pragma journal_mode=wal")
+        self._conn.execute("pragma synchronous=normal")
+        self._conn.executescript(
+            """
+            create table if not exists chunks (
+              chunk_id text primary key,
+              document_id text,
+              subject_id text,
+              length int not null,
+              text text not null,
+              meta text
+            );
+            create index if not exists idx_chunks_document on chunks(document_id);
+            create table if not exists postings (
+              term text not null,
+              chunk_id text not null,
+              tf int not null,
+              primary key (term, chunk_id)
+            ) without rowid;
+            create index if not exists idx_postings_chunk on postings(chunk_id);
+            """
+        )
+        self._conn.commit()
+
+    # -------- Updates --------
+    def add(self, chunk_ids: Sequence[str], texts: Sequence[str], metadatas: Sequence[Dict[str, Any]]) -> None:
+        rows = []
+        postings = []
+        for cid, text, meta in zip(chunk_ids, texts, metadatas):
+            counts = Counter(tokenize(text))
+            rows.append((
+                str(cid),
+                str((meta or {}).get("document_id") or ""),
+                str((meta or {}).get("subject_id") or ""),
+                sum(counts.values()),
+                text,
+                json.dumps(meta or {}, ensure_ascii=False, default=str),
+            ))
+            postings.extend((term, str(cid), tf) for term, tf in counts.items())
+        with self._lock:
+            self._conn.executemany("delete from postings where chunk_id=?", [(r[0],) for r in rows])
+            self._conn.executemany("insert or replace into chunks(chunk_id, document_id, subject_id, length, text, meta) values (?,?,?,?,?,?)", rows)
+            self._conn.executemany("insert or replace into postings(term, chunk_id, tf) values (?,?,?)", postings)
+            self._conn.commit()
+            self._stats = None
+
+    def remove_document(self, document_id: str, keep_ids: Iterable[str] = ()) -> int:
+        """Drop a document's chunks, except `keep_ids` (the freshly indexed ones)."""
+        keep = {str(k) for k in keep_ids}
+        with self._lock:
+            ids = [r[0] for r in self._conn.execute("select chunk_id from chunks where document_id=?", (str(document_id),)) if r[0] not in keep]
+            self._delete_locked(ids)
+        return len(ids)
+
+    def remove_ids(self, chunk_ids: Iterable[str]) -> None:
+        with self._lock:
+            self._delete_locked([str(c) for c in chunk_ids])
+
+    def update_document_metadata(self, document_id: str, fields: Dict[str, Any]) -> None:
+        """Merge `fields` into the stored metadata of every chunk of a document."""
+        with self._lock:
+            rows = self._conn.execute("select chunk_id, meta from chunks where document_id=?", (str(document_id),)).fetchall()
+            updates = []
+            for cid, meta in rows:
+                m = json.loads(meta or "{}")
+                m.update(fields)
+                updates.append((json.dumps(m, ensure_ascii=False, default=str), cid))
+            self._conn.executemany("update chunks set meta=? where chunk_id=?", updates)
+            self._conn.commit()
+
+    def update_chunk_metadata(self, updates: Dict[str, Dict[str, Any]]) -> None:
+        """Merge per-chunk fields (chunk id -> fields) into stored metadata."""
+        with self._lock:
+            ids = list(updates)
+            changes = []
+            for i in range(0, len(ids), 500):
+                part = ids[i:i + 500]
+                for cid, meta in self._conn.execute(f"select chunk_id, meta from chunks where chunk_id in ({','.join('?' * len(part))})", part):
+                    m = json.loads(meta or "{}")
+                    m.update(updates[cid])
+                    changes.append((json.dumps(m, ensure_ascii=False, default=str), cid))
+            self._conn.executemany("update chunks set meta=? where chunk_id=?", changes)
+            self._conn.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("delete from postings")
+            self._conn.execute("delete from chunks")
+            self._conn.commit()
+            self._stats = None
+
+    def _delete_locked(self, ids: List[str]) -> None:
+        if not ids:
+            return
+        self._conn.executemany("delete from postings where chunk_id=?", [(i,) for i in ids])
+        self._conn.executemany("delete from chunks where chunk_id=?", [(i,) for i in ids])
+        self._conn.commit()
+        self._stats = None
+
+    # -------- Search --------
+    def _corpus_stats(self) -> Tuple[int, float]:
+        if self._stats is None:
+            n, avg = self._conn.execute("select count(*), avg(length) from chunks").fetchone()
+            self._stats = (int(n or 0), float(avg or 0.0))
+        return self._stats
+
+    def search(self, query: str, *, limit: int = 20, subject_ids: Optional[Sequence[str]] = None,
+               k1: float = 1.2, b: float = 0.75, max_df_ratio: float = 0.3) -> List[Dict[str, Any]]:
+        """BM25 top-`limit` chunks. On larger corpora, terms occurring in more than
+        `max_df_ratio` of the chunks carry almost no weight and are skipped to keep
+        posting scans short."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        with self._lock:
+            n, avgdl = self._corpus_stats()
+            if n == 0:
+                return []
+            marks = ",".join("?" * len(terms))
+            dfs = dict(self._conn.execute(f"select term, count(*) from postings where term in ({marks}) group by term", terms).fetchall())
+            use = [t for t in terms if t in dfs]
+            if n >= 1000:
+                use = [t for t in use if dfs[t] <= max_df_ratio * n] or use
+            if not use:
+                return []
+            sql = (
+                "select p.chunk_id, p.term, p.tf, c.length from postings p join chunks c on c.chunk_id = p.chunk_id "
+                f"where p.term in ({','.join('?' * len(use))})"
+            )
+            params: List[Any] = list(use)
+            if subject_ids:
+                sql += f" and c.subject_id in ({','.join('?' * len(subject_ids))})"
+                params.extend(str(s) for s in subject_ids)
+            scores: Dict[str, float] = {}
+            for cid, term, tf, length in self._conn.execute(sql, params):
+                df = dfs[term]
+                idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                denom = tf + k1 * (1 - b + b * (length / avgdl if avgdl else 1.0))
+                scores[cid] = scores.get(cid, 0.0) + idf * tf * (k1 + 1) / denom
+            top = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:max(1, limit)]
+            if not top:
+                return []
+            ids = [cid for cid, _ in top]
+            rows = {r[0]: r for r in self._conn.execute(
+                f"select chunk_id, text, meta from chunks where chunk_id in ({','.join('?' * len(ids))})", ids)}
+        out: List[Dict[str, Any]] = []
+        for cid, score in top:
+            r = rows.get(cid)
+            if r is None:
+                continue
+            try:
+                meta = json.loads(r[2] or "{}")
+            except ValueError:
+                meta = {}
+            out.append({"id": cid, "text": r[1], "metadata": meta, "lexical_score": round(score, 4)})
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            n, avgdl = self._corpus_stats()
+        return {"path": self.path, "chunks": n, "avg_length": round(avgdl, 1)}
+
+
+def reciprocal_rank_fusion(ranked_lists: Sequence[Sequence[str]], k: int = 60) -> Dict[str, float]:
+    """RRF: score(d) = sum over lists of 1 / (k + rank)."""
+    fused: Dict[str, float] = {}
+    for ranking in ranked_lists:
+        for rank, key in enumerate(ranking, start=1):
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank)
+    return fused
@@ -0,0 +1,188 @@
+"""
+Long-lived clients for the LLM and embedding providers (OpenAI, Gemini, Ollama).
+
+Building `OpenAI(...)` per call or calling `genai.configure` every time throws the
+connection pool away, so each request paid a fresh TCP + TLS handshake. Clients here
+are created once per provider, API key and base URL and keep their HTTP connections
+alive, with pool limits from RAGSettings (`configure`, called by RAGEngine). HTTP/2
+is negotiated when the optional `h2` package is installed.
+
+Async clients are additionally kept per event loop: an httpx.AsyncClient (and the
+Gemini/Ollama async clients built on it or on grpc.aio) is bound to the loop it first
+ran on.
+"""
+import asyncio
+import importlib.util
+import logging
+import threading
+import weakref
+from typing import Any, Dict, Optional, Tuple
+
+_lock = threading.Lock()
+_limits: Dict[str, Any] = {
+    "max_connections": 100,
+    "max_keepalive": 20,
+    "keepalive_expiry": 30.0,
+    "http2": True,
+    "timeout": 60.0,
+}
+_sync: Dict[Tuple[Any, ...], Any] = {}
+_async: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple[Any, ...], Any]]" = weakref.WeakKeyDictionary()
+_gemini_key: Optional[str] = None
+_created: Dict[str, int] = {}
+
+
+def configure(*, max_connections: int = 100, max_keepalive: int = 20, keepalive_expiry: float = 30.0,
+              http2: bool = True, timeout: float = 60.0) -> None:
+    """Pool settings for clients created from now on (existing clients keep theirs)."""
+    with _lock:
+        _limits.update(max_connections=max(1, int(max_connections)), max_keepalive=max(0, int(max_keepalive)),
+                       keepalive_expiry=float(keepalive_expiry), http2=bool(http2), timeout=float(timeout))
+
+
+def http2_enabled() -> bool:
+    return bool(_limits["http2"]) and importlib.util.find_spec("h2") is not None
+
+
+def _httpx_kwargs() -> Dict[str, Any]:
+    import httpx
+    return {
+        "limits": httpx.Limits(max_connections=_limits["max_connections"],
+                               max_keepalive_connections=_limits["max_keepalive"],
+                               keepalive_expiry=_limits["keepalive_expiry"]),
+        "timeout": httpx.Timeout(_limits["timeout"], connect=10.0),
+        "http2": http2_enabled(),
+    }
+
+
+def _key(kind: str, *parts: Any) -> Tuple[Any, ...]:
+    # pool settings are part of the key so a settings reload takes effect for new clients
+    return (kind, *parts, tuple(sorted(_limits.items())))
+
+
+def _get_sync(key: Tuple[Any, ...], factory: Any) -> Any:
+    with _lock:
+        client = _sync.get(key)
+        if client is None:
+            client = factory()
+            _sync[key] = client
+            _created[key[0]] = _created.get(key[0], 0) + 1
+        return client
+
+
+def _get_async(key: Tuple[Any, ...], factory: Any) -> Any:
+    loop = asyncio.get_running_loop()
+    with _lock:
+        per_loop = _async.setdefault(loop, {})
+        client = per_loop.get(key)
+        if client is None:
+            client = factory()
+            per_loop[key] = client
+            _created[key[0]] = _created.get(key[0], 0) + 1
+        return client
+
+
+# -------- Plain HTTP --------
+def http_client() -> Any:
+    """Shared keep-alive httpx.Client (Gemini REST embeddings)."""
+    import httpx
+    return _get_sync(_key("http"), lambda: httpx.Client(**_httpx_kwargs()))
+
+
+def async_http_client() -> Any:
+    """Shared keep-alive httpx.AsyncClient for the running loop (web search)."""
+    import httpx
+    return _get_async(_key("async_http"), lambda: httpx.AsyncClient(**_httpx_kwargs()))
+
+
+# -------- OpenAI --------
+def openai_client(api_key: Optional[str], base_url: Optional[str] = None) -> Any:
+    from openai import DefaultHttpxClient, OpenAI
+    return _get_sync(_key("openai", api_key, base_url),
+                     lambda: OpenAI(api_key=api_key, base_url=base_url, http_client=DefaultHttpxClient(**_httpx_kwargs())))
+
+
+def async_openai_client(api_key: Optional[str], base_url: Optional[str] = None) -> Any:
+    from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+    return _get_async(_key("async_openai", api_key, base_url),
+                      lambda: AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=DefaultAsyncHttpxClient(**_httpx_kwargs())))
+
+
+# -------- Gemini --------
+def _configure_gemini(api_key: str) -> Any:
+    global _gemini_key
+    import google.generativeai as genai
+    # genai keeps one process-wide configuration: only switch it when the key changes
+    with _lock:
+        if _gemini_key != api_key:
+            if _gemini_key is not None:
+                logging.getLogger("rag").warning("[RAG] Gemini API key changed; reconfiguring the shared client")
+            genai.configure(api_key=api_key)
+            _gemini_key = api_key
+    return genai
+
+
+def gemini_model(api_key: str, model: str) -> Any:
+    genai = _configure_gemini(api_key)
+    return _get_sync(("gemini", api_key, model), lambda: genai.GenerativeModel(model))
+
+
+def async_gemini_model(api_key: str, model: str) -> Any:
+    """Model for `generate_content_async` on the running loop (its grpc.aio channel is loop-bound)."""
+    genai = _configure_gemini(api_key)
+    return _get_async(("async_gemini", api_key, model), lambda: genai.GenerativeModel(model))
+
+
+# -------- Ollama --------
+def ollama_client() -> Any:
+    import ollama  # type: ignore
+    # host defaults to OLLAMA_HOST / localhost inside the library
+    return _get_sync(_key("ollama"), lambda: ollama.Client(limits=_httpx_kwargs()["limits"]))
+
+
+def async_ollama_client() -> Any:
+    import ollama  # type: ignore
+    return _get_async(_key("async_ollama"), lambda: ollama.AsyncClient(limits=_httpx_kwargs()["limits"]))
+
+
+# -------- Lifecycle / diagnostics --------
+def close() -> None:
+    """Close the sync clients (app shutdown); async ones are closed by `aclose` on their loop."""
+    with _lock:
+        clients = list(_sync.values())
+        _sync.clear()
+    for client in clients:
+        try:
+            close_fn = getattr(client, "close", None) or getattr(getattr(client, "_client", None), "close", None)
+            if close_fn is not None:
+                close_fn()
+        except Exception:
+            pass
+
+
+async def aclose() -> None:
+    """Close the async clients created on the running loop."""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        clients = list(_async.pop(loop, {}).values())
+    for client in clients:
+        try:
+            close_fn = getattr(client, "aclose", None) or getattr(client, "close", None) \
+                or getattr(getattr(client, "_client", None), "aclose", None)
+            if close_fn is not None:
+                res = close_fn()
+                if asyncio.iscoroutine(res):
+                    await res
+        except Exception:
+            pass
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        return {
+            "http2": http2_enabled(),
+            "limits": dict(_limits),
+            "sync_clients": len(_sync),
+            "async_clients": sum(len(v) for v in _async.values()),
+            "created": dict(_created),
+        }
@@ -0,0 +1,331 @@
+"""
+In-process vector store for single-node deployments and tests (store_backend=local).
+
+Layout under `<dir>`:
+- vectors.f32 / vectors.f16: row-major matrix of L2-normalized vectors, memory-mapped
+- columns.i32: per-row (document, subject, user) codes used for filtering, memory-mapped
+- alive.u8: tombstones (0 = deleted), memory-mapped read/write
+- meta.sqlite3: chunk id -> row slot, chunk text/metadata, and the string vocab for codes
+
+Search is exact: one matrix-vector product over the mapped matrix (blockwise for
+float16, which halves the file but scans slower on NumPy < 2) plus argpartition, so recall is 100% and opening a store costs no index
+build. Deleted rows are tombstoned and reclaimed by `compact()` once they exceed
+a third of the file.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+_DTYPES = {"float32": np.float32, "float16": np.float16}
+_COLS = ("document_id", "subject_id", "user_id")
+_BLOCK = 16_384
+
+
+class LocalVectorStore:
+    def __init__(self, path: str, precision: str = "float32") -> None:
+        if precision not in _DTYPES:
+            raise ValueError(f"LocalVectorStore supports float32/float16, got '{precision}'")
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.RLock()
+        self._generation = 0  # bumped by compact(); slots from an older generation are stale
+        self._conn = sqlite3.connect(os.path.join(path, "meta.sqlite3"), check_same_thread=False, timeout=30)
+        self._conn.execute("pragma journal_mode=wal")
+        self._conn.execute("pragma synchronous=normal")
+        self._conn.executescript(
+            """
+            create table if not exists info (key text primary key, value text);
+            create table if not exists chunks (
+              chunk_id text primary key,
+              slot int not null,
+              document_id text,
+              chunk_index int,
+              text text not null,
+              meta text
+            );
+            create index if not exists idx_chunks_slot on chunks(slot);
+            create index if not exists idx_chunks_document on chunks(document_id, chunk_index);
+            create table if not exists vocab (kind text, value text, code int, primary key (kind, value));
+            """
+        )
+        info = dict(self._conn.execute("select key, value from info").fetchall())
+        # an existing store keeps its on-disk precision
+        self.precision = info.get("precision") or precision
+        if "precision" not in info:
+            self._conn.execute("insert into info(key, value) values ('precision', ?)", (self.precision,))
+        self._conn.commit()
+        if self.precision != precision:
+            logging.getLogger("rag").warning("[RAG] Local store %s keeps precision=%s (requested %s)", path, self.precision, precision)
+        self.dtype = _DTYPES[self.precision]
+        self.dim = int(info["dim"]) if info.get("dim") else 0
+        self._vocab: Dict[str, Dict[str, int]] = {k: {} for k in _COLS}
+        for kind, value, code in self._conn.execute("select kind, value, code from vocab"):
+            self._vocab[kind][value] = int(code)
+        self._remap()
+
+    # -------- Files --------
+    def _file(self, name: str) -> str:
+        ext = "f16" if self.precision == "float16" else "f32"
+        return os.path.join(self.path, name.replace("{ext}", ext))
+
+    def _rows_on_disk(self) -> int:
+        try:
+            return os.path.getsize(self._file("alive.u8"))
+        except OSError:
+            return 0
+
+    def _remap(self) -> None:
+        n = self._rows_on_disk()
+        self.n = n
+        if n == 0 or self.dim == 0:
+            self._vectors = np.zeros((0, self.dim), dtype=self.dtype)
+            self._columns = np.zeros((0, len(_COLS)), dtype=np.int32)
+            self._alive = np.zeros((0,), dtype=np.uint8)
+            return
+        self._vectors = np.memmap(self._file("vectors.{ext}"), dtype=self.dtype, mode="r", shape=(n, self.dim))
+        self._columns = np.memmap(self._file("columns.i32"), dtype=np.int32, mode="r", shape=(n, len(_COLS)))
+        self._alive = np.memmap(self._file("alive.u8"), dtype=np.uint8, mode="r+", shape=(n,))
+
+    def _code(self, kind: str, value: Any) -> int:
+        v = "" if value is None else str(value)
+        code = self._vocab[kind].get(v)
+        if code is None:
+            code = len(self._vocab[kind])
+            self._vocab[kind][v] = code
+            self._conn.execute("insert into vocab(kind, value, code) values (?,?,?)", (kind, v, code))
+        return code
+
+    # -------- Writes --------
+    def add(self, *, ids: Sequence[str], documents: Sequence[str], metadatas: Sequence[Dict[str, Any]],
+            embeddings: Sequence[Sequence[float]], chunk_indexes: Optional[Sequence[int]] = None) -> None:
+        if not ids:
+            return
+        vecs = np.asarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+        vecs = vecs / np.clip(norms, 1e-12, None)
+        with self._lock:
+            if self.dim == 0:
+                self.dim = int(vecs.shape[1])
+                self._conn.execute("insert or replace into info(key, value) values ('dim', ?)", (str(self.dim),))
+            elif vecs.shape[1] != self.dim:
+                raise ValueError(f"Embedding dim {vecs.shape[1]} does not match local store dim {self.dim}")
+            # Re-adding an id replaces it
+            self._tombstone_locked([str(i) for i in ids])
+            start = self.n
+            # drop any partial rows left by an interrupted append
+            for name, width in (("vectors.{ext}", self.dim * np.dtype(self.dtype).itemsize), ("columns.i32", 4 * len(_COLS))):
+                if os.path.exists(self._file(name)) and os.path.getsize(self._file(name)) != start * width:
+                    os.truncate(self._file(name), start * width)
+            cols = np.asarray([[self._code(k, (m or {}).get(k)) for k in _COLS] for m in metadatas], dtype=np.int32)
+            with open(self._file("vectors.{ext}"), "ab") as f:
+                f.write(vecs.astype(self.dtype).tobytes())
+            with open(self._file("columns.i32"), "ab") as f:
+                f.write(cols.tobytes())
+            # alive.u8 is written last: its size defines the committed row count
+            with open(self._file("alive.u8"), "ab") as f:
+                f.write(b"\x01" * len(ids))
+            rows = []
+            for j, (cid, text, meta) in enumerate(zip(ids, documents, metadatas)):
+                idx = chunk_indexes[j] if chunk_indexes is not None else j
+                rows.append((str(cid), start + j, str((meta or {}).get("document_id") or ""), int(idx), text,
+                             json.dumps(meta or {}, ensure_ascii=False, default=str)))
+            self._conn.executemany(
+                "insert or replace into chunks(chunk_id, slot, document_id, chunk_index, text, meta) values (?,?,?,?,?,?)", rows)
+            self._conn.commit()
+            self._remap()
+
+    def _tombstone_locked(self, ids: List[str]) -> int:
+        slots: List[int] = []
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            marks = ",".join("?" * len(part))
+            slots.extend(r[0] for r in self._conn.execute(f"select slot from chunks where chunk_id in ({marks})", part))
+            self._conn.execute(f"delete from chunks where chunk_id in ({marks})", part)
+        if slots:
+            self._alive[np.asarray(slots, dtype=np.int64)] = 0
+            self._alive.flush()
+        return len(slots)
+
+    def delete_ids(self, ids: Sequence[Any]) -> None:
+        with self._lock:
+            self._tombstone_locked([str(i) for i in ids])
+            self._conn.commit()
+            self._maybe_compact_locked()
+
+    def delete_document(self, document_id: str) -> None:
+        with self._lock:
+            ids = [r[0] for r in self._conn.execute("select chunk_id from chunks where document_id=?", (str(document_id),))]
+            self._tombstone_locked(ids)
+            self._conn.commit()
+            self._maybe_compact_locked()
+
+    def update_document_metadata(self, document_id: str, fields: Dict[str, Any]) -> None:
+        """Merge `fields` into the stored metadata of every chunk of a document."""
+        with self._lock:
+            rows = self._conn.execute("select chunk_id, meta from chunks where document_id=?", (str(document_id),)).fetchall()
+            updates = []
+            for cid, meta in rows:
+                m = json.loads(meta or "{}")
+                m.update(fields)
+                updates.append((json.dumps(m, ensure_ascii=False, default=str), cid))
+            self._conn.executemany("update chunks set meta=? where chunk_id=?", updates)
+            self._conn.commit()
+
+    def update_chunk_metadata(self, updates: Dict[str, Dict[str, Any]]) -> None:
+        """Merge per-chunk fields into stored metadata (chunk_index also moves the row order)."""
+        with self._lock:
+            ids = list(updates)
+            rows = []
+            for i in range(0, len(ids), 500):
+                part = ids[i:i + 500]
+                rows.extend(self._conn.execute(f"select chunk_id, chunk_index, meta from chunks where chunk_id in ({','.join('?' * len(part))})", part))
+            changes = []
+            for cid, idx, meta in rows:
+                m = json.loads(meta or "{}")
+                m.update(updates[cid])
+                changes.append((int(m.get("chunk_index", idx)), json.dumps(m, ensure_ascii=False, default=str), cid))
+            self._conn.executemany("update chunks set chunk_index=?, meta=? where chunk_id=?", changes)
+            self._conn.commit()
+
+    def _maybe_compact_locked(self) -> None:
+        dead = int(self.n - int(self._alive.sum())) if self.n else 0
+        if self.n >= 1000 and dead * 3 > self.n:
+            self.compact()
+
+    def compact(self) -> None:
+        """Rewrite the mapped files without tombstoned rows and renumber slots."""
+        with self._lock:
+            if self.n == 0:
+                return
+            keep = np.flatnonzero(np.asarray(self._alive) == 1)
+            new_slot = {int(old): new for new, old in enumerate(keep)}
+            for name, arr in (("vectors.{ext}", self._vectors), ("columns.i32", self._columns), ("alive.u8", self._alive)):
+                tmp = self._file(name) + ".tmp"
+                with open(tmp, "wb") as f:
+                    for i in range(0, len(keep), _BLOCK):
+                        f.write(np.ascontiguousarray(arr[keep[i:i + _BLOCK]]).tobytes())
+            old_slots = [r[0] for r in self._conn.execute("select slot from chunks")]
+            self._conn.executemany("update chunks set slot=? where slot=?", [(new_slot[s], s) for s in sorted(old_slots) if s in new_slot])
+            # drop the maps before replacing the files underneath them
+            self._vectors = self._columns = self._alive = None  # type: ignore[assignment]
+            for name in ("vectors.{ext}", "columns.i32", "alive.u8"):
+                os.replace(self._file(name) + ".tmp", self._file(name))
+            self._conn.commit()
+            self._generation += 1
+            self._remap()
+            logging.getLogger("rag").info("[RAG] Local store compacted rows=%d", self.n)
+
+    # -------- Reads --------
+    def query(self, *, query_embedding: Sequence[float], top_k: int, subject_ids: Optional[Sequence[str]] = None,
+              user_id: Optional[str] = None, predicate: Optional[Callable[[Dict[str, Any]], bool]] = None) -> List[Dict[str, Any]]:
+        """Exact cosine top-k. Subject/user filters use the mapped columns; `predicate`
+        filters the remaining metadata on candidates in score order."""
+        with self._lock:
+            n, vectors, columns, alive = self.n, self._vectors, self._columns, self._alive
+            generation = self._generation
+        if n == 0 or top_k <= 0:
+            return []
+        q = np.asarray(query_embedding, dtype=np.float32)
+        q = q / max(float(np.linalg.norm(q)), 1e-12)
+        if self.dtype == np.float32:
+            scores = vectors @ q
+        else:
+            # widen cache-sized blocks into one reused buffer (float16 matmul has no BLAS path)
+            scores = np.empty(n, dtype=np.float32)
+            buf = np.empty((min(n, 4096), self.dim), dtype=np.float32)
+            for i in range(0, n, 4096):
+                blk = vectors[i:i + 4096]
+                np.copyto(buf[:len(blk)], blk)
+                np.dot(buf[:len(blk)], q, out=scores[i:i + len(blk)])
+        mask = np.asarray(alive) == 1
+        if subject_ids is not None:
+            codes = [self._vocab["subject_id"][str(s)] for s in subject_ids if str(s) in self._vocab["subject_id"]]
+            mask &= np.isin(columns[:, 1], codes)
+        if user_id is not None:
+            mask &= columns[:, 2] == self._vocab["user_id"].get(str(user_id), -1)
+        scores = np.where(mask, scores, -np.inf)
+        valid = int(mask.sum())
+        out: List[Dict[str, Any]] = []
+        want = top_k * (4 if predicate else 1)
+        seen = 0
+        while len(out) < top_k and seen < valid:
+            k = min(valid, max(want, seen + top_k))
+            part = np.argpartition(-scores, k - 1)[:k]
+            ordered = part[np.argsort(-scores[part])][seen:]
+            for row in self._rows_for_slots([int(s) for s in ordered]):
+                if predicate is None or predicate(row["metadata"]):
+                    row["score"] = float(scores[row.pop("slot")])
+                    out.append(row)
+                    if len(out) >= top_k:
+                        break
+            seen = k
+            want = k * 2
+        if generation != self._generation:
+            return self.query(query_embedding=query_embedding, top_k=top_k, subject_ids=subject_ids, user_id=user_id, predicate=predicate)
+        return out
+
+    def _rows_for_slots(self, slots: List[int]) -> List[Dict[str, Any]]:
+        found: Dict[int, Dict[str, Any]] = {}
+        with self._lock:
+            for i in range(0, len(slots), 500):
+                part = slots[i:i + 500]
+                marks = ",".join("?" * len(part))
+                for cid, slot, text, meta in self._conn.execute(f"select chunk_id, slot, text, meta from chunks where slot in ({marks})", part):
+                    found[slot] = {"id": cid, "slot": slot, "text": text, "metadata": json.loads(meta or "{}")}
+        return [found[s] for s in slots if s in found]
+
+    def get_chunks_by_document(self, document_id: str, limit: int = 100) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "select text from chunks where document_id=? order by chunk_index limit ?", (str(document_id), max(1, int(limit)))).fetchall()
+        return [r[0] for r in rows if isinstance(r[0], str) and r[0].strip()]
+
+    def list_chunk_ids_by_document(self, document_id: str) -> List[str]:
+        with self._lock:
+            return [r[0] for r in self._conn.execute("select chunk_id from chunks where document_id=?", (str(document_id),))]
+
+    def list_chunks_by_document(self, document_id: str) -> List[Tuple[str, Dict[str, Any]]]:
+        """(chunk_id, metadata incl. chunk_index) of every chunk of a document."""
+        with self._lock:
+            rows = self._conn.execute("select chunk_id, chunk_index, meta from chunks where document_id=?", (str(document_id),)).fetchall()
+        out = []
+        for cid, idx, meta in rows:
+            m = json.loads(meta or "{}")
+            m["chunk_index"] = idx
+            out.append((cid, m))
+        return out
+
+    def get_document_vectors(self, document_id: str) -> List[Tuple[str, Dict[str, Any], List[float]]]:
+        """(text, metadata incl. chunk_index, normalized vector) of every chunk of a document."""
+        with self._lock:
+            rows = self._conn.execute("select slot, chunk_index, text, meta from chunks where document_id=?", (str(document_id),)).fetchall()
+            if not rows:
+                return []
+            vecs = np.asarray(self._vectors[np.asarray([r[0] for r in rows], dtype=np.int64)], dtype=np.float32)
+        out = []
+        for (_slot, idx, text, meta), vec in zip(rows, vecs):
+            m = json.loads(meta or "{}")
+            m["chunk_index"] = idx
+            out.append((text, m, vec.tolist()))
+        return out
+
+    def iter_chunks(self) -> Iterator[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute("select chunk_id, text, meta from chunks order by slot").fetchall()
+        for cid, text, meta in rows:
+            yield {"id": cid, "text": text, "metadata": json.loads(meta or "{}")}
+
+    def count(self) -> int:
+        with self._lock:
+            return int(self._conn.execute("select count(*) from chunks").fetchone()[0])
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            live = self.count()
+            return {"path": self.path, "precision": self.precision, "dim": self.dim, "rows": self.n, "live": live,
+                    "bytes": int(self.n * self.dim * np.dtype(self.dtype).itemsize)}
@@ -1,15 +1,52 @@
-from fastapi import FastAPI
+import importlib
+import sys
+import time
+
+_import_started = time.perf_counter()
+# Per-module import times (ms), reported by /api/diag/startup for regression tracking
+_import_ms: dict = {}
+
+
+def _timed_import(name: str):
+    t = time.perf_counter()
+    mod = importlib.import_module(name, __package__)
+    _import_ms[name.lstrip(".")] = round((time.perf_counter() - t) * 1000, 1)
+    return mod
+
+
+from fastapi import Depends, FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from .config import get_settings
-from .routers import subjects, documents, schedules, rag
-from .routers import learning_path as learning_path_router
-from .routers import quiz as quiz_router
-from .routers import mindmap as mindmap_router
-from .routers import imports as imports_router
-from .routers import profiles as profiles_router
-from .routers import ocr as ocr_router
-from .rag import RAGSettings, get_engine
+from .deps import require_roles
+_import_ms["fastapi+config"] = round((time.perf_counter() - _import_started) * 1000, 1)
+subjects = _timed_import(".routers.subjects")
+documents = _timed_import(".routers.documents")
+schedules = _timed_import(".routers.schedules")
+rag = _timed_import(".routers.rag")
+learning_path_router = _timed_import(".routers.learning_path")
+quiz_router = _timed_import(".routers.quiz")
+mindmap_router = _timed_import(".routers.mindmap")
+imports_router = _timed_import(".routers.imports")
+profiles_router = _timed_import(".routers.profiles")
+ocr_router = _timed_import(".routers.ocr")
+from .rag import RAGSettings, get_engine, reload_engines
+from .doc_meta_cache import doc_meta_cache
+from .index_queue import index_queue
+from . import ingest_pool
+from . import executors
+from . import llm_clients
+from . import chat_memory
+from .metrics import loop_lag
 import logging
+import threading
+
+# Modules that must not be imported at startup; they load on first use
+_HEAVY_MODULES = ("torch", "sentence_transformers", "chromadb", "pypdf", "docx", "openai", "google.generativeai", "PIL", "pytesseract", "supabase", "numpy", "onnxruntime")
+_app_import_ms = round((time.perf_counter() - _import_started) * 1000, 1)
+_startup_ms: dict = {}
+# Readiness: flipped by the warm-up thread when RAGSettings.warmup is enabled
+_readiness: dict = {"ready": True, "warmup": None, "components_ms": {}, "error": None}
 
 settings = get_settings()
 
@@ -39,6 +76,12 @@ app.add_middleware(
 def health():
     return {"status": "ok"}
 
+@app.get("/api/ready")
+def ready():
+    # Load balancers should only route to instances returning 200 here
+    body = dict(_readiness)
+    return JSONResponse(status_code=200 if body["ready"] else 503, content=body)
+
 # Simple diagnostics: show key app and RAG settings
 @app.get("/api/diag")
 def diag():
@@ -62,9 +105,9 @@ def diag():
 # Force-initialize RAG engine to emit init logs and return current config snapshot
 @app.get("/api/diag/rag")
 def diag_rag():
-    r = RAGSettings()
-    # Initialize engine (lazy singleton); will log init message
-    _ = get_engine()
+    # Initialize engine (lazy, from the shared registry); will log init message
+    engine = get_engine()
+    r = engine.settings
     return {
         "rag": {
             "store_backend": r.store_backend,
@@ -74,11 +117,91 @@ def diag_rag():
             "collection_name": r.collection_name,
             "chunk_size": r.chunk_size,
             "chunk_overlap": r.chunk_overlap,
-        }
+        },
+        "embed_cache": engine.embed_cache_stats(),
+        "query_batcher": engine.query_batcher_stats(),
+        "query_cache": engine.query_cache_stats(),
+        "rerank": engine.rerank_stats(),
+        "lexical_index": engine.lexical_stats(),
+        "doc_meta_cache": doc_meta_cache.stats() if r.store_backend == "supabase" else None,
+        "local_store": engine.local_store_stats(),
+        "content_registry": engine.content_registry_stats(),
+        "index_queue": index_queue.stats(),
+        "ingest_pool": ingest_pool.stats(),
+        "llm_clients": llm_clients.stats(),
+        "chat_memory": chat_memory.stats(),
+        "warmup_ms": engine.warmup_ms,
+    }
+
+# Hot-reload RAG settings from env/.env without restarting the process
+@app.post("/api/diag/rag/reload", dependencies=[Depends(require_roles("admin"))])
+def diag_rag_reload():
+    engine = reload_engines()
+    r = engine.settings
+    return {
+        "ok": True,
+        "rag": {
+            "store_backend": r.store_backend,
+            "embed_provider": r.embed_provider,
+            "llm_provider": r.llm_provider,
+            "collection_name": r.collection_name,
+        },
+    }
+
+# Backfill the BM25 index (hybrid search) from chunks already in the vector store
+@app.post("/api/diag/rag/lexical/rebuild", dependencies=[Depends(require_roles("admin"))])
+def diag_rag_lexical_rebuild():
+    engine = get_engine()
+    if engine.lexical_stats() is None:
+        raise HTTPException(status_code=400, detail="HYBRID_SEARCH is disabled")
+    return {"ok": True, "chunks": engine.rebuild_lexical_index()}
+
+def _run_warmup():
+    t = time.perf_counter()
+    try:
+        components = get_engine().warmup()
+        _readiness.update(ready=True, warmup="done", components_ms=components)
+        rag_logger.info("[RAG] Warm-up finished in %.1f ms: %s", (time.perf_counter() - t) * 1000, components)
+    except Exception as e:
+        # stay not-ready so a broken instance never receives traffic
+        _readiness.update(warmup="failed", error=str(e))
+        rag_logger.exception("[RAG] Warm-up failed: %s", e)
+    _readiness["total_ms"] = round((time.perf_counter() - t) * 1000, 1)
+
+@app.get("/api/diag/startup")
+def diag_startup():
+    return {
+        "app_import_ms": _app_import_ms,
+        "startup_ms": _startup_ms.get("startup_ms"),
+        "imports_ms": _import_ms,
+        "heavy_modules_loaded": [m for m in _HEAVY_MODULES if m in sys.modules],
     }
 
+@app.get("/api/diag/loop")
+def diag_loop():
+    # Event-loop lag (blocking work in async handlers shows up here) and the async facade's thread pools
+    return {"loop": loop_lag.stats(), "executors": executors.stats()}
+
+@app.on_event("startup")
+async def start_loop_lag_monitor():
+    loop_lag.start()
+
+@app.on_event("shutdown")
+async def close_async_clients():
+    await llm_clients.aclose()
+
 @app.on_event("startup")
 def on_startup():
+    _startup_ms["startup_ms"] = round((time.perf_counter() - _import_started) * 1000, 1)
+    rag_logger.info(
+        "[RAG] Import report: app_import_ms=%s slowest=%s heavy_loaded=%s",
+        _app_import_ms,
+        sorted(_import_ms.items(), key=lambda kv: kv[1], reverse=True)[:3],
+        [m for m in _HEAVY_MODULES if m in sys.modules],
+    )
+    if RAGSettings().warmup:
+        _readiness.update(ready=False, warmup="running")
+        threading.Thread(target=_run_warmup, name="rag-warmup", daemon=True).start()
     try:
         rag_logger.info(
             "[RAG] App startup: store_backend=%s embed_provider=%s llm_provider=%s",
@@ -88,6 +211,24 @@ def on_startup():
         )
     except Exception as e:
         rag_logger.exception("[RAG] Startup logging failed: %s", e)
+    # Resume index jobs persisted by a previous run (queued, or running when the process died)
+    try:
+        depth = index_queue.stats()
+        if depth["queued"] or depth["running"]:
+            index_queue.start()
+            rag_logger.info("[RAG] Index queue resumed queued=%d running=%d", depth["queued"], depth["running"])
+    except Exception as e:
+        rag_logger.exception("[RAG] Index queue resume failed: %s", e)
+
+
+@app.on_event("shutdown")
+def on_shutdown():
+    index_queue.stop()
+    loop_lag.stop()
+    executors.shutdown()
+    llm_clients.close()
+    # Stop the ingestion worker processes (started on first use)
+    ingest_pool.shutdown()
 
 # Routers
 app.include_router(subjects.router, prefix=settings.api_prefix, tags=["subjects"])
@@ -0,0 +1,94 @@
+import asyncio
+import bisect
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+
+class Histogram:
+    """Fixed-bucket histogram (Prometheus-style `le` buckets) for in-process diagnostics."""
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self._bounds: List[float] = sorted(float(b) for b in buckets)
+        self._counts: List[int] = [0] * (len(self._bounds) + 1)
+        self._lock = threading.Lock()
+        self._count = 0
+        self._sum = 0.0
+        self._min: Optional[float] = None
+        self._max: Optional[float] = None
+
+    def observe(self, value: float) -> None:
+        v = float(value)
+        with self._lock:
+            self._counts[bisect.bisect_left(self._bounds, v)] += 1
+            self._count += 1
+            self._sum += v
+            self._min = v if self._min is None else min(self._min, v)
+            self._max = v if self._max is None else max(self._max, v)
+
+    def _quantile_locked(self, q: float) -> Optional[float]:
+        # Upper bound of the bucket holding the q-th observation
+        if not self._count:
+            return None
+        rank = q * self._count
+        seen = 0
+        for bound, n in zip(self._bounds, self._counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return self._max
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            buckets: Dict[str, int] = {}
+            cumulative = 0
+            for bound, n in zip(self._bounds, self._counts):
+                cumulative += n
+                buckets[f"le_{bound:g}"] = cumulative
+            buckets["le_inf"] = self._count
+            return {
+                "count": self._count,
+                "sum": round(self._sum, 3),
+                "mean": round(self._sum / self._count, 3) if self._count else None,
+                "min": self._min,
+                "max": self._max,
+                "p50": self._quantile_locked(0.5),
+                "p95": self._quantile_locked(0.95),
+                "buckets": buckets,
+            }
+
+
+LATENCY_MS_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+LOOP_LAG_MS_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class LoopLagMonitor:
+    """Event-loop lag: how late a periodic `asyncio.sleep(interval)` wakes up. Anything
+    above a few ms means a handler blocked the loop for that long."""
+    def __init__(self, interval_s: float = 0.25) -> None:
+        self.interval_s = interval_s
+        self.lag_ms = Histogram(LOOP_LAG_MS_BUCKETS)
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    def start(self) -> None:
+        """Start sampling on the running loop (idempotent)."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._sample())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _sample(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            t0 = loop.time()
+            await asyncio.sleep(self.interval_s)
+            self.lag_ms.observe(max(0.0, (loop.time() - t0 - self.interval_s) * 1000.0))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"interval_ms": self.interval_s * 1000.0, "running": self._task is not None and not self._task.done(),
+                "lag_ms": self.lag_ms.snapshot()}
+
+
+loop_lag = LoopLagMonitor()
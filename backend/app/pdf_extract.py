@@ -0,0 +1,124 @@
+"""
+PDF text extraction, parallel over page ranges for large files.
+
+pypdf's `extract_text()` is pure Python and CPU-bound, so a long PDF keeps one core
+busy (and holds the GIL) for the whole extraction. Files with at least `min_pages`
+pages are split into page ranges that the shared ingestion pool (ingest_pool.py)
+parses independently; the results are yielded back in page order as soon as the
+next range is ready, so the streaming splitter in rag.py keeps consuming while later
+ranges are still running. Smaller files are parsed by the caller, where pickling
+would cost more than it saves.
+
+Every page is timed; a summary with the slowest pages is logged (and written into
+an optional `report` dict) when the iterator is exhausted.
+"""
+import logging
+import math
+import time
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from . import ingest_pool
+
+
+def _extract_range(file_bytes: bytes, start: int, end: int) -> List[Tuple[int, Optional[str], float]]:
+    """Worker: (page_number, text or None if the page failed, milliseconds) for pages [start, end)."""
+    from pypdf import PdfReader
+    reader = PdfReader(BytesIO(file_bytes))
+    out: List[Tuple[int, Optional[str], float]] = []
+    for i in range(start, end):
+        t0 = time.perf_counter()
+        try:
+            text: Optional[str] = reader.pages[i].extract_text() or ""
+        except Exception:
+            text = None
+        out.append((i + 1, text, (time.perf_counter() - t0) * 1000.0))
+    return out
+
+
+def _page_ranges(total: int, workers: int, pages_per_task: int) -> List[Tuple[int, int]]:
+    # ~4 ranges per worker balances uneven pages without making tasks tiny
+    size = max(1, pages_per_task, math.ceil(total / (workers * 4)))
+    return [(s, min(total, s + size)) for s in range(0, total, size)]
+
+
+def page_count(file_bytes: bytes) -> int:
+    from pypdf import PdfReader
+    return len(PdfReader(BytesIO(file_bytes)).pages)
+
+
+def open_pdf_pages(file_bytes: bytes, *, pool: bool = True, min_pages: int = 40, pages_per_task: int = 8,
+                   slow_page_ms: float = 2000.0, report: Optional[Dict[str, Any]] = None
+                   ) -> Tuple[int, Iterator[Tuple[int, str]]]:
+    """(page count, lazy iterator of (page_number, text) in page order). Pages whose
+    extraction fails are skipped; `pool=False` keeps large files in-process too."""
+    from pypdf import PdfReader
+    reader = PdfReader(BytesIO(file_bytes))
+    total = len(reader.pages)
+    # never from inside a pool worker: workers cannot start a nested pool
+    parallel = pool and total >= max(1, min_pages) and not ingest_pool.in_worker()
+    nworkers = ingest_pool.size() if parallel else 1
+
+    def serial(start: int = 0) -> Iterator[Tuple[int, Optional[str], float]]:
+        for i in range(start, total):
+            t0 = time.perf_counter()
+            try:
+                text: Optional[str] = reader.pages[i].extract_text() or ""
+            except Exception:
+                text = None
+            yield i + 1, text, (time.perf_counter() - t0) * 1000.0
+
+    def pooled() -> Iterator[Tuple[int, Optional[str], float]]:
+        executor = ingest_pool.get_pool()
+        ranges = _page_ranges(total, nworkers, pages_per_task)
+        futures = [executor.submit(_extract_range, file_bytes, s, e) for s, e in ranges]
+        try:
+            for (start, _end), fut in zip(ranges, futures):
+                try:
+                    rows = fut.result()
+                except BrokenProcessPool as e:
+                    # a worker died (OOM/crash): finish in-process, next file gets a fresh pool
+                    logging.getLogger("rag").warning("[RAG] PDF worker pool failed at page %d, continuing in-process: %s", start + 1, e)
+                    ingest_pool.reset(executor)
+                    yield from serial(start)
+                    return
+                yield from rows
+        finally:
+            # consumer stopped early (error/cancel): drop ranges not started yet
+            for fut in futures:
+                fut.cancel()
+
+    def pages() -> Iterator[Tuple[int, str]]:
+        t0 = time.perf_counter()
+        timings: List[Tuple[int, float]] = []
+        for number, text, ms in (pooled() if parallel else serial()):
+            timings.append((number, ms))
+            if ms >= slow_page_ms:
+                logging.getLogger("rag").warning("[RAG] Slow PDF page=%d took %.0fms", number, ms)
+            if text is not None:
+                yield number, text
+        _report(timings, total, nworkers, (time.perf_counter() - t0) * 1000.0, report)
+
+    return total, pages()
+
+
+def _report(timings: List[Tuple[int, float]], total: int, workers: int, wall_ms: float,
+            report: Optional[Dict[str, Any]]) -> None:
+    slowest = sorted(timings, key=lambda t: t[1], reverse=True)[:5]
+    summary = {
+        "pages": total,
+        "workers": workers,
+        "wall_ms": round(wall_ms, 1),
+        "page_ms_total": round(sum(ms for _p, ms in timings), 1),
+        "slowest": [{"page": p, "ms": round(ms, 1)} for p, ms in slowest],
+    }
+    if report is not None:
+        report.update(summary)
+    try:
+        logging.getLogger("rag").info(
+            "[RAG] PDF extracted pages=%d workers=%d wall_ms=%.0f cpu_ms=%.0f slowest=%s",
+            total, workers, summary["wall_ms"], summary["page_ms_total"],
+            ", ".join(f"p{s['page']}:{s['ms']:.0f}ms" for s in summary["slowest"]))
+    except Exception:
+        pass
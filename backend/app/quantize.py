@@ -0,0 +1,102 @@
+"""
+Reduced-precision vector codecs (RAGSettings.vector_precision).
+
+- float32: vectors are stored as-is.
+- float16: half precision; maps to pgvector `halfvec` (2 bytes/dim). Stores keep no
+  float32 copy, so float16 search is not rescored at full precision: the local store
+  scores the float32 query against the half vectors, Supabase compares halfvec to halfvec.
+
+int8 (symmetric scalar quantization with one float32 scale per vector, shortlisted
+on the codes and re-ranked at full precision by `rescore`) is only evaluated by the
+benchmark: none of the stores keeps int8 codes, so it is rejected as a setting and
+`quantize_int8` / `dequantize_int8` / `rescore` below exist for the benchmark alone.
+
+Run `python -m app.quantize` from backend/ for a recall benchmark.
+"""
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+PRECISIONS = ("float32", "float16")
+
+
+def normalize_precision(value: str) -> str:
+    p = (value or "float32").lower()
+    if p in ("fp16", "half", "halfvec"):
+        p = "float16"
+    if p == "int8":
+        raise ValueError("vector_precision=int8 is not supported by any vector store (benchmark only); use float16")
+    if p not in PRECISIONS:
+        raise ValueError(f"Unsupported vector_precision '{value}' (expected one of {', '.join(PRECISIONS)})")
+    return p
+
+
+def to_float16(vectors: Sequence[Sequence[float]]) -> np.ndarray:
+    return np.asarray(vectors, dtype=np.float32).astype(np.float16)
+
+
+def vector_literal(vec: Sequence[float], precision: str = "float32") -> str:
+    """pgvector text literal. Half precision carries ~3 significant digits, so
+    printing fewer digits roughly halves the JSON insert payload."""
+    if precision == "float32":
+        return "[" + ",".join(repr(float(x)) for x in vec) + "]"
+    half = np.asarray(vec, dtype=np.float32).astype(np.float16)
+    return "[" + ",".join(f"{float(x):.4g}" for x in half) + "]"
+
+
+# -------- Benchmark only (int8 is not a storage precision) --------
+def quantize_int8(vectors: Sequence[Sequence[float]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Return (codes int8[n, d], scales float32[n]) with x ~= codes * scale."""
+    arr = np.asarray(vectors, dtype=np.float32)
+    if arr.ndim == 1:
+        arr = arr[None, :]
+    scales = np.abs(arr).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(arr / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def dequantize_int8(codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    return codes.astype(np.float32) * scales.astype(np.float32)[:, None]
+
+
+def rescore(query: Sequence[float], candidates: np.ndarray) -> np.ndarray:
+    """Cosine similarity of a full-precision query against (dequantized) candidates."""
+    q = np.asarray(query, dtype=np.float32)
+    c = np.asarray(candidates, dtype=np.float32)
+    qn = np.linalg.norm(q) or 1.0
+    cn = np.linalg.norm(c, axis=1)
+    cn[cn == 0] = 1.0
+    return (c @ q) / (cn * qn)
+
+
+def _benchmark(n: int = 20_000, dim: int = 384, queries: int = 200, k: int = 10, oversample: int = 4) -> List[str]:
+    rng = np.random.default_rng(0)
+    # Clustered data is closer to real embeddings than isotropic noise
+    centers = rng.normal(size=(64, dim)).astype(np.float32)
+    docs = centers[rng.integers(0, 64, n)] + 0.6 * rng.normal(size=(n, dim)).astype(np.float32)
+    docs /= np.linalg.norm(docs, axis=1, keepdims=True)
+    qs = docs[rng.integers(0, n, queries)] + 0.3 * rng.normal(size=(queries, dim)).astype(np.float32)
+    qs /= np.linalg.norm(qs, axis=1, keepdims=True)
+    truth = np.argsort(-(qs @ docs.T), axis=1)[:, :k]
+
+    def recall(found: np.ndarray) -> float:
+        return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(found, truth)]))
+
+    lines = [f"n={n} dim={dim} queries={queries} k={k}"]
+    f16 = to_float16(docs).astype(np.float32)
+    lines.append(f"float16: bytes/vec={dim * 2} recall@{k}={recall(np.argsort(-(qs @ f16.T), axis=1)[:, :k]):.4f}")
+    codes, scales = quantize_int8(docs)
+    deq = dequantize_int8(codes, scales)
+    q_codes, q_scales = quantize_int8(qs)
+    approx = (q_codes.astype(np.int32) @ codes.astype(np.int32).T) * scales[None, :]
+    raw = np.argsort(-approx, axis=1)[:, :k]
+    shortlist = np.argsort(-approx, axis=1)[:, :k * oversample]
+    rescored = np.stack([cand[np.argsort(-rescore(q, deq[cand]))[:k]] for q, cand in zip(qs, shortlist)])
+    lines.append(f"int8: bytes/vec={dim + 4} recall@{k}={recall(raw):.4f} rescored(x{oversample})={recall(rescored):.4f}")
+    return lines
+
+
+if __name__ == "__main__":
+    for line in _benchmark():
+        print(line)
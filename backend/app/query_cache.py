@@ -0,0 +1,98 @@
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+
+def normalize_query(query: str) -> str:
+    """Canonical form used as cache key: NFC, lowercase, collapsed whitespace."""
+    q = unicodedata.normalize("NFC", query or "")
+    return re.sub(r"\s+", " ", q).strip().lower()
+
+
+class TTLLRUCache:
+    """
+    Thread-safe in-process cache with per-entry TTL and LRU eviction.
+    Entries may carry tags (e.g. subject ids) so a group can be invalidated at once.
+    """
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 300.0) -> None:
+        self.max_entries = max(1, int(max_entries))
+        self.ttl = float(ttl_seconds)
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[Hashable, Tuple[float, Any, Tuple[str, ...]]]" = OrderedDict()
+        self._tags: Dict[str, Set[Hashable]] = {}
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._invalidations = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self._misses += 1
+                return None
+            expires, value, _tags = item
+            if expires <= now:
+                self._remove_locked(key)
+                self._misses += 1
+                return None
+            self._data.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, tags: Iterable[str] = ()) -> None:
+        tag_tuple = tuple(tags)
+        with self._lock:
+            if key in self._data:
+                self._remove_locked(key)
+            self._data[key] = (time.monotonic() + self.ttl, value, tag_tuple)
+            for t in tag_tuple:
+                self._tags.setdefault(t, set()).add(key)
+            while len(self._data) > self.max_entries:
+                oldest = next(iter(self._data))
+                self._remove_locked(oldest)
+                self._evictions += 1
+
+    def invalidate_tags(self, tags: Iterable[str]) -> int:
+        removed = 0
+        with self._lock:
+            for t in tags:
+                for key in list(self._tags.get(t, ())):
+                    if key in self._data:
+                        self._remove_locked(key)
+                        removed += 1
+            self._invalidations += removed
+        return removed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._invalidations += len(self._data)
+            self._data.clear()
+            self._tags.clear()
+
+    def _remove_locked(self, key: Hashable) -> None:
+        _exp, _val, tags = self._data.pop(key)
+        for t in tags:
+            keys = self._tags.get(t)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[t]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self._hits + self._misses
+            return {
+                "entries": len(self._data),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "invalidations": self._invalidations,
+                "hit_rate": round(self._hits / total, 4) if total else None,
+            }
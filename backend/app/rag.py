@@ -1,21 +1,33 @@
+import copy
+import hashlib
 import os
+import queue
 import re
+import threading
 import uuid
-from typing import List, Optional, Dict, Any
+import zlib
+from array import array
+from typing import List, Optional, Dict, Any, AsyncIterator, Iterable, Iterator, Tuple
 
-import httpx
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
-# Embeddings & Vector store (all local, free)
-from sentence_transformers import SentenceTransformer
-import chromadb
-from chromadb.config import Settings
+# Heavy stacks (sentence_transformers/torch, chromadb, pypdf, docx) are imported
+# lazily where used so the API process starts fast.
 from .vector_store import SupabaseVectorStore
+from .embed_cache import EmbeddingCache
+from .batching import MicroBatcher
+from .query_cache import TTLLRUCache, normalize_query
+from .lexical_index import LexicalIndex, reciprocal_rank_fusion
+from .rerank import RerankService
+from .doc_meta_cache import doc_meta_cache
+from .pdf_extract import open_pdf_pages, page_count
+from . import ingest_pool
+from .executors import get_executor
+from . import llm_clients
+from .content_registry import ContentRegistry
+from .tokens import estimate_tokens
 
-# Text extraction
-from pypdf import PdfReader
-from docx import Document as DocxDocument
 import logging
 
 # Simple splitter
@@ -34,13 +46,95 @@ class RAGSettings(BaseSettings):
     # Chunking
     chunk_size: int = 850                # RAG_CHUNK_SIZE
     chunk_overlap: int = 150              # RAG_CHUNK_OVERLAP
+    # Content-defined boundaries: once a chunk holds chunk_anchor_min * chunk_size chars it also ends
+    # after any sentence whose crc32 is 0 mod N, so boundaries re-synchronize right after an edit and
+    # an incremental re-index keeps the chunks around it (0 = pure size packing)
+    chunk_anchor_every: int = 3
+    chunk_anchor_min: float = 0.75
+    # Ingestion process pool (see ingest_pool.py): extraction, splitting, keyword extraction and
+    # local embedding run in spawned workers shared by the whole uvicorn worker process
+    ingest_process_pool: bool = True     # false = run these stages on threads of the API process
+    ingest_workers: int = 0              # 0 = cpu_count - 1 (max 4)
+    ingest_max_tasks_per_child: int = 100  # recycle workers to release leaked memory (0 = never)
+    ingest_memory_limit_mb: int = 0      # RLIMIT_AS per worker (0 = unlimited)
+    # PDF text extraction: files with >= min_pages pages are parsed page-range-parallel in the pool (see pdf_extract.py)
+    pdf_parallel_min_pages: int = 40
+    pdf_pages_per_task: int = 8
+    pdf_slow_page_ms: float = 2000
     # Backends/providers
-    store_backend: str = "chroma"        # chroma | supabase
+    store_backend: str = "chroma"        # chroma | supabase | local (mmap'd matrix in store_dir, exact search)
     embed_provider: str = "local"        # local | openai | gemini
     llm_provider: str = "none"           # none | ollama | openai | gemini
-    # Re-ranking
-    rerank: bool = False
+    # Vector storage precision: float32 | float16 (see quantize.py); float16 is searched as stored,
+    # without full-precision rescoring. Supabase: switching needs the backfill in pgvector.sql
+    vector_precision: str = "float32"
+    # Load models and open the store at startup; /api/ready stays 503 until done
+    warmup: bool = False
+    # Local model inference: torch | torch-int8 | onnx | onnx-int8 (see inference.py); 0 threads = library default
+    inference_backend: str = "torch"
+    inference_threads: int = 0
+    # Re-ranking: shared cross-encoder service (see rerank.py); only the top-N candidates within
+    # a token budget are scored, and reranking is skipped when the dense top-1 leads by >= skip_gap
+    rerank: bool = True
     rerank_model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    rerank_top_n: int = 20
+    rerank_max_tokens: int = 6000
+    rerank_skip_gap: float = 0.15        # 0 = always rerank
+    rerank_batch_window_ms: float = 5.0
+    rerank_batch_max: int = 64
+    rerank_cache_size: int = 20_000
+    rerank_cache_ttl_seconds: float = 86_400
+    # Hybrid retrieval: BM25 index (sqlite in store_dir) fused with vector hits via reciprocal rank fusion
+    hybrid_search: bool = False
+    hybrid_candidates: int = 20          # candidates taken from each retriever before fusion
+    bm25_k1: float = 1.2
+    bm25_b: float = 0.75
+    rrf_k: int = 60
+    # Durable index queue (sqlite in store_dir, see index_queue.py): worker threads per process,
+    # retries with exponential backoff, and a cap on waiting jobs (0 = unbounded)
+    index_workers: int = 2
+    index_max_attempts: int = 3
+    index_retry_base_seconds: float = 10
+    index_queue_max: int = 200
+    # Async facade for async handlers (see executors.py): threads running aretrieve off the event loop;
+    # aanswer uses the providers' native async clients, indexing goes through the index queue
+    retrieve_concurrency: int = 16
+    # Content registry (sqlite in store_dir): identical uploads reuse the Storage object, the
+    # analysis and the already-embedded chunks of another document instead of recomputing them
+    content_dedup: bool = True
+    # Conversation memory for /rag/stream threads (see chat_memory.py): prior snippets re-used as context
+    # up to a token budget; bounded per thread and overall, idle threads expire; sqlite in store_dir when persisted
+    chat_memory_persist: bool = True
+    chat_memory_context_tokens: int = 1500
+    chat_memory_max_turns: int = 20
+    chat_memory_max_threads: int = 10_000
+    chat_memory_ttl_seconds: float = 86_400
+    chat_memory_snippet_chars: int = 2000
+    # Supabase: cache of `documents` rows used to enrich retrieval hits (invalidated by the documents router)
+    doc_meta_cache_size: int = 5000
+    doc_meta_cache_ttl_seconds: float = 300
+    # Persistent embedding cache of document chunks (sqlite file in store_dir)
+    embed_cache: bool = True
+    embed_cache_max_entries: int = 200_000
+    # Cross-request micro-batching of query embeddings
+    query_batching: bool = True
+    query_batch_window_ms: float = 5.0
+    query_batch_max: int = 32
+    # In-memory TTL+LRU caches: normalized query -> embedding, (embedding, filters, top_k) -> results
+    query_cache: bool = True
+    query_embed_cache_size: int = 4096
+    query_embed_cache_ttl_seconds: float = 3600
+    result_cache_size: int = 1024
+    result_cache_ttl_seconds: float = 300
+    # Ingestion embedding batches; 0 = provider default (see _EMBED_BATCH_LIMITS)
+    embed_batch_size: int = 0
+    embed_batch_max_tokens: int = 0
+    # Provider clients (see llm_clients.py): created once per provider/API key, keep-alive connection pools
+    llm_http_max_connections: int = 100
+    llm_http_max_keepalive: int = 20
+    llm_http_keepalive_expiry_seconds: float = 30
+    llm_http2: bool = True               # only when the `h2` package is installed
+    llm_timeout_seconds: float = 60
     # OpenAI
     openai_api_key: Optional[str] = None
     openai_embed_model: str = "text-embedding-3-small"
@@ -49,18 +143,148 @@ class RAGSettings(BaseSettings):
     gemini_api_key: Optional[str] = None
     gemini_embed_model: str = "models/text-embedding-004"
     gemini_chat_model: str = "gemini-1.5-flash"
+    gemini_base_url: str = "https://generativelanguage.googleapis.com"
+    gemini_embed_concurrency: int = 4
+    gemini_embed_max_retries: int = 4
 
     # Load env from backend/.env, case-insensitive, ignore extras
     _env_file = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '.env'))
     model_config = SettingsConfigDict(env_file=_env_file, case_sensitive=False, extra="ignore")
 
+    @field_validator("vector_precision")
+    @classmethod
+    def _check_vector_precision(cls, v: str) -> str:
+        from .quantize import normalize_precision
+        return normalize_precision(v)
+
+
+# Per-provider request limits for ingestion batches: (max inputs, max estimated tokens)
+_EMBED_BATCH_LIMITS: Dict[str, Tuple[int, int]] = {
+    "local": (64, 16_384),
+    "openai": (512, 250_000),  # API hard caps: 2048 inputs / 300k tokens per request
+    "gemini": (400, 80_000),   # split into 100-text batchEmbedContents calls sent concurrently
+}
+
+
+# Upper bound of page text sent to one ingest_pool.split_window task
+_SPLIT_WINDOW_CHARS = 2_000_000
+
+
+class _Splitter:
+    """
+    Streaming state of the chunk splitter:
+    - Clean spaces
+    - Split into sentences with a lightweight regex
+    - Pack sentences into chunks of approx chunk_size with chunk_overlap, ending early
+      at content-defined anchor sentences (chunk_anchor_every)
+    Only the chunk being packed is held in memory. The state is picklable, so consecutive
+    page windows of one document can be split by pool workers (ingest_pool.split_window).
+    """
+    def __init__(self, *, chunk_size: int, overlap: int, anchor_every: int, anchor_min_ratio: float) -> None:
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.anchor_every = anchor_every
+        self.anchor_min = int(chunk_size * anchor_min_ratio)
+        self.current: List[Tuple[str, Optional[int]]] = []
+        self.current_len = 0
+        self.emitted = False
+        self.first_text = ""
+
+    def _flush_with_overlap(self) -> Optional[Tuple[str, Optional[int], Optional[int]]]:
+        if not self.current:
+            return None
+        chunk = " ".join(s for s, _p in self.current).strip()
+        out = (chunk, self.current[0][1], self.current[-1][1]) if chunk else None
+        # build overlap from end of current chunk (attributed to its last page)
+        if self.overlap > 0 and chunk:
+            keep = chunk[-self.overlap:]
+            self.current = [(keep, self.current[-1][1])]
+            self.current_len = len(keep)
+        else:
+            self.current = []
+            self.current_len = 0
+        if out:
+            self.emitted = True
+        return out
+
+    def feed(self, pages: Iterable[Tuple[Optional[int], str]]) -> Iterator[Tuple[str, Optional[int], Optional[int]]]:
+        for page, text in pages:
+            cleaned = re.sub(r"\s+", " ", text or "").strip()
+            if not cleaned:
+                continue
+            if not self.first_text:
+                self.first_text = cleaned[:self.chunk_size]
+            # Split into rough sentences by punctuation. Keep delimiters by splitting on lookbehind.
+            for sent in re.split(r"(?<=[\.!?。！？;；:\n])\s+", cleaned):
+                sent = sent.strip()
+                if not sent:
+                    continue
+                if self.current_len + len(sent) + 1 <= self.chunk_size:
+                    self.current.append((sent, page))
+                    self.current_len += len(sent) + 1
+                    if (self.anchor_every and self.current_len >= self.anchor_min
+                            and zlib.crc32(sent.encode("utf-8")) % self.anchor_every == 0):
+                        out = self._flush_with_overlap()
+                        if out:
+                            yield out
+                else:
+                    out = self._flush_with_overlap()
+                    if out:
+                        yield out
+                    self.current.append((sent, page))
+                    self.current_len = len(sent)
+
+    def finish(self) -> Iterator[Tuple[str, Optional[int], Optional[int]]]:
+        out = self._flush_with_overlap()
+        if out:
+            yield out
+        # Ensure at least one chunk for very small text
+        if not self.emitted and self.first_text:
+            yield self.first_text, None, None
+
+
+def _chunk_id(document_id: str, text: str, occurrences: Dict[str, int]) -> str:
+    """Deterministic chunk id: document id + content hash; repeated texts within a
+    document get an occurrence suffix."""
+    digest = hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+    n = occurrences.get(digest, 0) + 1
+    occurrences[digest] = n
+    return f"{document_id}-{digest}" if n == 1 else f"{document_id}-{digest}-{n}"
+
+
+def _chunk_position(chunk_index: int, page: Optional[int], page_end: Optional[int]) -> Dict[str, Any]:
+    # Chroma rejects None metadata values; page-less formats carry no page keys
+    pos: Dict[str, Any] = {"chunk_index": int(chunk_index)}
+    if page is not None:
+        pos["page"] = int(page)
+        pos["page_end"] = int(page_end if page_end is not None else page)
+    return pos
+
+
+def _position_key(meta: Dict[str, Any]) -> Tuple[Any, ...]:
+    """Comparable (chunk_index[, page, page_end]) of a chunk from its metadata/row."""
+    pos = [meta.get("chunk_index")]
+    if meta.get("page") is not None:
+        pos.extend([meta.get("page"), meta.get("page_end")])
+    return tuple(pos)
+
 
 class RAGEngine:
-    _model: Optional[SentenceTransformer] = None
-    _client: Optional[chromadb.Client] = None
+    _model: Any = None
+    _pool_embed_backend: Optional[str] = None
+    _client: Any = None
     _collection: Optional[Any] = None
     _svs: Optional[SupabaseVectorStore] = None
+    _lvs: Any = None
     _cross_encoder: Any = None
+    _rerank_service: Optional[RerankService] = None
+    _embed_cache: Optional[EmbeddingCache] = None
+    _query_batcher: Optional[MicroBatcher] = None
+    _query_emb_cache: Optional[TTLLRUCache] = None
+    _result_cache: Optional[TTLLRUCache] = None
+    _lexical: Optional[LexicalIndex] = None
+    content_registry: Optional[ContentRegistry] = None
+    warmup_ms: Optional[Dict[str, float]] = None
 
     def __init__(self, settings: Optional[RAGSettings] = None) -> None:
         self.settings = settings or RAGSettings()
@@ -71,52 +295,252 @@ class RAGEngine:
             self.settings.embed_provider,
             self.settings.llm_provider,
         )
+        # Store clients, models and the embedding cache are shared process-wide (see registry below)
         if self.settings.store_backend == "chroma":
-            self._client = chromadb.PersistentClient(
-                path=self.settings.store_dir,
-                settings=Settings(anonymized_telemetry=False),
-            )
+            self._client = _shared(("chroma", self.settings.store_dir), lambda: _open_chroma(self.settings.store_dir))
             self._collection = self._client.get_or_create_collection(
                 name=self.settings.collection_name,
                 metadata={"hnsw:space": "cosine"},
             )
+        elif self.settings.store_backend == "local":
+            self._lvs = _shared(("local", self._local_store_path()), self._open_local_store)
         else:
-            self._svs = SupabaseVectorStore()
+            precision = self._vector_precision()
+            self._svs = _shared(("supabase", precision), lambda: SupabaseVectorStore(precision=precision))
+            doc_meta_cache.configure(self.settings.doc_meta_cache_size, self.settings.doc_meta_cache_ttl_seconds)
+        if self.settings.query_batching:
+            # queries skip the persistent chunk cache; repeats are served by the query cache
+            self._query_batcher = MicroBatcher(
+                self._embed_uncached,
+                max_batch=self.settings.query_batch_max,
+                window_ms=self.settings.query_batch_window_ms,
+                name="query-embed",
+            )
+        if self.settings.query_cache:
+            self._query_emb_cache = TTLLRUCache(self.settings.query_embed_cache_size, self.settings.query_embed_cache_ttl_seconds)
+            self._result_cache = TTLLRUCache(self.settings.result_cache_size, self.settings.result_cache_ttl_seconds)
+        if self.settings.embed_cache:
+            path = os.path.join(self.settings.store_dir, "embed_cache.sqlite3")
+            try:
+                self._embed_cache = _shared(
+                    ("embed_cache", path),
+                    lambda: EmbeddingCache(path, max_entries=self.settings.embed_cache_max_entries),
+                )
+            except Exception as e:
+                logging.getLogger("rag").warning("[RAG] Embedding cache disabled: %s", e)
+        if self.settings.hybrid_search:
+            path = os.path.join(self.settings.store_dir, f"lexical_{self.settings.store_backend}_{self.settings.collection_name}.sqlite3")
+            try:
+                self._lexical = _shared(("lexical", path), lambda: LexicalIndex(path))
+            except Exception as e:
+                logging.getLogger("rag").warning("[RAG] Hybrid search disabled (lexical index unavailable): %s", e)
+        if self.settings.content_dedup:
+            path = os.path.join(self.settings.store_dir, "content_registry.sqlite3")
+            try:
+                self.content_registry = _shared(("content_registry", path), lambda: ContentRegistry(path))
+            except Exception as e:
+                logging.getLogger("rag").warning("[RAG] Content registry disabled: %s", e)
+        llm_clients.configure(max_connections=self.settings.llm_http_max_connections,
+                              max_keepalive=self.settings.llm_http_max_keepalive,
+                              keepalive_expiry=self.settings.llm_http_keepalive_expiry_seconds,
+                              http2=self.settings.llm_http2,
+                              timeout=self.settings.llm_timeout_seconds)
+        if self.settings.ingest_process_pool:
+            ingest_pool.configure(workers=self.settings.ingest_workers,
+                                  max_tasks_per_child=self.settings.ingest_max_tasks_per_child,
+                                  memory_limit_mb=self.settings.ingest_memory_limit_mb)
+
+    @classmethod
+    def for_worker(cls, settings: RAGSettings) -> "RAGEngine":
+        """Engine without stores or caches, for the stages run inside ingest_pool workers."""
+        engine = cls.__new__(cls)
+        engine.settings = settings
+        return engine
+
+    def _ingest_in_pool(self) -> bool:
+        return self.settings.ingest_process_pool and not ingest_pool.in_worker()
+
+    def close(self) -> None:
+        """Stop per-engine background workers; shared models/clients stay in the registry."""
+        if self._query_batcher is not None:
+            self._query_batcher.close()
 
-    def _emb_model(self) -> SentenceTransformer:
+    def warmup(self) -> Dict[str, float]:
+        """Load models and touch the vector store ahead of traffic.
+        Returns per-component durations in ms (also kept in self.warmup_ms)."""
+        import time
+        logger = logging.getLogger("rag")
+        timings: Dict[str, float] = {}
+
+        def timed(name: str, fn: Any) -> None:
+            t = time.perf_counter()
+            fn()
+            timings[name] = round((time.perf_counter() - t) * 1000, 1)
+            logger.info("[RAG] Warm-up %s took %.1f ms", name, timings[name])
+
+        if self.settings.store_backend == "chroma":
+            timed("vector_store", lambda: self._collection.count())  # type: ignore[attr-defined]
+        elif self.settings.store_backend == "local":
+            timed("vector_store", lambda: self._lvs.query(query_embedding=[1.0] * max(1, self._lvs.dim), top_k=1))
+        else:
+            timed("vector_store", lambda: self._svs.sb.table(self._svs.table_name).select("id").limit(1).execute())  # type: ignore[attr-defined]
+        if (self.settings.embed_provider or "local").lower() == "local":
+            timed("embed_model", self._emb_model)
+        # first call triggers kernel init / opens provider connections; bypass caches
+        timed("embed_first_call", lambda: self._embed_uncached(["warm-up"]))
+        if self.settings.rerank:
+            timed("rerank_model", lambda: self._reranker().model())
+            timed("rerank_first_call", lambda: self._reranker().model().predict([("warm-up", "warm-up")]))
+        self.warmup_ms = timings
+        return timings
+
+    def _vector_precision(self) -> str:
+        from .quantize import normalize_precision
+        precision = normalize_precision(self.settings.vector_precision)
+        if precision != "float32" and self.settings.store_backend == "chroma":
+            logging.getLogger("rag").warning("[RAG] vector_precision=%s is not supported by Chroma; storing float32", precision)
+            return "float32"
+        return precision
+
+    def _local_store_path(self) -> str:
+        return os.path.join(self.settings.store_dir, f"local_{self.settings.collection_name}")
+
+    def _open_local_store(self) -> Any:
+        from .local_vector_store import LocalVectorStore
+        return LocalVectorStore(self._local_store_path(), precision=self._vector_precision())
+
+    def _emb_model(self) -> Any:
         if self._model is None:
-            # Will download the model once and cache locally
-            self._model = SentenceTransformer(self.settings.embed_model_name)
+            from .inference import load_embedder
+            s = self.settings
+            # Will download the model once and cache locally (ONNX exports live under store_dir/models)
+            self._model = _shared(
+                ("embed_model", s.embed_model_name, s.inference_backend, s.inference_threads, s.store_dir),
+                lambda: load_embedder(s.embed_model_name, backend=s.inference_backend, cache_dir=s.store_dir, threads=s.inference_threads),
+            )
         return self._model
 
-    def _embed_texts(self, texts: List[str]) -> List[List[float]]:
+    def _embed_model_id(self, ingest: bool = False) -> str:
+        provider = (self.settings.embed_provider or "local").lower()
+        if provider == "openai":
+            return self.settings.openai_embed_model
+        if provider == "gemini":
+            return self.settings.gemini_embed_model
+        from .inference import backend_label
+        backend_label(self.settings.inference_backend)  # reject unknown backends early
+        # int8/ONNX outputs differ slightly from torch float32; keep their cache entries apart.
+        # Label by the backend actually loaded (a failed ONNX export falls back to torch)
+        backend = self._loaded_backend(ingest)
+        return self.settings.embed_model_name if backend == "torch" else f"{self.settings.embed_model_name}@{backend}"
+
+    def _loaded_backend(self, ingest: bool = False) -> str:
+        """Backend of the model that computes the vectors: a pool worker's for pooled
+        ingestion, this process's otherwise."""
+        if ingest and self._ingest_in_pool():
+            if self._pool_embed_backend is None:
+                self._pool_embed_backend = ingest_pool.run(ingest_pool.embed_backend, self.settings.model_dump_json())
+            return self._pool_embed_backend
+        return getattr(self._emb_model(), "backend_label", None) or "torch"
+
+    def _embed_texts(self, texts: List[str], ingest: bool = False) -> List[List[float]]:
+        """Embed texts, serving unchanged chunks from the persistent cache.
+        Only cache misses are sent to the embedding provider; with `ingest`, a local
+        model runs in the ingestion pool instead of this process.
+        """
+        compute = self._embed_ingest if ingest else self._embed_uncached
+        cache = self._embed_cache
+        if cache is None or not texts:
+            return compute(texts)
+        provider = (self.settings.embed_provider or "local").lower()
+        model = self._embed_model_id(ingest)
+        try:
+            vectors = cache.get_many(provider, model, texts)
+        except Exception as e:
+            logging.getLogger("rag").warning("[RAG] Embedding cache lookup failed: %s", e)
+            return compute(texts)
+        miss_idx = [i for i, v in enumerate(vectors) if v is None]
+        if miss_idx:
+            # identical chunk texts only need one model call
+            uniq = list(dict.fromkeys(texts[i] for i in miss_idx))
+            fresh = compute(uniq)
+            try:
+                cache.put_many(provider, model, uniq, fresh)
+            except Exception as e:
+                logging.getLogger("rag").warning("[RAG] Embedding cache store failed: %s", e)
+            by_text = dict(zip(uniq, fresh))
+            for i in miss_idx:
+                vectors[i] = by_text[texts[i]]
+        return vectors  # type: ignore[return-value]
+
+    def embed_cache_stats(self) -> Optional[Dict[str, Any]]:
+        return self._embed_cache.stats() if self._embed_cache is not None else None
+
+    def _embed_query(self, query: str) -> List[float]:
+        """Embed a single query, coalescing concurrent callers into one model batch.
+        Repeated questions are served from the normalized query cache."""
+        cache = self._query_emb_cache
+        key = None
+        if cache is not None:
+            key = ((self.settings.embed_provider or "local").lower(), self._embed_model_id(), normalize_query(query))
+            hit = cache.get(key)
+            if hit is not None:
+                return hit
+        if self._query_batcher is None:
+            vec = self._embed_uncached([query])[0]
+        else:
+            vec = self._query_batcher.run(query)
+        if cache is not None:
+            cache.set(key, vec)
+        return vec
+
+    def invalidate_subject(self, subject_id: Optional[str]) -> None:
+        """Drop cached retrieval results that may include chunks of this subject.
+        Results of queries without a subject filter are always dropped. Caches are
+        per process; other workers rely on result_cache_ttl_seconds."""
+        if self._result_cache is None:
+            return
+        if subject_id is None or str(subject_id) == "":
+            self._result_cache.clear()
+        else:
+            self._result_cache.invalidate_tags([str(subject_id), "*"])
+
+    def query_cache_stats(self) -> Optional[Dict[str, Any]]:
+        if self._query_emb_cache is None or self._result_cache is None:
+            return None
+        return {"query_embedding": self._query_emb_cache.stats(), "results": self._result_cache.stats()}
+
+    def query_batcher_stats(self) -> Optional[Dict[str, Any]]:
+        return self._query_batcher.stats() if self._query_batcher is not None else None
+
+    def _embed_ingest(self, texts: List[str]) -> List[List[float]]:
+        # Remote providers are I/O-bound and stay on this thread
+        if (self.settings.embed_provider or "local").lower() == "local" and self._ingest_in_pool():
+            return ingest_pool.run(ingest_pool.embed_local, self.settings.model_dump_json(), texts)
+        return self._embed_uncached(texts)
+
+    def _embed_uncached(self, texts: List[str]) -> List[List[float]]:
         provider = (self.settings.embed_provider or "local").lower()
         if provider == "openai":
-            from openai import OpenAI
             if not self.settings.openai_api_key:
                 raise RuntimeError("OPENAI_API_KEY is required for OpenAI embeddings")
-            client = OpenAI(api_key=self.settings.openai_api_key)
+            client = llm_clients.openai_client(self.settings.openai_api_key)
             model = self.settings.openai_embed_model
             # OpenAI expects one input per call to get batching; we'll batch via single request if supported
             resp = client.embeddings.create(model=model, input=texts)
             return [d.embedding for d in resp.data]
         elif provider == "gemini":
-            import google.generativeai as genai
+            from .gemini_embed import gemini_batch_embed
             if not self.settings.gemini_api_key:
                 raise RuntimeError("GEMINI_API_KEY is required for Gemini embeddings")
-            genai.configure(api_key=self.settings.gemini_api_key)
-            # text-embedding-004 uses embed_content API
-            out: List[List[float]] = []
-            for t in texts:
-                resp = genai.embed_content(model=self.settings.gemini_embed_model, content=t)
-                vec = resp.get("embedding") if isinstance(resp, dict) else None  # type: ignore
-                # Some versions return {"embedding": {"values": [...]}}
-                if isinstance(vec, dict):
-                    vec = vec.get("values") or vec.get("embedding")
-                if not isinstance(vec, list):
-                    raise RuntimeError("Gemini embed_content returned unexpected shape")
-                out.append([float(x) for x in vec])
-            return out
+            # batchEmbedContents: up to 100 texts per call, calls fanned out concurrently
+            return gemini_batch_embed(
+                texts,
+                api_key=self.settings.gemini_api_key,
+                model=self.settings.gemini_embed_model,
+                base_url=self.settings.gemini_base_url,
+                concurrency=self.settings.gemini_embed_concurrency,
+                max_retries=self.settings.gemini_embed_max_retries,
+            )
         else:
             return self._emb_model().encode(texts, normalize_embeddings=True).tolist()
 
@@ -137,92 +561,332 @@ class RAGEngine:
             job_store.update(document_id, stage="chunking", progress=10, message="Đang tách đoạn (chunking)")
         except Exception:
             pass
-        text = self._extract_text(file_bytes=file_bytes, file_name=file_name)
-        if not text.strip():
-            logger.warning("[RAG] Index skip doc_id=%s: no text extracted", document_id)
-            try:
-                from .rag_jobs import job_store
-                job_store.fail(document_id, "Không trích xuất được nội dung")
-            except Exception:
-                pass
-            return {"ok": False, "chunks": 0, "message": "No text extracted"}
-        chunks = self._split_text(text)
-        logger.info("[RAG] Index chunked doc_id=%s chunks=%d chunk_size=%s overlap=%s", document_id, len(chunks), self.settings.chunk_size, self.settings.chunk_overlap)
+        # Standardize metadata shared by every chunk
+        base_meta: Dict[str, Any] = {
+            "document_id": str(document_id),
+            "subject_id": subject_id or "",
+            "user_id": user_id or "",
+            "file_name": file_name,
+        }
+        # derive file extension and source type
         try:
-            from .rag_jobs import job_store
-            job_store.update(document_id, stage="embedding", progress=40, message=f"Đang tạo embedding cho {len(chunks)} đoạn")
+            lower = (file_name or "").lower()
+            ext = lower.split('.')[-1] if '.' in lower else ''
+            if ext:
+                base_meta["file_ext"] = ext
         except Exception:
             pass
-        ids = []
-        metadatas = []
-        documents = []
-        for i, chunk in enumerate(chunks):
-            ids.append(f"{document_id}-{i}-{uuid.uuid4().hex[:8]}")
-            # Standardize metadata per chunk
-            meta = {
-                "document_id": str(document_id),
-                "subject_id": subject_id or "",
-                "user_id": user_id or "",
-                "file_name": file_name,
-            }
-            # derive file extension and source type
+        if isinstance(extra_metadata, dict):
+            # allow: tags (list[str]), author (str), created_at (iso/ts), file_url (str)
+            for k in ("tags", "author", "created_at", "file_url"):
+                if k in extra_metadata:
+                    base_meta[k] = extra_metadata[k]
+            # set source based on file_url presence
             try:
-                lower = (file_name or "").lower()
-                ext = lower.split('.')[-1] if '.' in lower else ''
-                if ext:
-                    meta["file_ext"] = ext
+                base_meta["source"] = "url" if (extra_metadata.get("file_url") or "") else "local"
             except Exception:
                 pass
-            if isinstance(extra_metadata, dict):
-                # allow: tags (list[str]), author (str), created_at (iso/ts), file_url (str)
-                for k in ("tags", "author", "created_at", "file_url"):
-                    if k in extra_metadata:
-                        meta[k] = extra_metadata[k]
-                # set source based on file_url presence
+
+        # Pages are parsed and split on a producer thread while this thread embeds and
+        # stores finished chunks window by window; the bounded queue keeps memory to a
+        # window of chunks instead of the whole document text.
+        # Identical content already indexed under another document: copy its chunks and
+        # vectors instead of parsing and embedding the file again (see content_registry.py)
+        content_sha = hashlib.sha256(file_bytes).hexdigest()
+        reused = self._reusable_chunks(content_sha, exclude_document_id=str(document_id))
+        known: Optional[Dict[str, List[float]]] = None
+        pages: Iterator[Tuple[Optional[int], str]] = iter(())
+        split: Optional[Iterator[Tuple[str, Optional[int], Optional[int]]]] = None
+        pooled = self._ingest_in_pool()
+        n_chunks: Optional[int] = None  # known up front except when streaming pages
+        if reused is not None:
+            reuse_source, reused_chunks = reused
+            known = {c: emb for c, _p, _e, emb in reused_chunks}
+            total_pages = max([e or 0 for _c, _p, e, _emb in reused_chunks] + [1])
+            n_chunks = len(reused_chunks)
+            logger.info("[RAG] Index reusing chunks doc_id=%s source_doc_id=%s chunks=%d", document_id, reuse_source, len(reused_chunks))
+        elif pooled and not self._is_large_pdf(file_bytes, file_name):
+            # One pool worker extracts and splits the whole file (reporting page progress to
+            # job_store) into a spool file read back lazily; large PDFs below are extracted
+            # range-parallel and split in the pool window by window instead
+            spool_dir = os.path.join(self.settings.store_dir, "index_spool")
+            os.makedirs(spool_dir, exist_ok=True)
+            spool = os.path.join(spool_dir, f"{document_id}-{uuid.uuid4().hex}.chunks")
+            total_pages, n_chunks = ingest_pool.run(ingest_pool.split_document, self.settings.model_dump_json(),
+                                              str(document_id), file_bytes, file_name, spool)
+            split = ingest_pool.read_chunk_spool(spool)
+        else:
+            total_pages, pages = self._open_pages(file_bytes=file_bytes, file_name=file_name)
+        pages_done = [0]
+
+        def counted() -> Iterator[Tuple[Optional[int], str]]:
+            for item in pages:
+                yield item
+                pages_done[0] += 1
+
+        max_items, _max_tokens = self._embed_batch_limits()
+        window = max(16, 2 * max_items)
+        chunk_q: "queue.Queue[Any]" = queue.Queue(maxsize=window * 2)
+        stop = threading.Event()
+        done = object()
+
+        def put(item: Any) -> bool:
+            while not stop.is_set():
                 try:
-                    meta["source"] = "url" if (extra_metadata.get("file_url") or "") else "local"
-                except Exception:
-                    pass
-            metadatas.append(meta)
-            documents.append(chunk)
-        # Compute embeddings with explicit failure reporting
+                    chunk_q.put(item, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce() -> None:
+            try:
+                if reused is not None:
+                    source: Iterable[Tuple[str, Optional[int], Optional[int]]] = ((c, p, e) for c, p, e, _emb in reused[1])
+                else:
+                    if split is not None:
+                        source = split
+                    elif pooled:
+                        source = self._split_in_pool(counted())
+                    else:
+                        source = self._split_pages(counted())
+                for item in source:
+                    if not put(item):
+                        return
+                put(done)
+            except BaseException as e:  # surfaced to the consumer
+                put(e)
+
+        threading.Thread(target=produce, name=f"index-parse-{document_id}", daemon=True).start()
+        # Chunk ids are deterministic (document id + content hash), so a re-index only
+        # embeds chunks whose text is new; unchanged chunks that moved just get their
+        # position metadata rewritten, and with replace=True the rest are deleted.
+        ids: List[str] = []
+        occurrences: Dict[str, int] = {}
+        pending: List[Tuple[str, Optional[int], Optional[int]]] = []
+        existing: Optional[Dict[str, Tuple[Any, Tuple[Any, ...]]]] = None
+        moved: List[Tuple[Any, str, Dict[str, Any]]] = []
+        stored: List[str] = []  # chunk ids this run wrote (or tried to), rolled back on failure
+        added = 0
+        dim = None
+        n_batches = 0
         try:
-            embeddings = self._embed_texts(documents)
-        except Exception as e:
-            logger.exception("[RAG] Embedding failed doc_id=%s error=%s", document_id, e)
+            while True:
+                item = chunk_q.get()
+                if item is not done and not isinstance(item, BaseException):
+                    pending.append(item)
+                    if len(pending) < window:
+                        continue
+                elif isinstance(item, BaseException):
+                    raise item
+                if pending:
+                    if not ids:
+                        try:
+                            from .rag_jobs import job_store
+                            job_store.update(document_id, stage="embedding", progress=40, message="Đang tạo embedding")
+                        except Exception:
+                            pass
+                        existing = self._existing_chunks(document_id)
+                        # Unlistable store: fall back to dropping everything before re-adding
+                        if existing is None and replace:
+                            self._delete_document_chunks(document_id, subject_id=subject_id)
+                    start = len(ids)
+                    new_ids: List[str] = []
+                    documents: List[str] = []
+                    metadatas: List[Dict[str, Any]] = []
+                    chunk_indexes: List[int] = []
+                    for i, (c, page, page_end) in enumerate(pending):
+                        cid = _chunk_id(document_id, c, occurrences)
+                        ids.append(cid)
+                        position = _chunk_position(start + i, page, page_end)
+                        if existing is not None and cid in existing:
+                            store_id, old_position = existing[cid]
+                            if old_position != _position_key(position):
+                                moved.append((store_id, cid, position))
+                            continue
+                        meta = dict(base_meta)
+                        meta.update(position)
+                        new_ids.append(cid)
+                        documents.append(c)
+                        metadatas.append(meta)
+                        chunk_indexes.append(start + i)
+                    pending = []
+                    if new_ids:
+                        stored.extend(new_ids)
+                        w_dim, w_batches = self._embed_and_store(
+                            document_id=document_id,
+                            subject_id=subject_id,
+                            user_id=user_id,
+                            file_name=file_name,
+                            ids=new_ids,
+                            documents=documents,
+                            metadatas=metadatas,
+                            chunk_indexes=chunk_indexes,
+                            known=known,
+                        )
+                        dim = dim or w_dim
+                        n_batches += w_batches
+                        added += len(new_ids)
+                    try:
+                        from .rag_jobs import job_store
+                        if n_chunks:
+                            job_store.update(document_id, stage="embedding", progress=40 + (30 * min(len(ids), n_chunks)) // n_chunks,
+                                             message=f"Đã xử lý {len(ids)}/{n_chunks} đoạn, {added} đoạn mới")
+                        else:
+                            job_store.update(document_id, stage="embedding", progress=40 + (30 * min(pages_done[0], total_pages)) // max(1, total_pages),
+                                             message=f"Đã xử lý {len(ids)} đoạn, {added} đoạn mới (trang {pages_done[0]}/{total_pages})")
+                    except Exception:
+                        pass
+                if item is done:
+                    break
+        except BaseException:
+            # never leave a document served with part of the new chunks next to the old ones
+            self._rollback_chunks(document_id, stored, existing, replace=replace)
+            self.invalidate_subject(subject_id)
+            raise
+        finally:
+            stop.set()
+        if not ids:
+            logger.warning("[RAG] Index skip doc_id=%s: no text extracted", document_id)
+            try:
+                from .rag_jobs import job_store
+                job_store.fail(document_id, "Không trích xuất được nội dung")
+            except Exception:
+                pass
+            return {"ok": False, "chunks": 0, "message": "No text extracted"}
+        logger.info("[RAG] Index embeddings stored doc_id=%s provider=%s dim=%s chunks=%d new=%d pages=%d batches=%d", document_id, self.settings.embed_provider, dim, len(ids), added, total_pages, n_batches)
+        if moved:
+            self._update_chunk_positions(document_id, moved)
+            self.invalidate_subject(subject_id)
+        stale: List[Any] = []
+        if replace and existing:
+            current = set(ids)
+            stale = [store_id for cid, (store_id, _pos) in existing.items() if cid not in current]
+        if replace and self._lexical is not None:
+            try:
+                self._lexical.remove_document(document_id, keep_ids=ids)
+            except Exception as e:
+                logger.warning("[RAG] Lexical index cleanup failed doc_id=%s err=%s", document_id, e)
+        if stale:
             try:
                 from .rag_jobs import job_store
-                job_store.fail(document_id, f"Tạo embedding thất bại: {e}")
+                job_store.update(document_id, stage="storing", progress=70, message="Đang dọn các đoạn cũ trong vector store")
             except Exception:
                 pass
-            raise
-        try:
-            dim = len(embeddings[0]) if embeddings and isinstance(embeddings[0], list) else None
-        except Exception:
-            dim = None
-        logger.info("[RAG] Index embeddings computed doc_id=%s provider=%s dim=%s", document_id, self.settings.embed_provider, dim)
-        # If replace=True, delete existing chunks for this document first
+            self._delete_chunk_ids(document_id, stale)
+            self.invalidate_subject(subject_id)
+        summary = {"ok": True, "chunks": len(ids), "added": added, "kept": len(ids) - added, "removed": len(stale), "repositioned": len(moved)}
+        if reused is not None:
+            summary["reused_from"] = reuse_source
+        if self.content_registry is not None:
+            try:
+                # the document's chunks were just rewritten: entries under another scope (older model/chunking) are stale
+                self.content_registry.forget_document(str(document_id))
+                self.content_registry.record_indexed(self._content_scope(), str(document_id), content_sha)
+            except Exception as e:
+                logger.warning("[RAG] Content registry update failed doc_id=%s err=%s", document_id, e)
+        logger.info("[RAG] Index success doc_id=%s chunks=%d added=%d kept=%d removed=%d repositioned=%d",
+                    document_id, len(ids), added, len(ids) - added, len(stale), len(moved))
         try:
-            if replace:
-                if self.settings.store_backend == "chroma":
-                    try:
-                        self._collection.delete(where={"document_id": str(document_id)})  # type: ignore[attr-defined]
-                        logger.info("[RAG] Deleted existing Chroma chunks doc_id=%s", document_id)
-                    except Exception as e:
-                        logger.warning("[RAG] Failed to delete Chroma chunks doc_id=%s err=%s", document_id, e)
-                else:
-                    try:
-                        self._svs.delete_chunks_by_document(str(document_id))  # type: ignore[attr-defined]
-                        logger.info("[RAG] Deleted existing Supabase chunks doc_id=%s", document_id)
-                    except Exception as e:
-                        logger.warning("[RAG] Failed to delete Supabase chunks doc_id=%s err=%s", document_id, e)
+            from .rag_jobs import job_store
+            job_store.success(document_id, result=summary)
         except Exception:
             pass
+        return summary
+
+    def _embed_and_store(self, *,
+                         document_id: str,
+                         subject_id: Optional[str],
+                         user_id: Optional[str],
+                         file_name: str,
+                         ids: List[str],
+                         documents: List[str],
+                         metadatas: List[Dict[str, Any]],
+                         chunk_indexes: List[int],
+                         known: Optional[Dict[str, List[float]]] = None) -> Tuple[Optional[int], int]:
+        """Embed and store one window of chunks in length-sorted, size-bounded batches so
+        per-request payloads stay bounded; texts in `known` reuse those vectors.
+        Returns (embedding dim, number of batches)."""
+        logger = logging.getLogger("rag")
+        batches = self._plan_embed_batches(documents)
+        logger.info("[RAG] Index embedding plan doc_id=%s provider=%s chunks=%d batches=%d", document_id, self.settings.embed_provider, len(documents), len(batches))
+        dim = None
+        for n, idxs in enumerate(batches, start=1):
+            batch_docs = [documents[i] for i in idxs]
+            # Compute embeddings with explicit failure reporting
+            try:
+                if known is not None and all(d in known for d in batch_docs):
+                    embeddings = [known[d] for d in batch_docs]
+                else:
+                    embeddings = self._embed_texts(batch_docs, ingest=True)
+            except Exception as e:
+                logger.exception("[RAG] Embedding failed doc_id=%s batch=%d/%d error=%s", document_id, n, len(batches), e)
+                try:
+                    from .rag_jobs import job_store
+                    job_store.fail(document_id, f"Tạo embedding thất bại: {e}")
+                except Exception:
+                    pass
+                raise
+            if dim is None and embeddings:
+                dim = len(embeddings[0])
+            self._store_chunks(
+                document_id=document_id,
+                subject_id=subject_id,
+                user_id=user_id,
+                file_name=file_name,
+                ids=[ids[i] for i in idxs],
+                documents=batch_docs,
+                metadatas=[metadatas[i] for i in idxs],
+                embeddings=embeddings,
+                chunk_indexes=[chunk_indexes[i] for i in idxs],
+            )
+        return dim, len(batches)
+
+    def _embed_batch_limits(self) -> Tuple[int, int]:
+        provider = (self.settings.embed_provider or "local").lower()
+        max_items, max_tokens = _EMBED_BATCH_LIMITS.get(provider, _EMBED_BATCH_LIMITS["local"])
+        if self.settings.embed_batch_size > 0:
+            max_items = min(max_items, self.settings.embed_batch_size)
+        if self.settings.embed_batch_max_tokens > 0:
+            max_tokens = min(max_tokens, self.settings.embed_batch_max_tokens)
+        return max_items, max_tokens
 
+    def _plan_embed_batches(self, texts: List[str]) -> List[List[int]]:
+        """Group chunk indexes into batches of similar length (less padding), bounded by
+        the provider's max inputs and estimated tokens per request."""
+        max_items, max_tokens = self._embed_batch_limits()
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        batches: List[List[int]] = []
+        cur: List[int] = []
+        cur_tokens = 0
+        for i in order:
+            tok = estimate_tokens(texts[i])
+            if cur and (len(cur) >= max_items or cur_tokens + tok > max_tokens):
+                batches.append(cur)
+                cur, cur_tokens = [], 0
+            cur.append(i)
+            cur_tokens += tok
+        if cur:
+            batches.append(cur)
+        return batches
+
+    def _store_chunks(self, *,
+                      document_id: str,
+                      subject_id: Optional[str],
+                      user_id: Optional[str],
+                      file_name: str,
+                      ids: List[str],
+                      documents: List[str],
+                      metadatas: List[Dict[str, Any]],
+                      embeddings: List[List[float]],
+                      chunk_indexes: List[int]) -> None:
+        logger = logging.getLogger("rag")
+        self.invalidate_subject(subject_id)
         if self.settings.store_backend == "chroma":
             try:
-                self._collection.add(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
-                logger.info("[RAG] Index stored (chroma) doc_id=%s chunks=%d", document_id, len(chunks))
+                # upsert: chunk ids are deterministic, a re-added chunk replaces itself
+                self._collection.upsert(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings)
+                logger.info("[RAG] Index stored (chroma) doc_id=%s chunks=%d", document_id, len(documents))
             except Exception as e:
                 logger.exception("[RAG] Index store failed (chroma) doc_id=%s error=%s", document_id, e)
                 try:
@@ -231,14 +895,21 @@ class RAGEngine:
                 except Exception:
                     pass
                 raise
-        else:
-            # Supabase pgvector storage
+        elif self.settings.store_backend == "local":
             try:
+                self._lvs.add(ids=ids, documents=documents, metadatas=metadatas, embeddings=embeddings, chunk_indexes=chunk_indexes)
+                logger.info("[RAG] Index stored (local) doc_id=%s chunks=%d", document_id, len(documents))
+            except Exception as e:
+                logger.exception("[RAG] Index store failed (local) doc_id=%s error=%s", document_id, e)
                 try:
                     from .rag_jobs import job_store
-                    job_store.update(document_id, stage="storing", progress=70, message="Đang lưu embeddings vào vector store")
+                    job_store.fail(document_id, f"Lưu vào local store thất bại: {e}")
                 except Exception:
                     pass
+                raise
+        else:
+            # Supabase pgvector storage
+            try:
                 logger.info("[RAG] Supabase add_chunks doc_id=%s (type=%s) subject_id=%s (type=%s) file=%s chunks=%d", document_id, type(document_id).__name__, subject_id, type(subject_id).__name__ if subject_id is not None else None, file_name, len(documents))
                 self._svs.add_chunks(
                     document_id=document_id,
@@ -247,6 +918,9 @@ class RAGEngine:
                     file_name=file_name,
                     chunks=documents,
                     embeddings=embeddings,
+                    chunk_indexes=chunk_indexes,
+                    metadatas=metadatas,
+                    chunk_keys=ids,
                 )
             except Exception as e:
                 # Bubble up with context so caller can log
@@ -257,34 +931,242 @@ class RAGEngine:
                 except Exception:
                     pass
                 raise RuntimeError(f"RAG Supabase add_chunks failed for document {document_id}: {e}")
-        logger.info("[RAG] Index success doc_id=%s chunks=%d", document_id, len(chunks))
+        if self._lexical is not None:
+            # Best-effort: a stale lexical index only degrades hybrid ranking
+            try:
+                self._lexical.add(ids, documents, metadatas)
+            except Exception as e:
+                logger.warning("[RAG] Lexical index update failed doc_id=%s err=%s", document_id, e)
+
+    def _existing_chunks(self, document_id: str) -> Optional[Dict[str, Tuple[Any, Tuple[Any, ...]]]]:
+        """Chunks currently stored for a document: chunk id -> (store row id, position key),
+        or None if they cannot be listed. Rows indexed before chunk ids were deterministic
+        never match a fresh id and are treated as stale."""
         try:
-            from .rag_jobs import job_store
-            job_store.success(document_id)
-        except Exception:
-            pass
-        return {"ok": True, "chunks": len(chunks)}
-
-    async def index_document_from_url(self, *,
-                                      document_id: str,
-                                      subject_id: Optional[str],
-                                      user_id: Optional[str],
-                                      url: str,
-                                      file_name: Optional[str] = None,
-                                      extra_metadata: Optional[Dict[str, Any]] = None,
-                                      replace: bool = False) -> Dict[str, Any]:
-        async with httpx.AsyncClient(timeout=60) as client:
-            resp = await client.get(url)
-            resp.raise_for_status()
-            content = resp.content
-        name = file_name or url.split("?")[0].split("/")[-1] or "file.bin"
-        return self.index_document(document_id=document_id, subject_id=subject_id, user_id=user_id, file_bytes=content, file_name=name, extra_metadata=extra_metadata, replace=replace)
+            if self.settings.store_backend == "chroma":
+                got = self._collection.get(where={"document_id": str(document_id)}, include=["metadatas"])  # type: ignore[attr-defined]
+                got = got or {}
+                return {cid: (cid, _position_key(m or {})) for cid, m in zip(got.get("ids") or [], got.get("metadatas") or [])}
+            if self.settings.store_backend == "local":
+                return {cid: (cid, _position_key(m)) for cid, m in self._lvs.list_chunks_by_document(str(document_id))}
+            rows = self._svs.list_chunk_keys_by_document(str(document_id))  # type: ignore[attr-defined]
+            if rows is None:
+                return None
+            return {(r.get("chunk_key") or f"sb-{r['id']}"): (r["id"], _position_key(r)) for r in rows}
+        except Exception as e:
+            logging.getLogger("rag").warning("[RAG] Failed to list existing chunks doc_id=%s err=%s", document_id, e)
+            return None
+
+    def _update_chunk_positions(self, document_id: str, moved: List[Tuple[Any, str, Dict[str, Any]]]) -> None:
+        """Rewrite chunk_index/page of unchanged chunks that moved within the document."""
+        logger = logging.getLogger("rag")
+        try:
+            if self.settings.store_backend == "chroma":
+                self._collection.update(ids=[cid for _sid, cid, _p in moved], metadatas=[p for _sid, _cid, p in moved])  # type: ignore[attr-defined]
+            elif self.settings.store_backend == "local":
+                self._lvs.update_chunk_metadata({cid: p for _sid, cid, p in moved})
+            else:
+                self._svs.update_chunk_positions([{"id": sid, **p} for sid, _cid, p in moved])  # type: ignore[attr-defined]
+            if self._lexical is not None:
+                self._lexical.update_chunk_metadata({cid: p for _sid, cid, p in moved})
+            logger.info("[RAG] Repositioned unchanged chunks doc_id=%s count=%d", document_id, len(moved))
+        except Exception as e:
+            logger.warning("[RAG] Failed to reposition chunks doc_id=%s err=%s", document_id, e)
+
+    def _rollback_chunks(self, document_id: str, chunk_ids: List[str],
+                         existing: Optional[Dict[str, Tuple[Any, Tuple[Any, ...]]]], *, replace: bool) -> None:
+        """Remove the chunks a failed index run added, keeping the document's previous ones."""
+        if not chunk_ids:
+            return
+        logger = logging.getLogger("rag")
+        try:
+            if self._lexical is not None:
+                self._lexical.remove_ids(chunk_ids)
+            if self.settings.store_backend == "chroma":
+                self._collection.delete(ids=chunk_ids)  # type: ignore[attr-defined]
+            elif self.settings.store_backend == "local":
+                self._lvs.delete_ids(chunk_ids)
+            elif existing is None:
+                # no chunk keys: new rows can't be told apart, which is only safe to undo when
+                # the previous chunks were already dropped before re-adding (replace=True)
+                if not replace:
+                    logger.warning("[RAG] Partial index of doc_id=%s kept: rag_chunks has no chunk_key column", document_id)
+                    return
+                self._svs.delete_chunks_by_document(str(document_id))  # type: ignore[attr-defined]
+            else:
+                self._svs.delete_chunks_by_keys(str(document_id), chunk_ids)  # type: ignore[attr-defined]
+            logger.info("[RAG] Rolled back partial index doc_id=%s chunks=%d", document_id, len(chunk_ids))
+        except Exception as e:
+            logger.warning("[RAG] Rollback of partial index failed doc_id=%s err=%s", document_id, e)
+
+    def _delete_chunk_ids(self, document_id: str, chunk_ids: List[Any]) -> None:
+        logger = logging.getLogger("rag")
+        try:
+            if self.settings.store_backend == "chroma":
+                self._collection.delete(ids=chunk_ids)  # type: ignore[attr-defined]
+            elif self.settings.store_backend == "local":
+                self._lvs.delete_ids(chunk_ids)
+            else:
+                self._svs.delete_chunks_by_ids(chunk_ids)  # type: ignore[attr-defined]
+            logger.info("[RAG] Deleted previous chunks doc_id=%s count=%d", document_id, len(chunk_ids))
+        except Exception as e:
+            logger.warning("[RAG] Failed to delete previous chunks doc_id=%s err=%s", document_id, e)
+
+    def _content_scope(self) -> str:
+        """Registry scope: chunks are only reusable within the same store, chunking and
+        embedding model (vectors of another model live in a different space)."""
+        s = self.settings
+        return (f"{s.store_backend}:{s.collection_name}:{s.chunk_size}/{s.chunk_overlap}/{s.chunk_anchor_every}/{s.chunk_anchor_min}"
+                f":{(s.embed_provider or 'local').lower()}/{self._embed_model_id(ingest=True)}")
+
+    def _reusable_chunks(self, content_sha: str, exclude_document_id: str
+                         ) -> Optional[Tuple[str, List[Tuple[str, Optional[int], Optional[int], List[float]]]]]:
+        """(source document id, its chunks with vectors) for content already indexed under
+        another document, or None."""
+        if self.content_registry is None:
+            return None
+        try:
+            candidates = self.content_registry.indexed_documents(self._content_scope(), content_sha)
+        except Exception as e:
+            logging.getLogger("rag").warning("[RAG] Content registry lookup failed: %s", e)
+            return None
+        for source in candidates:
+            if source == exclude_document_id:
+                continue
+            chunks = self._load_document_chunks(source)
+            if chunks:
+                return source, chunks
+            # source was deleted or re-indexed with other content
+            self.content_registry.forget_document(source, scope=self._content_scope())
+        return None
+
+    def _load_document_chunks(self, document_id: str) -> Optional[List[Tuple[str, Optional[int], Optional[int], List[float]]]]:
+        """A document's stored chunks in order as (text, page, page_end, vector), or None if
+        they cannot be read back (e.g. indexed before chunk positions were stored)."""
+        try:
+            if self.settings.store_backend == "chroma":
+                got = self._collection.get(where={"document_id": str(document_id)}, include=["documents", "metadatas", "embeddings"])  # type: ignore[attr-defined]
+                got = got or {}
+                rows = [(t, m or {}, list(map(float, v))) for t, m, v in zip(got.get("documents") or [], got.get("metadatas") or [], got.get("embeddings") or [])]
+            elif self.settings.store_backend == "local":
+                rows = self._lvs.get_document_vectors(str(document_id))
+            else:
+                rows = self._svs.get_document_vectors(str(document_id))  # type: ignore[attr-defined]
+        except Exception as e:
+            logging.getLogger("rag").warning("[RAG] Failed to read chunks for reuse doc_id=%s err=%s", document_id, e)
+            return None
+        if not rows or any(m.get("chunk_index") is None for _t, m, _v in rows):
+            return None
+        rows.sort(key=lambda r: int(r[1]["chunk_index"]))
+        return [(t, m.get("page"), m.get("page_end"), v) for t, m, v in rows]
+
+    def content_registry_stats(self) -> Optional[Dict[str, Any]]:
+        return self.content_registry.stats() if self.content_registry is not None else None
+
+    def update_document_metadata(self, document_id: str, meta: Dict[str, Any], subject_id: Optional[str] = None) -> None:
+        """Propagate edited document metadata (author, tags, created_at, file_url) to its
+        stored chunks so metadata filters see the new values."""
+        logger = logging.getLogger("rag")
+        fields = {k: meta[k] for k in ("author", "tags", "created_at", "file_url") if k in meta}
+        if not fields:
+            return
+        self.invalidate_subject(subject_id)
+        if "file_url" in fields:
+            fields["source"] = "url" if fields["file_url"] else "local"
+        try:
+            if self.settings.store_backend == "chroma":
+                got = self._collection.get(where={"document_id": str(document_id)}, include=[])  # type: ignore[attr-defined]
+                ids = list((got or {}).get("ids") or [])
+                # Chroma rejects None metadata values
+                clean = {k: v for k, v in fields.items() if v is not None}
+                if ids and clean:
+                    self._collection.update(ids=ids, metadatas=[clean] * len(ids))  # type: ignore[attr-defined]
+            elif self.settings.store_backend == "local":
+                self._lvs.update_document_metadata(str(document_id), fields)
+            else:
+                self._svs.update_document_metadata(str(document_id), fields)  # type: ignore[attr-defined]
+            if self._lexical is not None:
+                self._lexical.update_document_metadata(str(document_id), fields)
+        except Exception as e:
+            logger.warning("[RAG] Failed to sync chunk metadata doc_id=%s err=%s", document_id, e)
+
+    def delete_document(self, document_id: str, subject_id: Optional[str] = None) -> None:
+        """Drop every stored chunk of a document (vector store and lexical index)."""
+        self._delete_document_chunks(document_id, subject_id=subject_id)
+        if self.content_registry is not None:
+            self.content_registry.forget_document(str(document_id))
+
+    def _delete_document_chunks(self, document_id: str, subject_id: Optional[str] = None) -> None:
+        logger = logging.getLogger("rag")
+        # Unknown subject -> invalidate every cached result
+        self.invalidate_subject(subject_id)
+        if self._lexical is not None:
+            try:
+                self._lexical.remove_document(document_id)
+            except Exception as e:
+                logger.warning("[RAG] Failed to delete lexical entries doc_id=%s err=%s", document_id, e)
+        if self.settings.store_backend == "chroma":
+            try:
+                self._collection.delete(where={"document_id": str(document_id)})  # type: ignore[attr-defined]
+                logger.info("[RAG] Deleted existing Chroma chunks doc_id=%s", document_id)
+            except Exception as e:
+                logger.warning("[RAG] Failed to delete Chroma chunks doc_id=%s err=%s", document_id, e)
+        elif self.settings.store_backend == "local":
+            try:
+                self._lvs.delete_document(str(document_id))
+                logger.info("[RAG] Deleted existing local chunks doc_id=%s", document_id)
+            except Exception as e:
+                logger.warning("[RAG] Failed to delete local chunks doc_id=%s err=%s", document_id, e)
+        else:
+            try:
+                self._svs.delete_chunks_by_document(str(document_id))  # type: ignore[attr-defined]
+                logger.info("[RAG] Deleted existing Supabase chunks doc_id=%s", document_id)
+            except Exception as e:
+                logger.warning("[RAG] Failed to delete Supabase chunks doc_id=%s err=%s", document_id, e)
 
     # -------- Retrieval & QA --------
     def retrieve(self, query: str, *, top_k: int = 5, subject_id: Optional[str] = None, subject_ids: Optional[List[str]] = None, user_id: Optional[str] = None, tags: Optional[List[str]] = None, author: Optional[str] = None, time_from: Optional[str] = None, time_to: Optional[str] = None, source: Optional[str] = None, file_type: Optional[str] = None, page_from: Optional[int] = None, page_to: Optional[int] = None) -> List[Dict[str, Any]]:
+        filters: Dict[str, Any] = dict(
+            subject_id=subject_id, subject_ids=subject_ids, user_id=user_id, tags=tags, author=author,
+            time_from=time_from, time_to=time_to, source=source, file_type=file_type,
+            page_from=page_from, page_to=page_to,
+        )
+        query_emb = self._embed_query(query)
+        cache = self._result_cache
+        if cache is None:
+            return self._retrieve_uncached(query, query_emb, top_k=top_k, **filters)
+        key = (
+            hashlib.sha1(array("f", query_emb).tobytes()).hexdigest(),
+            repr(sorted((k, v) for k, v in filters.items() if v is not None)),
+            int(top_k),
+        )
+        hit = cache.get(key)
+        if hit is not None:
+            logging.getLogger("rag").info("[RAG] Retrieve cache hit top_k=%s subj=%s", top_k, subject_id)
+            return copy.deepcopy(hit)
+        outs = self._retrieve_uncached(query, query_emb, top_k=top_k, **filters)
+        if subject_ids:
+            cache_tags = [str(x) for x in subject_ids]
+        elif subject_id is not None and str(subject_id) != "":
+            cache_tags = [str(subject_id)]
+        else:
+            cache_tags = ["*"]
+        cache.set(key, copy.deepcopy(outs), tags=cache_tags)
+        return outs
+
+    def _retrieve_uncached(self, query: str, query_emb: List[float], *, top_k: int = 5, subject_id: Optional[str] = None, subject_ids: Optional[List[str]] = None, user_id: Optional[str] = None, tags: Optional[List[str]] = None, author: Optional[str] = None, time_from: Optional[str] = None, time_to: Optional[str] = None, source: Optional[str] = None, file_type: Optional[str] = None, page_from: Optional[int] = None, page_to: Optional[int] = None) -> List[Dict[str, Any]]:
         logger = logging.getLogger("rag")
         backend = self.settings.store_backend
         logger.info("[RAG] Retrieve start backend=%s top_k=%s subj=%s user=%s", backend, top_k, subject_id, user_id)
+        # Hybrid mode widens the vector candidate pool before fusion with BM25 hits
+        fetch_k = max(top_k, self.settings.hybrid_candidates) if self._lexical is not None else top_k
+        lexical_filters: Dict[str, Any] = dict(
+            subject_id=subject_id, subject_ids=subject_ids, tags=tags, author=author,
+            time_from=time_from, time_to=time_to, source=source, file_type=file_type,
+            page_from=page_from, page_to=page_to,
+            # the Supabase RPC filters by owner; Chroma and the local store ignore user_id
+            user_id=user_id if backend == "supabase" else None,
+        )
         if backend == "chroma":
             if not self._collection:
                 raise RuntimeError("Chroma collection not initialized")
@@ -313,21 +1195,20 @@ class RAGEngine:
                     time_clause["$lte"] = time_to
                 if time_clause:
                     where["created_at"] = time_clause
-                # page range filter if per-chunk page metadata exists
-                if page_from is not None or page_to is not None:
-                    p: Dict[str, Any] = {}
-                    if page_from is not None:
-                        p["$gte"] = page_from
-                    if page_to is not None:
-                        p["$lte"] = page_to
-                    where["page"] = p
+                # page range: chunks [page, page_end] overlapping [page_from, page_to]
+                if page_from is not None:
+                    where["page_end"] = {"$gte": page_from}
+                if page_to is not None:
+                    where["page"] = {"$lte": page_to}
+                # Chroma accepts a single top-level condition; combine several with $and
+                if len(where) > 1:
+                    where = {"$and": [{k: v} for k, v in where.items()]}
             except Exception:
                 pass
             try:
-                query_emb = self._embed_texts([query])[0]
                 results = self._collection.query(
                     query_embeddings=[query_emb],
-                    n_results=max(1, min(top_k, 20)),
+                    n_results=max(1, min(fetch_k, 50 if self._lexical is not None else 20)),
                     where=where or None,
                 )
             except Exception as e:
@@ -348,47 +1229,73 @@ class RAGEngine:
                     "score": float(1 - dist) if dist is not None else None,
                     "citation": {"title": title, "url": url, "page": page, "snippet": d},
                 })
-            outs = self._maybe_rerank(query, outs, top_k)
+            outs, agree = self._fuse_lexical(query, outs, top_k=top_k, filters=lexical_filters)
+            outs = self._maybe_rerank(query, outs, top_k, skip=agree)
             logger.info("[RAG] Retrieve success backend=chroma results=%d", len(outs))
             return outs
+        elif backend == "local":
+            if subject_ids:
+                subjects: Optional[List[str]] = [str(x) for x in subject_ids]
+            elif subject_id is not None:
+                subjects = [str(subject_id)]
+            else:
+                subjects = None
+            rest = {k: v for k, v in lexical_filters.items() if k not in ("subject_id", "subject_ids", "user_id") and v is not None}
+            try:
+                hits = self._lvs.query(
+                    query_embedding=query_emb,
+                    top_k=fetch_k,
+                    subject_ids=subjects,
+                    predicate=(lambda m: _meta_matches(m, **rest)) if rest else None,
+                )
+            except Exception as e:
+                logger.exception("[RAG] Retrieve failed (local) error=%s", e)
+                raise
+            outs = []
+            for h in hits:
+                m = h["metadata"]
+                outs.append({
+                    "text": h["text"],
+                    "metadata": m,
+                    "score": h["score"],
+                    "citation": {"title": m.get("file_name"), "url": m.get("file_url"), "page": m.get("page"), "snippet": h["text"]},
+                })
+            outs, agree = self._fuse_lexical(query, outs, top_k=top_k, filters=lexical_filters)
+            outs = self._maybe_rerank(query, outs, top_k, skip=agree)
+            logger.info("[RAG] Retrieve success backend=local results=%d", len(outs))
+            return outs
         else:
             try:
-                q_emb = self._embed_texts([query])[0]
-                outs = self._svs.query(query_embedding=q_emb, top_k=top_k, subject_id=subject_id, user_id=user_id)
+                # Filters pushed into match_rag_chunks_filtered: full top_k in one round-trip
+                pushed = self._svs.query_filtered(
+                    query_embedding=query_emb,
+                    top_k=fetch_k,
+                    subject_ids=subject_ids or ([subject_id] if subject_id not in (None, "") else None),
+                    user_id=user_id, author=author, tags=tags, time_from=time_from, time_to=time_to,
+                    source=source, file_type=file_type, page_from=page_from, page_to=page_to,
+                )
+                if pushed is not None:
+                    for o in pushed:
+                        m = o["metadata"]
+                        o["citation"] = {"title": m.get("file_name"), "url": m.get("file_url"), "page": m.get("page"), "snippet": o.get("text")}
+                    outs, agree = self._fuse_lexical(query, pushed, top_k=top_k, filters=lexical_filters)
+                    outs = self._maybe_rerank(query, outs, top_k, skip=agree)
+                    logger.info("[RAG] Retrieve success backend=supabase (filtered rpc) results=%d", len(outs))
+                    return outs
+                outs = self._svs.query(query_embedding=query_emb, top_k=fetch_k, subject_id=subject_id, user_id=user_id)
                 # Enrich with document metadata for filtering and citation
                 try:
-                    from .supabase_client import get_supabase
-                    sb = get_supabase()
-                    doc_ids = sorted({m.get("document_id") for m in (o.get("metadata") or {} for o in outs) if m.get("document_id") is not None})
-                    doc_meta: Dict[Any, Dict[str, Any]] = {}
-                    if doc_ids:
-                        res = sb.table("documents").select("id,author,tags,created_at,file_url,subject_id,name,file_path").in_("id", doc_ids).execute()
-                        for row in res.data or []:
-                            doc_meta[row["id"]] = row
+                    doc_ids = sorted({str(m.get("document_id")) for m in (o.get("metadata") or {} for o in outs) if m.get("document_id") is not None})
+                    # Cached document rows; a cold subject is prefetched in one query
+                    doc_meta = doc_meta_cache.get_many(doc_ids, subject_id=subject_id or None) if doc_ids else {}
                     # attach and filter
                     filtered: List[Dict[str, Any]] = []
                     for o in outs:
                         m = o.get("metadata") or {}
                         did = m.get("document_id")
-                        drow = doc_meta.get(did) if did in doc_meta else None
+                        drow = doc_meta.get(str(did)) if did is not None else None
                         if drow:
-                            m["author"] = drow.get("author")
-                            m["tags"] = drow.get("tags") or []
-                            m["created_at"] = drow.get("created_at")
-                            m["file_url"] = drow.get("file_url")
-                            m["subject_id"] = drow.get("subject_id") or m.get("subject_id")
-                            # infer file_ext/source from name/url
-                            try:
-                                fname = (drow.get("file_path") or drow.get("name") or "").lower()
-                                ext = fname.split('.')[-1] if '.' in fname else ''
-                                if ext:
-                                    m["file_ext"] = ext
-                            except Exception:
-                                pass
-                            try:
-                                m["source"] = "url" if (m.get("file_url") or "") else "local"
-                            except Exception:
-                                pass
+                            _apply_doc_row(m, drow)
                         # apply filters
                         if author and (m.get("author") or "") != author:
                             continue
@@ -440,47 +1347,167 @@ class RAGEngine:
                             "page": m.get("page"),
                             "snippet": o.get("text"),
                         }
-                outs = self._maybe_rerank(query, outs, top_k)
+                outs, agree = self._fuse_lexical(query, outs, top_k=top_k, filters=lexical_filters)
+                outs = self._maybe_rerank(query, outs, top_k, skip=agree)
                 logger.info("[RAG] Retrieve success backend=supabase results=%d", len(outs))
                 return outs
             except Exception as e:
                 logger.exception("[RAG] Retrieve failed (supabase) error=%s", e)
                 raise
 
-    def answer(self, query: str, contexts: List[str]) -> str:
-        provider = (self.settings.llm_provider or "none").lower()
-        prompt = (
+    def _fuse_lexical(self, query: str, outs: List[Dict[str, Any]], *, top_k: int, filters: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], bool]:
+        """Merge BM25 hits into the vector candidates with reciprocal rank fusion.
+        Returns (fused candidates, whether both retrievers agree on the top hit)."""
+        if self._lexical is None:
+            return outs, False
+        s = self.settings
+        if filters.get("subject_ids"):
+            subjects: Optional[List[str]] = [str(x) for x in filters["subject_ids"]]
+        elif filters.get("subject_id") is not None:
+            subjects = [str(filters["subject_id"])]
+        else:
+            subjects = None
+        try:
+            hits = self._lexical.search(query, limit=max(top_k, s.hybrid_candidates), subject_ids=subjects, k1=s.bm25_k1, b=s.bm25_b)
+        except Exception as e:
+            logging.getLogger("rag").warning("[RAG] Lexical search failed; using vector results only: %s", e)
+            return outs, False
+        if s.store_backend == "supabase":
+            # chunk metadata only has what was known at index time: filter on the current documents rows
+            doc_ids = sorted({str(h["metadata"].get("document_id")) for h in hits if h["metadata"].get("document_id") is not None})
+            try:
+                doc_meta = doc_meta_cache.get_many(doc_ids, subject_id=filters.get("subject_id") or None) if doc_ids else {}
+            except Exception as e:
+                logging.getLogger("rag").warning("[RAG] Document metadata lookup failed; using vector results only: %s", e)
+                return outs, False
+            for h in hits:
+                drow = doc_meta.get(str(h["metadata"].get("document_id")))
+                if drow:
+                    _apply_doc_row(h["metadata"], drow)
+        hits = [h for h in hits if _meta_matches(h["metadata"], **filters)]
+
+        def key(o: Dict[str, Any]) -> str:
+            # Chunk ids differ between stores (Supabase row ids), so match on document + content
+            m = o.get("metadata") or {}
+            return f"{m.get('document_id')}|{hashlib.sha1((o.get('text') or '').encode('utf-8')).hexdigest()}"
+
+        by_key: Dict[str, Dict[str, Any]] = {}
+        vec_rank = list(dict.fromkeys(key(o) for o in outs))
+        for o in outs:
+            by_key.setdefault(key(o), o)
+        lex_rank: List[str] = []
+        for h in hits:
+            k = key(h)
+            if k in lex_rank:
+                continue
+            lex_rank.append(k)
+            if k in by_key:
+                by_key[k]["lexical_score"] = h["lexical_score"]
+                continue
+            m = h["metadata"]
+            by_key[k] = {
+                "text": h["text"],
+                "metadata": m,
+                "score": None,
+                "lexical_score": h["lexical_score"],
+                "citation": {"title": m.get("file_name"), "url": m.get("file_url"), "page": m.get("page"), "snippet": h["text"]},
+            }
+        fused = reciprocal_rank_fusion([vec_rank, lex_rank], k=s.rrf_k)
+        ranked = sorted(fused, key=lambda k: fused[k], reverse=True)
+        result = []
+        for k in ranked:
+            o = by_key[k]
+            o["fusion_score"] = round(fused[k], 6)
+            result.append(o)
+        agree = bool(vec_rank and lex_rank and vec_rank[0] == lex_rank[0])
+        logging.getLogger("rag").info("[RAG] Hybrid fusion vector=%d lexical=%d fused=%d agree=%s", len(vec_rank), len(lex_rank), len(result), agree)
+        return result, agree
+
+    def local_store_stats(self) -> Optional[Dict[str, Any]]:
+        return self._lvs.stats() if self._lvs is not None else None
+
+    def lexical_stats(self) -> Optional[Dict[str, Any]]:
+        return self._lexical.stats() if self._lexical is not None else None
+
+    def rebuild_lexical_index(self) -> int:
+        """Backfill the BM25 index from the vector store (chunks indexed before hybrid search was enabled)."""
+        if self._lexical is None:
+            raise RuntimeError("hybrid_search is disabled")
+        self._lexical.clear()
+        self.invalidate_subject(None)
+        count = 0
+        if self.settings.store_backend == "chroma":
+            offset = 0
+            while True:
+                got = self._collection.get(include=["documents", "metadatas"], limit=1000, offset=offset)  # type: ignore[attr-defined]
+                ids = list(got.get("ids") or [])
+                if not ids:
+                    break
+                self._lexical.add(ids, list(got.get("documents") or []), [m or {} for m in (got.get("metadatas") or [])])
+                count += len(ids)
+                offset += len(ids)
+        elif self.settings.store_backend == "local":
+            rows = list(self._lvs.iter_chunks())
+            for i in range(0, len(rows), 1000):
+                part = rows[i:i + 1000]
+                self._lexical.add([r["id"] for r in part], [r["text"] for r in part], [r["metadata"] for r in part])
+            count = len(rows)
+        else:
+            batch: List[Dict[str, Any]] = []
+
+            def flush() -> None:
+                self._lexical.add(  # type: ignore[union-attr]
+                    [f"sb-{r['id']}" for r in batch],
+                    [r.get("content") or "" for r in batch],
+                    [{k: ("" if r.get(k) is None else str(r.get(k))) for k in ("document_id", "subject_id", "user_id", "file_name")} for r in batch],
+                )
+
+            for row in self._svs.iter_chunks():  # type: ignore[union-attr]
+                batch.append(row)
+                if len(batch) >= 1000:
+                    flush()
+                    count += len(batch)
+                    batch = []
+            if batch:
+                flush()
+                count += len(batch)
+        logging.getLogger("rag").info("[RAG] Lexical index rebuilt chunks=%d", count)
+        return count
+
+    @staticmethod
+    def _answer_prompt(query: str, contexts: List[str]) -> str:
+        return (
             "Bạn là trợ lý hữu ích. Chỉ sử dụng NGỮ CẢNH được cung cấp để trả lời. "
             "Nếu không có trong ngữ cảnh, hãy nói bạn không biết. Trả lời bằng TIẾNG VIỆT.\n\n"
             f"Câu hỏi: {query}\n\n"
             "Ngữ cảnh:\n" + "\n---\n".join(contexts) + "\n\nTrả lời:"
         )
+
+    def answer(self, query: str, contexts: List[str]) -> str:
+        provider = (self.settings.llm_provider or "none").lower()
+        prompt = self._answer_prompt(query, contexts)
         if provider == "openai":
             try:
-                from openai import OpenAI
                 if not self.settings.openai_api_key:
                     raise RuntimeError("OPENAI_API_KEY is required for OpenAI LLM")
-                client = OpenAI(api_key=self.settings.openai_api_key)
+                client = llm_clients.openai_client(self.settings.openai_api_key)
                 r = client.chat.completions.create(model=self.settings.openai_chat_model, messages=[{"role": "user", "content": prompt}])
                 return (r.choices[0].message.content or "").strip()
             except Exception:
                 return self._simple_extractive_answer(query, contexts)
         if provider == "gemini":
             try:
-                import google.generativeai as genai
                 if not self.settings.gemini_api_key:
                     raise RuntimeError("GEMINI_API_KEY is required for Gemini LLM")
-                genai.configure(api_key=self.settings.gemini_api_key)
-                model = genai.GenerativeModel(self.settings.gemini_chat_model)
+                model = llm_clients.gemini_model(self.settings.gemini_api_key, self.settings.gemini_chat_model)
                 r = model.generate_content(prompt)
                 return (getattr(r, "text", None) or "").strip()
             except Exception:
                 return self._simple_extractive_answer(query, contexts)
         if provider == "ollama":
             try:
-                import ollama  # type: ignore
                 model = os.environ.get("OLLAMA_MODEL", "llama3.1:8b")
-                r = ollama.chat(model=model, messages=[{"role": "user", "content": prompt}])
+                r = llm_clients.ollama_client().chat(model=model, messages=[{"role": "user", "content": prompt}])
                 content = r.get("message", {}).get("content")
                 if isinstance(content, str) and content.strip():
                     return content.strip()
@@ -489,6 +1516,85 @@ class RAGEngine:
         # none or fallback
         return self._simple_extractive_answer(query, contexts)
 
+    # -------- Async facade (for async def handlers) --------
+    async def aretrieve(self, query: str, **kwargs: Any) -> List[Dict[str, Any]]:
+        """`retrieve` on the bounded "retrieve" pool, off the event loop."""
+        return await get_executor("retrieve", self.settings.retrieve_concurrency).run(self.retrieve, query, **kwargs)
+
+    async def aanswer(self, query: str, contexts: List[str]) -> str:
+        """`answer` through the provider's native async client (same fallbacks as `answer`)."""
+        provider = (self.settings.llm_provider or "none").lower()
+        prompt = self._answer_prompt(query, contexts)
+        try:
+            if provider == "openai":
+                if not self.settings.openai_api_key:
+                    raise RuntimeError("OPENAI_API_KEY is required for OpenAI LLM")
+                client = llm_clients.async_openai_client(self.settings.openai_api_key)
+                r = await client.chat.completions.create(model=self.settings.openai_chat_model, messages=[{"role": "user", "content": prompt}])
+                return (r.choices[0].message.content or "").strip()
+            if provider == "gemini":
+                if not self.settings.gemini_api_key:
+                    raise RuntimeError("GEMINI_API_KEY is required for Gemini LLM")
+                model = llm_clients.async_gemini_model(self.settings.gemini_api_key, self.settings.gemini_chat_model)
+                r = await model.generate_content_async(prompt)
+                return (getattr(r, "text", None) or "").strip()
+            if provider == "ollama":
+                model = os.environ.get("OLLAMA_MODEL", "llama3.1:8b")
+                r = await llm_clients.async_ollama_client().chat(model=model, messages=[{"role": "user", "content": prompt}])
+                content = r.get("message", {}).get("content")
+                if isinstance(content, str) and content.strip():
+                    return content.strip()
+        except Exception as e:
+            logging.getLogger("rag").warning("[RAG] Answer failed provider=%s, using extractive answer: %s", provider, e)
+            return self._simple_extractive_answer(query, contexts)
+        return self._simple_extractive_answer(query, contexts)
+
+    async def astream_answer(self, query: str, contexts: List[str]) -> AsyncIterator[str]:
+        """Yield answer text as the provider generates it. Without an LLM, or when the provider
+        fails before the first token, yields the extractive answer instead."""
+        provider = (self.settings.llm_provider or "none").lower()
+        prompt = self._answer_prompt(query, contexts)
+        messages = [{"role": "user", "content": prompt}]
+        sent = False
+        try:
+            if provider == "openai":
+                if not self.settings.openai_api_key:
+                    raise RuntimeError("OPENAI_API_KEY is required for OpenAI LLM")
+                client = llm_clients.async_openai_client(self.settings.openai_api_key)
+                stream = await client.chat.completions.create(model=self.settings.openai_chat_model, messages=messages, stream=True)
+                async for part in stream:
+                    delta = part.choices[0].delta.content if part.choices else None
+                    if delta:
+                        sent = True
+                        yield delta
+            elif provider == "gemini":
+                if not self.settings.gemini_api_key:
+                    raise RuntimeError("GEMINI_API_KEY is required for Gemini LLM")
+                model = llm_clients.async_gemini_model(self.settings.gemini_api_key, self.settings.gemini_chat_model)
+                async for part in await model.generate_content_async(prompt, stream=True):
+                    try:
+                        text = part.text
+                    except ValueError:  # chunk without text parts (e.g. safety stop)
+                        text = ""
+                    if text:
+                        sent = True
+                        yield text
+            elif provider == "ollama":
+                model = os.environ.get("OLLAMA_MODEL", "llama3.1:8b")
+                async for part in await llm_clients.async_ollama_client().chat(model=model, messages=messages, stream=True):
+                    text = (part.get("message") or {}).get("content")
+                    if text:
+                        sent = True
+                        yield text
+        except Exception as e:
+            if sent:
+                # the client already has part of the answer: end the stream rather than append another one
+                logging.getLogger("rag").warning("[RAG] Answer stream interrupted provider=%s: %s", provider, e)
+                return
+            logging.getLogger("rag").warning("[RAG] Answer stream failed provider=%s, using extractive answer: %s", provider, e)
+        if not sent:
+            yield self._simple_extractive_answer(query, contexts)
+
     # -------- Utils --------
     def _extract_text(self, *, file_bytes: bytes, file_name: str) -> str:
         name = file_name.lower()
@@ -512,6 +1618,8 @@ class RAGEngine:
         """Extract full text then classify simple metadata.
         Returns: { text, title, doc_type, date, year, month, tags }
         """
+        if self._ingest_in_pool():
+            return ingest_pool.run(ingest_pool.analyze_file, self.settings.model_dump_json(), file_bytes, file_name)
         text = self._extract_text(file_bytes=file_bytes, file_name=file_name) or ""
         meta = self._classify_metadata(text)
         # Simple keyword-based tags from content
@@ -601,14 +1709,13 @@ class RAGEngine:
         provider = (self.settings.llm_provider or "none").lower()
         if provider == "ollama":
             try:
-                import ollama  # type: ignore
                 model = os.environ.get("OLLAMA_MODEL", "llama3.1:8b")
                 prompt = (
                     "Phân loại loại văn bản theo các nhãn: cong-van, quyet-dinh, thong-bao, bien-ban, khac.\n"
                     "Chỉ trả lời 1 nhãn duy nhất, dạng slug không dấu.\n"
                     f"Tiêu đề: {title or ''}\nNội dung: {text[:1500]}\nNhãn:"
                 )
-                r = ollama.chat(model=model, messages=[{"role": "user", "content": prompt}])
+                r = llm_clients.ollama_client().chat(model=model, messages=[{"role": "user", "content": prompt}])
                 ans = (r.get("message", {}) or {}).get("content") or ""
                 label = ans.strip().split()[0].lower()
                 if label in {"cong-van", "quyet-dinh", "thong-bao", "bien-ban"}:
@@ -669,104 +1776,256 @@ class RAGEngine:
 
 
     def _extract_pdf(self, file_bytes: bytes) -> str:
-        from io import BytesIO
-        reader = PdfReader(BytesIO(file_bytes))
-        texts = []
-        for page in reader.pages:
-            try:
-                texts.append(page.extract_text() or "")
-            except Exception:
-                continue
-        return "\n".join(texts)
+        _total, pages = self._open_pages(file_bytes=file_bytes, file_name="file.pdf")
+        return "\n".join(text for _page, text in pages)
+
+    def _open_pages(self, *, file_bytes: bytes, file_name: str) -> Tuple[int, Iterator[Tuple[Optional[int], str]]]:
+        """(page count, lazy iterator of (page_number, text)). PDF pages are produced in order
+        as the iterator advances (large files are parsed in the ingestion pool, see pdf_extract.py);
+        other formats are a single unit without page number."""
+        if not file_name.lower().endswith('.pdf'):
+            return 1, iter([(None, self._extract_text(file_bytes=file_bytes, file_name=file_name))])
+        return self.open_pdf_pages(file_bytes)
+
+    def _is_large_pdf(self, file_bytes: bytes, file_name: str) -> bool:
+        if not file_name.lower().endswith('.pdf'):
+            return False
+        try:
+            return page_count(file_bytes) >= self.settings.pdf_parallel_min_pages
+        except Exception:
+            return False
+
+    def open_pdf_pages(self, file_bytes: bytes, report: Optional[Dict[str, Any]] = None) -> Tuple[int, Iterator[Tuple[int, str]]]:
+        """PDF pages with this engine's extraction settings; `report` receives per-page timings."""
+        s = self.settings
+        return open_pdf_pages(file_bytes, pool=self._ingest_in_pool(), min_pages=s.pdf_parallel_min_pages,
+                              pages_per_task=s.pdf_pages_per_task, slow_page_ms=s.pdf_slow_page_ms, report=report)
 
     def _extract_docx(self, file_bytes: bytes) -> str:
         from io import BytesIO
+        from docx import Document as DocxDocument
         doc = DocxDocument(BytesIO(file_bytes))
         return "\n".join(p.text for p in doc.paragraphs)
 
     def _split_text(self, text: str) -> List[str]:
-        """Sentence-aware splitter with env-configurable size/overlap.
-        - Clean spaces
-        - Split into sentences with a lightweight regex
-        - Pack sentences into chunks of approx chunk_size with chunk_overlap
-        """
-        chunk_size = max(200, int(self.settings.chunk_size))  # guardrails
-        overlap = max(0, min(int(self.settings.chunk_overlap), chunk_size // 2))
+        return [chunk for chunk, _page, _page_end in self._split_pages([(None, text)])]
 
-        cleaned = re.sub(r"\s+", " ", text).strip()
-        if not cleaned:
-            return []
-
-        # Split into rough sentences by punctuation. Keep delimiters by splitting on lookbehind.
-        sentences = re.split(r"(?<=[\.!?。！？;；:\n])\s+", cleaned)
-        sentences = [s.strip() for s in sentences if s and s.strip()]
-
-        chunks: List[str] = []
-        current: List[str] = []
-        current_len = 0
-
-        def flush_with_overlap():
-            nonlocal current, current_len
-            if not current:
-                return
-            chunk = " ".join(current).strip()
-            if chunk:
-                chunks.append(chunk)
-            # build overlap from end of current chunk
-            if overlap > 0 and chunks:
-                keep = chunk[-overlap:]
-                current = [keep]
-                current_len = len(keep)
-            else:
-                current = []
-                current_len = 0
+    def _splitter(self) -> "_Splitter":
+        return _Splitter(
+            chunk_size=max(200, int(self.settings.chunk_size)),  # guardrails
+            overlap=max(0, min(int(self.settings.chunk_overlap), max(200, int(self.settings.chunk_size)) // 2)),
+            anchor_every=max(0, int(self.settings.chunk_anchor_every)),
+            anchor_min_ratio=self.settings.chunk_anchor_min,
+        )
 
-        for sent in sentences:
-            if current_len + len(sent) + 1 <= chunk_size:
-                current.append(sent)
-                current_len += len(sent) + 1
-            else:
-                flush_with_overlap()
-                current.append(sent)
-                current_len = len(sent)
+    def _split_in_pool(self, pages: Iterable[Tuple[Optional[int], str]]) -> Iterator[Tuple[str, Optional[int], Optional[int]]]:
+        """`_split_pages` run in the ingest pool one window of pages per task, passing the
+        splitter state along; windows are bounded by page count and text size."""
+        splitter = self._splitter()
+        max_pages = max(1, self.settings.pdf_pages_per_task) * ingest_pool.size()
+        window: List[Tuple[Optional[int], str]] = []
+        chars = 0
+        for page, text in pages:
+            window.append((page, text))
+            chars += len(text or "")
+            if len(window) >= max_pages or chars >= _SPLIT_WINDOW_CHARS:
+                chunks, splitter = ingest_pool.run(ingest_pool.split_window, splitter, window, False)
+                yield from chunks
+                window, chars = [], 0
+        chunks, _splitter = ingest_pool.run(ingest_pool.split_window, splitter, window, True)
+        yield from chunks
 
-        flush_with_overlap()
-        # Ensure at least one chunk for very small text
-        if not chunks and cleaned:
-            chunks = [cleaned[:chunk_size]]
-        return chunks
+    def _split_pages(self, pages: Iterable[Tuple[Optional[int], str]]) -> Iterator[Tuple[str, Optional[int], Optional[int]]]:
+        """Sentence-aware splitter with env-configurable size/overlap, streaming over
+        (page_number, text) pairs and yielding (chunk, start_page, end_page); see _Splitter."""
+        splitter = self._splitter()
+        yield from splitter.feed(pages)
+        yield from splitter.finish()
 
     def _simple_extractive_answer(self, query: str, contexts: List[str]) -> str:
         # Return first 2 chunks as context with a brief preface
         joined = "\n\n".join(contexts[:2])
         return f"(Không có LLM cục bộ; trả lời theo ngữ cảnh gần nhất)\n\n{joined}"
 
-    def _maybe_rerank(self, query: str, outs: List[Dict[str, Any]], top_k: int) -> List[Dict[str, Any]]:
+    def _rerank_model(self) -> Any:
+        if self._cross_encoder is None:
+            from .inference import load_cross_encoder
+            s = self.settings
+            self._cross_encoder = _shared(
+                ("rerank_model", s.rerank_model, s.inference_backend, s.inference_threads, s.store_dir),
+                lambda: load_cross_encoder(s.rerank_model, backend=s.inference_backend, cache_dir=s.store_dir, threads=s.inference_threads),
+            )
+        return self._cross_encoder
+
+    def _reranker(self) -> RerankService:
+        if self._rerank_service is None:
+            s = self.settings
+            self._rerank_service = _shared(
+                ("rerank_service", s.rerank_model, s.inference_backend, s.inference_threads, s.store_dir,
+                 s.rerank_batch_max, s.rerank_batch_window_ms, s.rerank_cache_size, s.rerank_cache_ttl_seconds),
+                lambda: RerankService(
+                    self._rerank_model,
+                    max_batch=s.rerank_batch_max,
+                    window_ms=s.rerank_batch_window_ms,
+                    cache_size=s.rerank_cache_size,
+                    cache_ttl_seconds=s.rerank_cache_ttl_seconds,
+                ),
+            )
+        return self._rerank_service
+
+    def rerank_stats(self) -> Optional[Dict[str, Any]]:
+        return self._rerank_service.stats() if self._rerank_service is not None else None
+
+    def _maybe_rerank(self, query: str, outs: List[Dict[str, Any]], top_k: int, skip: bool = False) -> List[Dict[str, Any]]:
+        s = self.settings
+        if skip or not s.rerank or len(outs) <= 1:
+            return outs[:top_k]
+        # Dense top-1 clearly ahead of the runner-up: the cross-encoder would not change the answer
+        first, second = outs[0].get("score"), outs[1].get("score")
+        if s.rerank_skip_gap > 0 and first is not None and second is not None and first - second >= s.rerank_skip_gap:
+            return outs[:top_k]
+        # model failed to load recently: skip until its retry backoff expires
+        if not self._reranker().available():
+            return outs[:top_k]
+        # Score the head of the list within the token budget; the rest keeps its order
+        head: List[Dict[str, Any]] = []
+        used = 0
+        q_tokens = estimate_tokens(query)
+        for o in outs[:max(top_k, s.rerank_top_n)]:
+            # cross-encoders truncate pairs at 512 tokens
+            cost = min(512, q_tokens + estimate_tokens(o.get("text") or ""))
+            if head and used + cost > s.rerank_max_tokens:
+                break
+            head.append(o)
+            used += cost
         try:
-            if not self.settings.rerank or len(outs) <= 1:
-                return outs[:top_k]
-            if self._cross_encoder is None:
-                from sentence_transformers import CrossEncoder  # type: ignore
-                self._cross_encoder = CrossEncoder(self.settings.rerank_model)
-            pairs = [(query, o.get("text") or "") for o in outs]
-            scores = self._cross_encoder.predict(pairs)
-            scored = [(*pair, float(score)) for pair, score in zip(outs, scores)]
-            scored.sort(key=lambda x: x[-1], reverse=True)
-            reranked = [o for (o, *_s) in scored][:max(1, top_k)]
-            for o, _ in zip(reranked, range(len(reranked))):
-                o["rerank_score"] = _
-            return reranked
-        except Exception:
+            scores = self._reranker().score(query, [o.get("text") or "" for o in head])
+        except Exception as e:
             # best-effort; fallback to original order
+            logging.getLogger("rag").warning("[RAG] Rerank failed; keeping retrieval order: %s", e)
             return outs[:top_k]
+        for o, score in zip(head, scores):
+            o["rerank_score"] = score
+        head.sort(key=lambda o: o["rerank_score"], reverse=True)
+        return (head + outs[len(head):])[:max(1, top_k)]
+
+
+def _apply_doc_row(m: Dict[str, Any], drow: Dict[str, Any]) -> None:
+    """Overwrite chunk metadata with the current `documents` row (Supabase hits)."""
+    m["author"] = drow.get("author")
+    m["tags"] = drow.get("tags") or []
+    m["created_at"] = drow.get("created_at")
+    m["file_url"] = drow.get("file_url")
+    m["subject_id"] = drow.get("subject_id") or m.get("subject_id")
+    # infer file_ext/source from name/url
+    fname = (drow.get("file_path") or drow.get("name") or "").lower()
+    ext = fname.split('.')[-1] if '.' in fname else ''
+    if ext:
+        m["file_ext"] = ext
+    m["source"] = "url" if (m.get("file_url") or "") else "local"
+
+
+def _meta_matches(m: Dict[str, Any], *, subject_id: Optional[str] = None, subject_ids: Optional[List[str]] = None,
+                  user_id: Optional[str] = None, tags: Optional[List[str]] = None, author: Optional[str] = None,
+                  time_from: Optional[str] = None, time_to: Optional[str] = None, source: Optional[str] = None,
+                  file_type: Optional[str] = None, page_from: Optional[int] = None, page_to: Optional[int] = None) -> bool:
+    """Retrieval filters evaluated on stored chunk metadata (used for lexical hits)."""
+    if subject_ids:
+        if str(m.get("subject_id") or "") not in {str(x) for x in subject_ids}:
+            return False
+    elif subject_id is not None and str(m.get("subject_id") or "") != str(subject_id):
+        return False
+    # chunks without an owner are not visible to an owner-filtered query
+    if user_id and str(m.get("user_id") or "") != str(user_id):
+        return False
+    if author and (m.get("author") or "") != author:
+        return False
+    if tags and not any(t in (m.get("tags") or []) for t in tags):
+        return False
+    ts = m.get("created_at")
+    if (time_from or time_to) and isinstance(ts, str):
+        if (time_from and ts < time_from) or (time_to and ts > time_to):
+            return False
+    if source in ("local", "url") and (m.get("source") or "") != source:
+        return False
+    if file_type and (m.get("file_ext") or "").lower() != file_type.lower():
+        return False
+    if page_from is not None or page_to is not None:
+        # chunk pages [page, page_end] must overlap the requested range
+        try:
+            start = int(m.get("page"))  # type: ignore[arg-type]
+            end = int(m.get("page_end") if m.get("page_end") is not None else start)
+        except (TypeError, ValueError):
+            return False
+        if (page_from is not None and end < page_from) or (page_to is not None and start > page_to):
+            return False
+    return True
+
+
+# -------- Engine registry --------
+# One engine per distinct RAGSettings; heavy resources (models, store clients,
+# embedding cache) are shared between engines through _shared().
+# _registry_lock only guards the dicts: building an entry (model load/download,
+# opening a store, constructing an engine) happens under a per-key lock, so a
+# cold build blocks callers of the same key only.
+_registry_lock = threading.RLock()
+_build_locks: Dict[Any, threading.RLock] = {}  # resource keys are tuples, engine keys strings
+_shared_resources: Dict[Tuple[Any, ...], Any] = {}
+_engines: Dict[str, RAGEngine] = {}
+_default_settings: Optional[RAGSettings] = None
+
+
+def _build_once(cache: Dict[Any, Any], key: Any, factory: Any) -> Any:
+    with _registry_lock:
+        if key in cache:
+            return cache[key]
+        lock = _build_locks.setdefault(key, threading.RLock())
+    with lock:
+        with _registry_lock:
+            if key in cache:
+                return cache[key]
+        value = factory()
+        with _registry_lock:
+            cache[key] = value
+            _build_locks.pop(key, None)
+        return value
+
+
+def _shared(key: Tuple[Any, ...], factory: Any) -> Any:
+    return _build_once(_shared_resources, key, factory)
+
+
+def _open_chroma(store_dir: str) -> Any:
+    import chromadb
+    from chromadb.config import Settings
+    return chromadb.PersistentClient(path=store_dir, settings=Settings(anonymized_telemetry=False))
 
 
-# Singleton engine
-_engine: Optional[RAGEngine] = None
+def get_engine(settings: Optional[RAGSettings] = None) -> RAGEngine:
+    """Return the process-wide engine for `settings` (default: settings loaded from env)."""
+    global _default_settings
+    if settings is None:
+        with _registry_lock:
+            if _default_settings is None:
+                _default_settings = RAGSettings()
+            settings = _default_settings
+    return _build_once(_engines, settings.model_dump_json(), lambda: RAGEngine(settings))
 
 
-def get_engine() -> RAGEngine:
-    global _engine
-    if _engine is None:
-        _engine = RAGEngine()
-    return _engine
+def reload_engines() -> RAGEngine:
+    """Re-read RAGSettings from env/.env and swap the default engine without a restart.
+    Models and clients whose settings did not change are reused; engines still held
+    by in-flight requests keep working until they finish."""
+    global _default_settings
+    settings = RAGSettings()
+    # build (or reuse) the new engine before swapping, so callers keep the old one meanwhile
+    engine = get_engine(settings)
+    with _registry_lock:
+        _default_settings = settings
+        old = [e for e in _engines.values() if e is not engine]
+        _engines.clear()
+        _engines[settings.model_dump_json()] = engine
+    for e in old:
+        e.close()
+    logging.getLogger("rag").info("[RAG] Engines reloaded: store_backend=%s embed_provider=%s llm_provider=%s", engine.settings.store_backend, engine.settings.embed_provider, engine.settings.llm_provider)
+    return engine
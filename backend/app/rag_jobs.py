@@ -1,43 +1,265 @@
+import json
+import os
+import sqlite3
 import threading
 import time
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
+
+
+class QueueFull(Exception):
+    """Raised by `enqueue` when the index queue already holds `max_depth` waiting jobs."""
 
 
 class JobStore:
-    def __init__(self) -> None:
+    """
+    Per-document indexing status and the durable index queue, in one SQLite table
+    (store_dir/rag_jobs.sqlite3) so status survives restarts and is shared by every
+    uvicorn worker on the host. A document has at most one job: `state` is
+    queued -> running -> done | failed, plus `pending_payload` for an enqueue that
+    arrived while the job was running (it re-queues once the current run ends).
+    Deleting the document `cancel`s its job: a running one ends as `cancelled`.
+    """
+    def __init__(self, path: Optional[str] = None) -> None:
+        self._path = path
+        self._db: Optional[sqlite3.Connection] = None
         self._lock = threading.Lock()
-        self._jobs: Dict[str, Dict[str, Any]] = {}
 
+    @property
+    def path(self) -> str:
+        if self._path is None:
+            from .rag import RAGSettings
+            self._path = os.path.join(RAGSettings().store_dir, "rag_jobs.sqlite3")
+        return self._path
+
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False, timeout=30, isolation_level=None)
+            db.execute("pragma journal_mode=wal")
+            db.execute("pragma synchronous=normal")
+            db.executescript(
+                """
+                create table if not exists jobs (
+                  doc_id text primary key,
+                  state text not null default 'idle',
+                  stage text,
+                  progress int not null default 0,
+                  message text,
+                  payload text,
+                  pending_payload text,
+                  attempts int not null default 0,
+                  max_attempts int not null default 3,
+                  next_run_at real,
+                  lease_until real,
+                  enqueued_at real,
+                  started_at real,
+                  result text,
+                  error text,
+                  updated_at real
+                );
+                create index if not exists idx_jobs_queue on jobs(state, next_run_at);
+                """
+            )
+            self._db = db
+        return self._db
+
+    # -------- Status (used by the engine and routers) --------
     def start(self, doc_id: str) -> None:
         with self._lock:
-            self._jobs[doc_id] = {
-                "doc_id": doc_id,
-                "stage": "upload",  # upload -> chunking -> embedding -> storing -> indexed | failed
-                "progress": 0,
-                "message": "Đã nhận tệp, chuẩn bị xử lý",
-                "updated_at": time.time(),
-            }
-
-    def update(self, doc_id: str, *, stage: Optional[str] = None, progress: Optional[int] = None, message: Optional[str] = None) -> None:
-        with self._lock:
-            job = self._jobs.setdefault(doc_id, {"doc_id": doc_id})
-            if stage is not None:
-                job["stage"] = stage
-            if progress is not None:
-                job["progress"] = int(max(0, min(100, progress)))
-            if message is not None:
-                job["message"] = message
-            job["updated_at"] = time.time()
+            self._conn().execute(
+                "insert into jobs(doc_id, stage, progress, message, updated_at) values (?, 'upload', 0, ?, ?) "
+                "on conflict(doc_id) do update set stage='upload', progress=0, message=excluded.message, result=null, error=null, updated_at=excluded.updated_at",
+                (doc_id, "Đã nhận tệp, chuẩn bị xử lý", time.time()))
+
+    def update(self, doc_id: str, *, stage: Optional[str] = None, progress: Optional[int] = None, message: Optional[str] = None,
+               lease_seconds: float = 600.0) -> None:
+        """Set status fields; also renews the lease of a running job (progress is the heartbeat)."""
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            db.execute("insert or ignore into jobs(doc_id, updated_at) values (?, ?)", (doc_id, now))
+            db.execute(
+                "update jobs set stage=coalesce(?, stage), progress=coalesce(?, progress), message=coalesce(?, message), updated_at=?, "
+                "lease_until=case when state='running' then ? else lease_until end where doc_id=?",
+                (stage, None if progress is None else int(max(0, min(100, progress))), message, now, now + lease_seconds, doc_id))
 
     def fail(self, doc_id: str, message: str) -> None:
         self.update(doc_id, stage="failed", progress=100, message=message)
 
-    def success(self, doc_id: str) -> None:
+    def success(self, doc_id: str, result: Optional[Dict[str, Any]] = None) -> None:
         self.update(doc_id, stage="indexed", progress=100, message="Hoàn tất lập chỉ mục")
+        if result is not None:
+            with self._lock:
+                self._conn().execute("update jobs set result=? where doc_id=?", (json.dumps(result, default=str), doc_id))
 
     def get(self, doc_id: str) -> Dict[str, Any]:
         with self._lock:
-            return dict(self._jobs.get(doc_id, {"doc_id": doc_id, "stage": "unknown", "progress": 0, "message": "Không có job"}))
+            row = self._conn().execute(
+                "select doc_id, stage, progress, message, updated_at, state, attempts, max_attempts, next_run_at, result, error from jobs where doc_id=?",
+                (doc_id,)).fetchone()
+        if row is None:
+            return {"doc_id": doc_id, "stage": "unknown", "progress": 0, "message": "Không có job"}
+        out: Dict[str, Any] = {"doc_id": row[0], "stage": row[1] or "unknown", "progress": row[2], "message": row[3], "updated_at": row[4]}
+        if row[5] != "idle":
+            out.update(queue_state=row[5], attempts=row[6], max_attempts=row[7])
+            if row[5] == "queued" and row[8]:
+                out["next_run_at"] = row[8]
+        if row[9]:
+            out["result"] = json.loads(row[9])
+        if row[10]:
+            out["error"] = row[10]
+        return out
+
+    # -------- Queue (used by index_queue.py) --------
+    def enqueue(self, doc_id: str, payload: Dict[str, Any], *, max_attempts: int = 3, max_depth: int = 0) -> str:
+        """Idempotent per document: a queued job takes the newer payload ("updated"), a
+        running one re-runs with it afterwards ("deferred"), otherwise "queued"."""
+        now = time.time()
+        data = json.dumps(payload, default=str)
+        with self._lock:
+            db = self._conn()
+            db.execute("begin immediate")
+            try:
+                row = db.execute("select state from jobs where doc_id=?", (doc_id,)).fetchone()
+                state = row[0] if row else None
+                if state == "queued":
+                    db.execute("update jobs set payload=?, max_attempts=?, updated_at=? where doc_id=?", (data, max_attempts, now, doc_id))
+                    outcome = "updated"
+                elif state in ("running", "cancelled"):
+                    # a run cancelled midway still ends (and cleans up) before the new payload runs
+                    db.execute("update jobs set state='running', pending_payload=?, updated_at=? where doc_id=?", (data, now, doc_id))
+                    outcome = "deferred"
+                else:
+                    if max_depth > 0 and db.execute("select count(*) from jobs where state='queued'").fetchone()[0] >= max_depth:
+                        raise QueueFull(f"index queue is full ({max_depth} jobs waiting)")
+                    db.execute(
+                        "insert into jobs(doc_id, state, stage, progress, message, payload, attempts, max_attempts, next_run_at, enqueued_at, result, error, updated_at) "
+                        "values (?, 'queued', 'queued', 0, ?, ?, 0, ?, ?, ?, null, null, ?) "
+                        "on conflict(doc_id) do update set state='queued', stage='queued', progress=0, message=excluded.message, payload=excluded.payload, "
+                        "pending_payload=null, attempts=0, max_attempts=excluded.max_attempts, next_run_at=excluded.next_run_at, "
+                        "enqueued_at=excluded.enqueued_at, result=null, error=null, updated_at=excluded.updated_at",
+                        (doc_id, "Đang chờ trong hàng đợi", data, max_attempts, now, now, now))
+                    outcome = "queued"
+                db.execute("commit")
+            except BaseException:
+                db.execute("rollback")
+                raise
+        return outcome
+
+    def claim(self, lease_seconds: float = 600.0) -> Optional[Tuple[str, Dict[str, Any], int, float]]:
+        """Take the next due job (or one whose worker died and let its lease expire).
+        Returns (doc_id, payload, attempt number, seconds waited) or None."""
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            db.execute("begin immediate")
+            try:
+                row = db.execute(
+                    "select doc_id, payload, attempts, enqueued_at from jobs where (state='queued' and next_run_at<=?) "
+                    "or (state='running' and lease_until<?) order by next_run_at limit 1", (now, now)).fetchone()
+                if row is None:
+                    db.execute("commit")
+                    return None
+                db.execute("update jobs set state='running', attempts=attempts+1, lease_until=?, started_at=?, updated_at=? where doc_id=?",
+                           (now + lease_seconds, now, now, row[0]))
+                db.execute("commit")
+            except BaseException:
+                db.execute("rollback")
+                raise
+        return row[0], json.loads(row[1] or "{}"), int(row[2]) + 1, now - float(row[3] or now)
+
+    def complete(self, doc_id: str, *, ok: bool, error: Optional[str] = None) -> bool:
+        """End a run. Returns True if a deferred enqueue put the job back in the queue."""
+        now = time.time()
+        with self._lock:
+            db = self._conn()
+            db.execute("begin immediate")
+            try:
+                row = db.execute("select pending_payload, state from jobs where doc_id=?", (doc_id,)).fetchone()
+                if row and row[1] == "cancelled":
+                    db.execute("delete from jobs where doc_id=?", (doc_id,))
+                    requeued = False
+                elif row and row[0]:
+                    db.execute("update jobs set state='queued', payload=pending_payload, pending_payload=null, attempts=0, "
+                               "next_run_at=?, enqueued_at=?, lease_until=null, updated_at=? where doc_id=?", (now, now, now, doc_id))
+                    requeued = True
+                else:
+                    db.execute("update jobs set state=?, error=?, lease_until=null, updated_at=? where doc_id=?",
+                               ("done" if ok else "failed", error, now, doc_id))
+                    requeued = False
+                db.execute("commit")
+            except BaseException:
+                db.execute("rollback")
+                raise
+        return requeued
+
+    def retry_or_fail(self, doc_id: str, error: str, delay_seconds: float) -> bool:
+        """After a failed attempt: re-queue with a delay while attempts remain (True), else fail.
+        A newer payload enqueued meanwhile replaces the retry."""
+        now = time.time()
+        with self._lock:
+            row = self._conn().execute("select attempts, max_attempts, pending_payload, state from jobs where doc_id=?", (doc_id,)).fetchone()
+            if row is not None and row[3] == "cancelled":
+                self._conn().execute("delete from jobs where doc_id=?", (doc_id,))
+                return False
+            if row is not None and not row[2] and row[0] < row[1]:
+                self._conn().execute(
+                    "update jobs set state='queued', stage='queued', next_run_at=?, lease_until=null, error=?, message=?, updated_at=? where doc_id=?",
+                    (now + delay_seconds, error, f"Lỗi, thử lại lần {row[0] + 1}/{row[1]} sau {int(delay_seconds)}s: {error}", now, doc_id))
+                return True
+        if self.complete(doc_id, ok=False, error=error):
+            return True
+        self.fail(doc_id, f"Index thất bại: {error}")
+        return False
+
+    def cancel(self, doc_id: str) -> List[Dict[str, Any]]:
+        """Drop the job of a deleted document. A queued/retrying job is removed, a running
+        one loses its deferred payload and ends as cancelled (see `complete`). Returns the
+        payloads that will no longer run, so their spool files can be removed."""
+        with self._lock:
+            db = self._conn()
+            db.execute("begin immediate")
+            try:
+                row = db.execute("select state, payload, pending_payload from jobs where doc_id=?", (doc_id,)).fetchone()
+                if row is None:
+                    dropped: List[Optional[str]] = []
+                elif row[0] == "running":
+                    db.execute("update jobs set state='cancelled', pending_payload=null, updated_at=? where doc_id=?", (time.time(), doc_id))
+                    dropped = [row[2]]
+                else:
+                    db.execute("delete from jobs where doc_id=?", (doc_id,))
+                    dropped = [row[1] if row[0] == "queued" else None, row[2]]
+                db.execute("commit")
+            except BaseException:
+                db.execute("rollback")
+                raise
+        return [json.loads(p) for p in dropped if p]
+
+    def is_cancelled(self, doc_id: str) -> bool:
+        with self._lock:
+            row = self._conn().execute("select state from jobs where doc_id=?", (doc_id,)).fetchone()
+        return bool(row) and row[0] == "cancelled"
+
+    def payload_in_use(self, fragment: str) -> bool:
+        """Whether a queued/running job (or its deferred payload) still mentions `fragment`."""
+        pattern = "%" + json.dumps(fragment)[1:-1].replace("%", "\\%").replace("_", "\\_") + "%"
+        with self._lock:
+            return self._conn().execute(
+                "select 1 from jobs where state in ('queued', 'running') and (payload like ? escape '\\' or pending_payload like ? escape '\\') limit 1",
+                (pattern, pattern)).fetchone() is not None
+
+    def depth(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            counts = dict(self._conn().execute("select state, count(*) from jobs group by state").fetchall())
+            oldest = self._conn().execute("select min(enqueued_at) from jobs where state='queued'").fetchone()[0]
+        return {
+            "queued": int(counts.get("queued", 0)),
+            "running": int(counts.get("running", 0)),
+            "failed": int(counts.get("failed", 0)),
+            "done": int(counts.get("done", 0)),
+            "oldest_queued_s": round(now - oldest, 1) if oldest else None,
+        }
 
 
 job_store = JobStore()
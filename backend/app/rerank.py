@@ -0,0 +1,87 @@
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .batching import MicroBatcher
+from .query_cache import TTLLRUCache, normalize_query
+
+
+_RETRY_MIN_S = 30.0
+_RETRY_MAX_S = 3600.0
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha1((text or "").encode("utf-8")).hexdigest()
+
+
+class RerankService:
+    """
+    Cross-encoder scoring shared by every engine using the same rerank model.
+    (query, chunk) pairs from concurrent requests are micro-batched into one
+    predict() call, and scores are cached per (normalized query, chunk text) with
+    TTL+LRU eviction, so repeated or overlapping queries only score new chunks.
+    A failed model load (e.g. an offline node that cannot download it) is not retried
+    until a backoff expires (30 s, doubling up to 1 h); meanwhile `available()` is False
+    and callers keep the retrieval order.
+    """
+    def __init__(self, load_model: Callable[[], Any], *, max_batch: int = 64, window_ms: float = 5.0,
+                 cache_size: int = 20_000, cache_ttl_seconds: float = 86_400) -> None:
+        self._load_model = load_model
+        self._model: Any = None
+        self._model_lock = threading.Lock()
+        self._load_error: Optional[str] = None
+        self._retry_at = 0.0
+        self._retry_s = _RETRY_MIN_S
+        self._cache = TTLLRUCache(cache_size, cache_ttl_seconds)
+        self._batcher: MicroBatcher[Tuple[str, str], float] = MicroBatcher(
+            self._predict, max_batch=max_batch, window_ms=window_ms, name="rerank")
+
+    def available(self) -> bool:
+        return self._model is not None or time.monotonic() >= self._retry_at
+
+    def model(self) -> Any:
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    if time.monotonic() < self._retry_at:
+                        raise RuntimeError(f"rerank model unavailable: {self._load_error}")
+                    try:
+                        self._model = self._load_model()
+                    except Exception as e:
+                        self._load_error = str(e)
+                        self._retry_at = time.monotonic() + self._retry_s
+                        logging.getLogger("rag").warning("[RAG] Rerank model load failed; retrying in %.0f s: %s", self._retry_s, e)
+                        self._retry_s = min(self._retry_s * 2, _RETRY_MAX_S)
+                        raise
+                    self._load_error = None
+                    self._retry_s = _RETRY_MIN_S
+        return self._model
+
+    def _predict(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        return [float(s) for s in self.model().predict(pairs)]
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        """Relevance scores aligned with `texts`."""
+        qh = _digest(normalize_query(query))
+        keys = [(qh, _digest(t)) for t in texts]
+        scores: List[Optional[float]] = [None] * len(texts)
+        pending: Dict[Tuple[str, str], "Future[float]"] = {}
+        for i, key in enumerate(keys):
+            hit = self._cache.get(key)
+            if hit is not None:
+                scores[i] = hit
+            elif key not in pending:
+                pending[key] = self._batcher.submit((query, texts[i]))
+        for key, fut in pending.items():
+            self._cache.set(key, fut.result())
+        return [s if s is not None else pending[k].result() for s, k in zip(scores, keys)]
+
+    def close(self) -> None:
+        self._batcher.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"cache": self._cache.stats(), "batcher": self._batcher.stats(), "model_loaded": self._model is not None,
+                "load_error": self._load_error}
@@ -1,13 +1,17 @@
 from typing import List, Optional
-from fastapi import APIRouter, UploadFile, File, HTTPException, Form, BackgroundTasks
+from fastapi import APIRouter, UploadFile, File, HTTPException, Form
+from fastapi.concurrency import run_in_threadpool
 import logging
 from ..schemas import DocumentCreate, DocumentUpdate, DocumentOut
-from ..supabase_client import get_supabase
+from ..supabase_client import get_supabase, upload_public_file
 from ..config import get_settings
+import hashlib
 import uuid
 import json
 from ..rag import get_engine
 from ..rag_jobs import job_store
+from ..index_queue import QueueFull, index_queue
+from ..doc_meta_cache import doc_meta_cache
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -18,7 +22,7 @@ def _table_name() -> str:
 
 
 @router.get("/documents", response_model=List[DocumentOut])
-async def list_documents(subject_id: Optional[str] = None):
+def list_documents(subject_id: Optional[str] = None):
     sb = get_supabase()
     query = sb.table(_table_name()).select("*")
     if subject_id is not None:
@@ -28,7 +32,7 @@ async def list_documents(subject_id: Optional[str] = None):
 
 
 @router.post("/documents", response_model=DocumentOut)
-async def create_document(payload: DocumentCreate):
+def create_document(payload: DocumentCreate):
     sb = get_supabase()
     data = payload.model_dump(by_alias=True)
     # Ensure tags is JSON-serializable
@@ -41,28 +45,50 @@ async def create_document(payload: DocumentCreate):
 
 
 @router.patch("/documents/{doc_id}", response_model=DocumentOut)
-async def update_document(doc_id: str, payload: DocumentUpdate):
+def update_document(doc_id: str, payload: DocumentUpdate):
     sb = get_supabase()
     data = {k: v for k, v in payload.model_dump().items() if v is not None}
     q = sb.table(_table_name()).update(data).eq("id", doc_id)
     resp = q.execute()
     if not resp.data:
         raise HTTPException(status_code=404, detail="Document not found")
-    return resp.data[0]
+    row = resp.data[0]
+    doc_meta_cache.invalidate([doc_id])
+    # Keep filterable metadata on indexed chunks in sync; best-effort
+    if "author" in data or "tags" in data:
+        try:
+            sid = row.get("subject_id")
+            get_engine().update_document_metadata(str(doc_id), row, subject_id=str(sid) if sid is not None else None)
+        except Exception as e:
+            logger.warning("RAG metadata sync failed for document %s: %s", doc_id, e)
+    return row
 
 
 @router.delete("/documents/{doc_id}")
-async def delete_document(doc_id: str):
+def delete_document(doc_id: str):
     sb = get_supabase()
     q = sb.table(_table_name()).delete().eq("id", doc_id)
     resp = q.execute()
     if resp.count == 0:
         raise HTTPException(status_code=404, detail="Document not found")
+    doc_meta_cache.invalidate([doc_id])
+    # Drop the pending index job and the indexed chunks (vector store + lexical index); best-effort
+    try:
+        index_queue.cancel(doc_id)
+        get_engine().delete_document(doc_id)
+    except Exception as e:
+        logger.warning("RAG cleanup failed for deleted document %s: %s", doc_id, e)
     return {"ok": True}
 
 
 @router.post("/documents/{doc_id}/upload", response_model=DocumentOut)
-async def upload_document_file(doc_id: str, file: UploadFile = File(...), enable_rag: bool = Form(False), background_tasks: BackgroundTasks = None):
+async def upload_document_file(doc_id: str, file: UploadFile = File(...), enable_rag: bool = Form(False)):
+    content = await file.read()
+    # Supabase, Storage and file analysis are blocking: run them off the event loop
+    return await run_in_threadpool(_attach_file, doc_id, file.filename, file.content_type, content, enable_rag)
+
+
+def _attach_file(doc_id: str, filename: Optional[str], content_type: Optional[str], content: bytes, enable_rag: bool) -> dict:
     sb = get_supabase()
     settings = get_settings()
 
@@ -72,46 +98,22 @@ async def upload_document_file(doc_id: str, file: UploadFile = File(...), enable
     if not doc_resp.data:
         raise HTTPException(status_code=404, detail="Document not found")
 
-    # Upload to storage
-    ext = (file.filename or "").split(".")[-1].lower() if file.filename else "bin"
-    path = f"{doc_id}/{uuid.uuid4().hex}.{ext}"
-    content = await file.read()
+    ext = (filename or "").split(".")[-1].lower() if filename else "bin"
+    # Identical file uploaded before (any document): reuse its Storage object and analysis
+    content_sha = hashlib.sha256(content).hexdigest()
+    registry = get_engine().content_registry
+    known = registry.lookup(content_sha) if registry is not None else None
 
-    storage = sb.storage.from_(settings.supabase_storage_bucket)
-    try:
-        upload_resp = storage.upload(
-            file=content,
-            path=path,
-            file_options={"content-type": file.content_type or "application/octet-stream"},
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Upload error: {e}")
-
-    # Supabase v2 may return dict-like response; try to detect error
-    if upload_resp is None:
-        raise HTTPException(status_code=500, detail="Upload failed (no response)")
-    if isinstance(upload_resp, dict):
-        # If it contains 'error' or similar, raise
-        err = upload_resp.get("error") or upload_resp.get("message")
-        if err:
-            raise HTTPException(status_code=500, detail=f"Upload failed: {err}")
-
-    # Build public URL (ensure bucket has public policy or signed url)
-    public_result = storage.get_public_url(path)
-    if isinstance(public_result, str):
-        public_url = public_result
-    elif isinstance(public_result, dict):
-        public_url = (
-            public_result.get("publicUrl")
-            or (public_result.get("data") or {}).get("publicUrl")
-            or (public_result.get("data") or {}).get("public_url")
-            or (public_result.get("data") or {}).get("publicURL")
-        )
-        if not isinstance(public_url, str):
-            # Fallback: convert to str if unknown shape
-            public_url = str(public_result)
+    if known and known.get("file_path") and known.get("file_url"):
+        path, public_url = known["file_path"], known["file_url"]
+        logger.info("Upload deduplicated doc_id=%s sha256=%s path=%s", doc_id, content_sha[:12], path)
     else:
-        public_url = str(public_result)
+        try:
+            path, public_url = upload_public_file(settings.supabase_storage_bucket, f"{doc_id}/{uuid.uuid4().hex}.{ext}", content, content_type)
+        except RuntimeError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        if registry is not None:
+            registry.record_upload(content_sha, size=len(content), mime=content_type, file_path=path, file_url=public_url)
 
     # Save file path/url to db
     update = sb.table(_table_name()).update({
@@ -126,7 +128,12 @@ async def upload_document_file(doc_id: str, file: UploadFile = File(...), enable
     # Auto analyze PDF/Doc to extract title, date, classify type, and content-based tags; update metadata non-destructively
     try:
         engine = get_engine()
-        analysis = engine.analyze_file(file_bytes=content, file_name=file.filename or path)
+        analysis = (known or {}).get("analysis")
+        if not analysis:
+            # text extraction + keywords run in the ingestion pool
+            analysis = engine.analyze_file(file_bytes=content, file_name=filename or path)
+            if registry is not None:
+                registry.record_analysis(content_sha, analysis)
         title = (analysis or {}).get("title")
         doc_type = (analysis or {}).get("doc_type")  # cong-van | quyet-dinh | thong-bao | bien-ban | khac
         date_iso = (analysis or {}).get("date")  # YYYY-MM-DD
@@ -168,55 +175,40 @@ async def upload_document_file(doc_id: str, file: UploadFile = File(...), enable
             saved_doc = ures.data[0]
     except Exception as e:
         logger.exception("Auto analysis failed for doc_id=%s: %s", doc_id, e)
+    doc_meta_cache.invalidate([doc_id])
 
-    # Trigger RAG indexing in background if enabled (best-effort, non-blocking)
+    # Queue RAG indexing if enabled (durable queue, bounded workers; best-effort)
     try:
         if enable_rag:
-            # init job status
             try:
                 job_store.start(str(doc_id))
                 job_store.update(str(doc_id), stage="upload", progress=5, message="Đang tải lên")
             except Exception:
                 pass
-            engine = get_engine()
             subject_id = str(saved_doc.get("subject_id")) if saved_doc.get("subject_id") is not None else None
-            user_id = None
-            filename = file.filename or path.split("/")[-1]
-
-            def _do_index():
-                try:
-                    extra_metadata = {
+            try:
+                index_queue.enqueue_index(
+                    document_id=str(doc_id),
+                    subject_id=subject_id,
+                    user_id=None,
+                    file_name=filename or path.split("/")[-1],
+                    extra_metadata={
                         "author": saved_doc.get("author"),
                         "tags": saved_doc.get("tags") or [],
                         "created_at": saved_doc.get("created_at"),
                         "file_url": saved_doc.get("file_url"),
-                    }
-                    res = engine.index_document(
-                        document_id=str(doc_id),
-                        subject_id=subject_id,
-                        user_id=user_id,
-                        file_bytes=content,
-                        file_name=filename,
-                        extra_metadata=extra_metadata,
-                    )
-                    logger.info("[RAG] Index scheduled and completed doc_id=%s chunks=%s", doc_id, (res or {}).get("chunks"))
-                except Exception as e:
-                    logger.exception("[RAG] Index failed for doc_id=%s: %s", doc_id, e)
-                    try:
-                        job_store.fail(str(doc_id), f"Index thất bại: {e}")
-                    except Exception:
-                        pass
-
-            if background_tasks is not None:
-                background_tasks.add_task(_do_index)
-                logger.info("[RAG] Index scheduled (background) doc_id=%s enable_rag=%s", doc_id, enable_rag)
-            else:
-                # Fallback if BackgroundTasks not available for some reason
-                _do_index()
+                    },
+                    # a new file replaces the previous one: unchanged chunks are kept, the rest re-indexed
+                    replace=True,
+                    content=content,
+                    file_url=saved_doc.get("file_url"),
+                )
+            except QueueFull as e:
+                job_store.fail(str(doc_id), f"Hàng đợi lập chỉ mục đang đầy, vui lòng thử lại sau: {e}")
         else:
             logger.info("[RAG] Index skipped doc_id=%s enable_rag=%s", doc_id, enable_rag)
     except Exception as e:
-        logger.exception("Failed to schedule/skip RAG indexing for doc_id=%s: %s", doc_id, e)
+        logger.exception("Failed to queue RAG indexing for doc_id=%s: %s", doc_id, e)
 
     return saved_doc
 
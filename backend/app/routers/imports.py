@@ -2,9 +2,12 @@ from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel, AnyHttpUrl
 from typing import Optional, Tuple
 from ..config import get_settings
-from ..supabase_client import get_supabase
+from ..supabase_client import get_supabase, upload_public_file
 from ..rag import get_engine
 from ..rag_jobs import job_store
+from ..index_queue import QueueFull, index_queue
+from ..doc_meta_cache import doc_meta_cache
+import hashlib
 import uuid
 import logging
 import json
@@ -214,40 +217,21 @@ def _create_doc_and_upload(content: bytes, filename: str, mime: str, subject_id:
     doc = resp.data[0]
     doc_id = str(doc["id"]) if isinstance(doc.get("id"), (str, int)) else str(doc.get("id"))
 
-    # Upload to storage
-    storage = sb.storage.from_(settings.supabase_storage_bucket)
-    ext = _infer_ext(filename, mime)
-    path = f"{doc_id}/{uuid.uuid4().hex}.{ext}"
-    try:
-        upload_resp = storage.upload(
-            file=content,
-            path=path,
-            file_options={"content-type": mime or "application/octet-stream"},
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Upload error: {e}")
-
-    if upload_resp is None:
-        raise HTTPException(status_code=500, detail="Upload failed (no response)")
-    if isinstance(upload_resp, dict):
-        err = upload_resp.get("error") or upload_resp.get("message")
-        if err:
-            raise HTTPException(status_code=500, detail=f"Upload failed: {err}")
-
-    public_result = storage.get_public_url(path)
-    if isinstance(public_result, str):
-        public_url = public_result
-    elif isinstance(public_result, dict):
-        public_url = (
-            public_result.get("publicUrl")
-            or (public_result.get("data") or {}).get("publicUrl")
-            or (public_result.get("data") or {}).get("public_url")
-            or (public_result.get("data") or {}).get("publicURL")
-        )
-        if not isinstance(public_url, str):
-            public_url = str(public_result)
+    # Identical file imported/uploaded before: reuse its Storage object (chunks are reused at index time)
+    content_sha = hashlib.sha256(content).hexdigest()
+    registry = get_engine().content_registry
+    known = registry.lookup(content_sha) if registry is not None else None
+    if known and known.get("file_path") and known.get("file_url"):
+        path, public_url = known["file_path"], known["file_url"]
+        logger.info("Import deduplicated doc_id=%s sha256=%s path=%s", doc_id, content_sha[:12], path)
     else:
-        public_url = str(public_result)
+        ext = _infer_ext(filename, mime)
+        try:
+            path, public_url = upload_public_file(settings.supabase_storage_bucket, f"{doc_id}/{uuid.uuid4().hex}.{ext}", content, mime)
+        except RuntimeError as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        if registry is not None:
+            registry.record_upload(content_sha, size=len(content), mime=mime, file_path=path, file_url=public_url)
 
     u = sb.table("documents").update({
         "file_path": path,
@@ -255,8 +239,9 @@ def _create_doc_and_upload(content: bytes, filename: str, mime: str, subject_id:
     }).eq("id", doc_id).execute()
     if u.data:
         doc = u.data[0]
+    doc_meta_cache.invalidate([doc_id])
 
-    # Best-effort RAG index
+    # Best-effort RAG index, queued instead of running inline in the request
     if enable_rag:
         try:
             try:
@@ -264,40 +249,30 @@ def _create_doc_and_upload(content: bytes, filename: str, mime: str, subject_id:
                 job_store.update(str(doc_id), stage="upload", progress=5, message="Đang tải lên")
             except Exception:
                 pass
-            engine = get_engine()
-            subject_opt = str(doc.get("subject_id")) if doc.get("subject_id") is not None else None
-            def _do_index():
-                try:
-                    extra_metadata = {
-                        "author": doc.get("author"),
-                        "tags": doc.get("tags") or [],
-                        "created_at": doc.get("created_at"),
-                        "file_url": doc.get("file_url"),
-                    }
-                    engine.index_document(
-                        document_id=str(doc_id),
-                        subject_id=subject_opt,
-                        user_id=None,
-                        file_bytes=content,
-                        file_name=filename,
-                        extra_metadata=extra_metadata,
-                    )
-                except Exception as e:
-                    logger.exception("[RAG] Index failed for doc_id=%s: %s", doc_id, e)
-                    try:
-                        job_store.fail(str(doc_id), f"Index thất bại: {e}")
-                    except Exception:
-                        pass
-            # Run inline; FastAPI may add BackgroundTasks if needed in future
-            _do_index()
+            index_queue.enqueue_index(
+                document_id=str(doc_id),
+                subject_id=str(doc.get("subject_id")) if doc.get("subject_id") is not None else None,
+                user_id=None,
+                file_name=filename,
+                extra_metadata={
+                    "author": doc.get("author"),
+                    "tags": doc.get("tags") or [],
+                    "created_at": doc.get("created_at"),
+                    "file_url": doc.get("file_url"),
+                },
+                content=content,
+                file_url=doc.get("file_url"),
+            )
+        except QueueFull as e:
+            job_store.fail(str(doc_id), f"Hàng đợi lập chỉ mục đang đầy, vui lòng thử lại sau: {e}")
         except Exception as e:
-            logger.exception("Failed to schedule/execute RAG indexing for doc_id=%s: %s", doc_id, e)
+            logger.exception("Failed to queue RAG indexing for doc_id=%s: %s", doc_id, e)
 
     return doc
 
 
 @router.post("/import/google_drive")
-async def import_google_drive(payload: ImportPayload):
+def import_google_drive(payload: ImportPayload):
     s = get_settings()
     file_id = payload.file_id
     if (not file_id) and payload.share_link:
@@ -319,7 +294,7 @@ async def import_google_drive(payload: ImportPayload):
 
 
 @router.post("/import/onedrive")
-async def import_onedrive(payload: ImportPayload):
+def import_onedrive(payload: ImportPayload):
     s = get_settings()
     if not payload.share_link:
         raise HTTPException(status_code=400, detail="OneDrive import currently requires share_link")
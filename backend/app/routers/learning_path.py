@@ -60,7 +60,7 @@ def _at_minutes(date: datetime, minutes: int) -> datetime:
 
 # ===== Endpoints =====
 @router.post("/learning_path/generate", response_model=GenerateResponse)
-async def learning_path_generate(payload: GeneratePayload):
+def learning_path_generate(payload: GeneratePayload):
     if not payload.subjects:
         raise HTTPException(status_code=400, detail="subjects is required")
     if not payload.goal or not payload.goal.strip():
@@ -104,7 +104,7 @@ async def learning_path_generate(payload: GeneratePayload):
 
 
 @router.post("/learning_path/apply")
-async def learning_path_apply(payload: ApplyPayload):
+def learning_path_apply(payload: ApplyPayload):
     if not payload.plan:
         raise HTTPException(status_code=400, detail="plan is empty")
     sb = get_supabase()
@@ -36,7 +36,7 @@ class MindmapResponse(BaseModel):
 
 
 @router.post("/mindmap/generate", response_model=MindmapResponse)
-async def generate_mindmap(payload: MindmapGeneratePayload):
+def generate_mindmap(payload: MindmapGeneratePayload):
     if not payload.document_id and not payload.subject_id:
         raise HTTPException(status_code=400, detail="Require document_id or subject_id")
 
@@ -1,37 +1,49 @@
 from fastapi import APIRouter, UploadFile, File, Form, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse, StreamingResponse
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
 from ..config import get_settings
+from .. import llm_clients
 from pydantic import BaseModel
-from openai import OpenAI
 import base64
 import io
-from pypdf import PdfReader
-from PIL import Image, ImageFilter, ImageOps
-import pytesseract
 import os
 from pathlib import Path
 
+# openai, pypdf, PIL and pytesseract are imported inside the handlers so that
+# importing this router does not slow down app startup.
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
 router = APIRouter()
 
-# Try to configure pytesseract command (useful on Windows)
-try:
-    s = get_settings()
-    cmd = None
-    # Priority: settings.tesseract_cmd -> env TESSERACT_CMD -> common Windows path
-    if getattr(s, "tesseract_cmd", None):
-        cmd = s.tesseract_cmd
-    elif os.getenv("TESSERACT_CMD"):
-        cmd = os.getenv("TESSERACT_CMD")
-    else:
-        common_win = Path(r"C:\Program Files\Tesseract-OCR\tesseract.exe")
-        if common_win.exists():
-            cmd = str(common_win)
-    if cmd:
-        pytesseract.pytesseract.tesseract_cmd = cmd
-except Exception:
-    # best-effort only; if it fails, the endpoint will report a clearer error later
-    pass
+_tesseract_configured = False
+
+
+def _get_pytesseract():
+    """Import pytesseract and configure its command once (useful on Windows)."""
+    global _tesseract_configured
+    import pytesseract
+    if not _tesseract_configured:
+        _tesseract_configured = True
+        try:
+            s = get_settings()
+            cmd = None
+            # Priority: settings.tesseract_cmd -> env TESSERACT_CMD -> common Windows path
+            if getattr(s, "tesseract_cmd", None):
+                cmd = s.tesseract_cmd
+            elif os.getenv("TESSERACT_CMD"):
+                cmd = os.getenv("TESSERACT_CMD")
+            else:
+                common_win = Path(r"C:\Program Files\Tesseract-OCR\tesseract.exe")
+                if common_win.exists():
+                    cmd = str(common_win)
+            if cmd:
+                pytesseract.pytesseract.tesseract_cmd = cmd
+        except Exception:
+            # best-effort only; if it fails, the endpoint will report a clearer error later
+            pass
+    return pytesseract
 
 class TranslatePayload(BaseModel):
     text: str
@@ -39,17 +51,13 @@ class TranslatePayload(BaseModel):
     return_format: str = "markdown"  # "text" | "markdown"
 
 
-def _get_openai_client() -> OpenAI:
-    # OpenAI api key should be in backend/.env as OPENAI_API_KEY
+def _get_openai_client() -> "AsyncOpenAI":
+    # OpenAI api key should be in backend/.env as OPENAI_API_KEY; async client so handlers never block the loop.
+    # Shared per key/base URL (see llm_clients.py), so requests reuse pooled connections
     try:
         s = get_settings()
-        kwargs = {}
-        if getattr(s, "openai_api_key", None):
-            kwargs["api_key"] = s.openai_api_key
-        if getattr(s, "openai_base_url", None):
-            kwargs["base_url"] = str(s.openai_base_url)
-        client = OpenAI(**kwargs)
-        return client
+        base_url = str(s.openai_base_url) if getattr(s, "openai_base_url", None) else None
+        return llm_clients.async_openai_client(getattr(s, "openai_api_key", None), base_url)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"OpenAI client init failed: {e}")
 
@@ -69,7 +77,7 @@ async def translate_text(payload: TranslatePayload):
     prompt = f"Target language: {target}. Return format: {fmt}.\n\n---\n{payload.text}"
 
     try:
-        res = client.chat.completions.create(
+        res = await client.chat.completions.create(
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": system},
@@ -114,11 +122,21 @@ async def ocr_translate(
     extracted_text: Optional[str] = None
     if mime == "application/pdf" or filename.lower().endswith(".pdf"):
         try:
-            reader = PdfReader(io.BytesIO(content))
-            pages_text = []
-            for p in reader.pages:
-                pages_text.append(p.extract_text() or "")
-            extracted_text = "\n\n".join(pages_text).strip()
+            # Large PDFs are extracted page-range-parallel in worker processes (see pdf_extract.py);
+            # only the extraction settings are needed, not a RAG engine
+            from .. import ingest_pool, pdf_extract
+            from ..rag import RAGSettings
+
+            def _extract() -> str:
+                s = RAGSettings()
+                if s.ingest_process_pool:
+                    ingest_pool.configure(workers=s.ingest_workers, max_tasks_per_child=s.ingest_max_tasks_per_child,
+                                          memory_limit_mb=s.ingest_memory_limit_mb)
+                _total, pages = pdf_extract.open_pdf_pages(content, pool=s.ingest_process_pool, min_pages=s.pdf_parallel_min_pages,
+                                                           pages_per_task=s.pdf_pages_per_task, slow_page_ms=s.pdf_slow_page_ms)
+                return "\n\n".join(text for _page, text in pages)
+
+            extracted_text = (await run_in_threadpool(_extract)).strip()
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Failed to read PDF: {e}")
 
@@ -139,7 +157,7 @@ async def ocr_translate(
             "- Do not add commentary; only the textual content."
         )
         try:
-            res = client.chat.completions.create(
+            res = await client.chat.completions.create(
                 model="gpt-4o-mini",
                 messages=[
                     {"role": "system", "content": system},
@@ -168,7 +186,7 @@ async def ocr_translate(
     )
     prompt = f"Target language: {target_lang}. Return format: {return_format}.\n\n---\n{extracted_text}"
     try:
-        res = client.chat.completions.create(
+        res = await client.chat.completions.create(
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": system},
@@ -188,8 +206,9 @@ async def ocr_translate(
 async def images_to_pdf(files: list[UploadFile] = File(..., description="One or more images (png/jpg/webp) to combine into a single PDF")):
     if not files:
         raise HTTPException(status_code=400, detail="No files uploaded")
+    from PIL import Image
 
-    images: list[Image.Image] = []
+    images: list = []
     order = 0
     for f in files:
         try:
@@ -219,7 +238,7 @@ async def images_to_pdf(files: list[UploadFile] = File(..., description="One or
     output = io.BytesIO()
     first, rest = images[0], images[1:]
     try:
-        first.save(output, format="PDF", save_all=True, append_images=rest)
+        await run_in_threadpool(first.save, output, format="PDF", save_all=True, append_images=rest)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create PDF: {e}")
 
@@ -241,6 +260,8 @@ async def free_ocr(
 ):
     if not files:
         raise HTTPException(status_code=400, detail="No files uploaded")
+    from PIL import Image, ImageFilter, ImageOps
+    pytesseract = _get_pytesseract()
 
     pages: list[dict] = []
     combined: list[str] = []
@@ -294,7 +315,7 @@ async def free_ocr(
                         cfg += f" --tessdata-dir \"{s2.tessdata_dir}\""
                 except Exception:
                     pass
-                text = pytesseract.image_to_string(proc, lang=lang, config=cfg)
+                text = await run_in_threadpool(pytesseract.image_to_string, proc, lang=lang, config=cfg)
             except Exception as te:
                 raise HTTPException(status_code=500, detail=f"Tesseract error: {te}. Ensure Tesseract is installed and on PATH.")
             pages.append({
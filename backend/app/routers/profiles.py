@@ -6,7 +6,7 @@ router = APIRouter()
 
 
 @router.get("/profiles/me")
-async def get_me():
+def get_me():
     """Return a shared public profile so the app can function without auth."""
     sb = get_supabase()
     res = sb.table("profiles").select("*").eq("id", "public").maybe_single().execute()
@@ -23,10 +23,10 @@ async def get_me():
 
 
 @router.patch("/profiles/me")
-async def update_me(payload: Dict[str, Any]):
+def update_me(payload: Dict[str, Any]):
     allowed = {k: v for k, v in payload.items() if k in {"full_name", "avatar_url"}}
     if not allowed:
-        return await get_me()
+        return get_me()
     sb = get_supabase()
     res = sb.table("profiles").upsert({"id": "public", **allowed}).execute()
     updated = res.data[0] if getattr(res, "data", None) else {"id": "public", **allowed}
@@ -6,7 +6,8 @@ import random
 import json
 import os
 
-from ..rag import RAGEngine
+from ..rag import get_engine
+from .. import llm_clients
 import logging
 
 router = APIRouter()
@@ -34,16 +35,14 @@ class QuizGenerateResponse(BaseModel):
     meta: dict
 
 
-_engine = RAGEngine()
-
-
 def _fetch_document_chunks(document_id: str, limit: int = 40) -> List[str]:
     """Fetch raw text chunks belonging to a document from the vector store."""
     texts: List[str] = []
     try:
-        logging.getLogger("rag").info("Quiz._fetch_document_chunks: backend=%s doc_id=%s limit=%s", _engine.settings.store_backend, document_id, limit)
-        if _engine.settings.store_backend == "chroma":
-            coll = _engine._collection  # type: ignore[attr-defined]
+        engine = get_engine()
+        logging.getLogger("rag").info("Quiz._fetch_document_chunks: backend=%s doc_id=%s limit=%s", engine.settings.store_backend, document_id, limit)
+        if engine.settings.store_backend == "chroma":
+            coll = engine._collection  # type: ignore[attr-defined]
             if coll is None:
                 texts = []
             else:
@@ -65,9 +64,13 @@ def _fetch_document_chunks(document_id: str, limit: int = 40) -> List[str]:
                     logging.getLogger("rag").info("Quiz._fetch_document_chunks fallback supabase: got %s chunks", len(texts))
                 except Exception:
                     pass
+        elif engine.settings.store_backend == "local":
+            lvs = getattr(engine, "_lvs", None)
+            if lvs is not None:
+                texts.extend(lvs.get_chunks_by_document(str(document_id), limit=limit))
         else:
             # Supabase: fetch directly by document_id from vector store to avoid semantic bias
-            svs = getattr(_engine, "_svs", None)
+            svs = getattr(engine, "_svs", None)
             if svs is None:
                 texts = []
             else:
@@ -76,7 +79,7 @@ def _fetch_document_chunks(document_id: str, limit: int = 40) -> List[str]:
             # Fallback: try Chroma if available
             if not texts:
                 try:
-                    coll = getattr(_engine, "_collection", None)
+                    coll = getattr(engine, "_collection", None)
                     if coll is not None:
                         got = coll.get(where={"document_id": str(document_id)}, include=["documents"], limit=limit)
                         docs = (got or {}).get("documents") or []
@@ -98,7 +101,8 @@ def _llm_generate_mcq_from_context(*, chunks: List[str], num: int, lang: str, di
     """Use configured LLM provider to generate MCQs strictly from provided chunks.
     Returns list of QuizQuestion with normalized fields.
     """
-    provider = (_engine.settings.llm_provider or "none").lower()
+    engine = get_engine()
+    provider = (engine.settings.llm_provider or "none").lower()
     logger = logging.getLogger("rag")
     if provider not in {"openai", "gemini", "ollama"}:
         raise HTTPException(status_code=400, detail="LLM provider chưa được cấu hình (llm_provider).")
@@ -138,11 +142,10 @@ def _llm_generate_mcq_from_context(*, chunks: List[str], num: int, lang: str, di
     output: List[Dict[str, Any]] = []
     if provider == "openai":
         try:
-            from openai import OpenAI  # type: ignore
-            if not _engine.settings.openai_api_key:
+            if not engine.settings.openai_api_key:
                 raise HTTPException(status_code=400, detail="Thiếu OPENAI_API_KEY cho LLM.")
-            client = OpenAI(api_key=_engine.settings.openai_api_key)
-            model = _engine.settings.openai_chat_model
+            client = llm_clients.openai_client(engine.settings.openai_api_key)
+            model = engine.settings.openai_chat_model
             msg = [{"role": "system", "content": directive}, {"role": "user", "content": user_prompt}]
             r = client.chat.completions.create(model=model, messages=msg)
             content = (r.choices[0].message.content or "").strip()
@@ -154,11 +157,9 @@ def _llm_generate_mcq_from_context(*, chunks: List[str], num: int, lang: str, di
             raise HTTPException(status_code=500, detail=f"LLM OpenAI lỗi: {e}")
     elif provider == "gemini":
         try:
-            import google.generativeai as genai  # type: ignore
-            if not _engine.settings.gemini_api_key:
+            if not engine.settings.gemini_api_key:
                 raise HTTPException(status_code=400, detail="Thiếu GEMINI_API_KEY cho LLM.")
-            genai.configure(api_key=_engine.settings.gemini_api_key)
-            model = genai.GenerativeModel(_engine.settings.gemini_chat_model)
+            model = llm_clients.gemini_model(engine.settings.gemini_api_key, engine.settings.gemini_chat_model)
             r = model.generate_content("\n\n".join([directive, user_prompt]))
             content = (getattr(r, "text", None) or "").strip()
             output = _parse_json_array(content)
@@ -169,9 +170,8 @@ def _llm_generate_mcq_from_context(*, chunks: List[str], num: int, lang: str, di
             raise HTTPException(status_code=500, detail=f"LLM Gemini lỗi: {e}")
     else:  # ollama
         try:
-            import ollama  # type: ignore
             model = os.environ.get("OLLAMA_MODEL", "llama3.1:8b")
-            r = ollama.chat(model=model, messages=[{"role": "system", "content": directive}, {"role": "user", "content": user_prompt}])
+            r = llm_clients.ollama_client().chat(model=model, messages=[{"role": "system", "content": directive}, {"role": "user", "content": user_prompt}])
             content = (r.get("message", {}) or {}).get("content") or ""
             output = _parse_json_array(content)
         except Exception as e:
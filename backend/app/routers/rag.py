@@ -1,15 +1,17 @@
 from typing import Optional, List, Any, Dict
-from fastapi import APIRouter, HTTPException, BackgroundTasks
+from fastapi import APIRouter, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from ..rag import get_engine
 from ..vector_store import SupabaseVectorStore
 from ..supabase_client import get_supabase
 from ..rag_jobs import job_store
+from ..index_queue import QueueFull, index_queue
 from ..config import get_settings
+from .. import chat_memory, llm_clients
 import json
-import urllib.request
-import urllib.error
+import logging
 
 router = APIRouter()
 
@@ -39,10 +41,6 @@ class RAGAnswer(BaseModel):
     contexts: List[Any]
 
 
-# --- Simple in-memory chat memory per thread ---
-_chat_memory: Dict[str, List[Dict[str, str]]] = {}
-
-
 class StreamPayload(RAGQuery):
     thread_id: Optional[str] = None  # client-generated conversation id
     memory: Optional[bool] = True    # whether to use and update memory
@@ -55,7 +53,7 @@ async def rag_stream(payload: StreamPayload):
     engine = get_engine()
     uid = None
 
-    results = engine.retrieve(
+    results = await engine.aretrieve(
         payload.query,
         top_k=payload.top_k,
         subject_id=payload.subject_id,
@@ -70,33 +68,29 @@ async def rag_stream(payload: StreamPayload):
         page_from=payload.page_from,
         page_to=payload.page_to,
     )
-    contexts: List[str] = [r.get("citation", {}).get("snippet") or r.get("text") or "" for r in results]
-
-    # memory: prepend previous snippets if any, then update
-    if payload.thread_id and payload.memory:
-        history = _chat_memory.get(payload.thread_id, [])
-        prev_ctx = [h.get("snippet", "") for h in history if h.get("snippet")]
-        if prev_ctx:
-            contexts = prev_ctx[-4:] + contexts  # limit history to last 4 items
-
-    answer = engine.answer(payload.query, contexts)
+    cited = await _build_contexts(payload, results)
+    contexts: List[str] = [c.get("snippet") or "" for c in cited]
 
-    # update memory store with last user query and top snippet
+    # memory: prepend the thread's previous snippets (within the token budget), then record this turn
     if payload.thread_id and payload.memory:
+        memory = chat_memory.get_store(engine.settings)
+        prev_ctx = await run_in_threadpool(memory.window, payload.thread_id, engine.settings.chat_memory_context_tokens)
+        # the best snippet of this turn's own retrieval, not a history one
         best_snippet = contexts[0] if contexts else ""
-        _chat_memory.setdefault(payload.thread_id, []).append({
-            "query": payload.query,
-            "snippet": best_snippet,
-        })
+        contexts = [c for c in prev_ctx if c not in contexts] + contexts
+        await run_in_threadpool(memory.append, payload.thread_id, payload.query, best_snippet)
 
+    # NDJSON: citations first so the UI can show sources immediately, then answer tokens as generated
     async def _gen():
-        # naive chunking to simulate streaming
-        text = answer
-        step = 128
-        for i in range(0, len(text), step):
-            yield text[i:i+step]
-        # done
-    return StreamingResponse(_gen(), media_type="text/plain; charset=utf-8")
+        yield json.dumps({"type": "contexts", "contexts": cited}, ensure_ascii=False) + "\n"
+        try:
+            async for piece in engine.astream_answer(payload.query, contexts):
+                yield json.dumps({"type": "token", "text": piece}, ensure_ascii=False) + "\n"
+        except Exception as e:
+            logging.getLogger("rag").exception("[RAG] Stream failed: %s", e)
+            yield json.dumps({"type": "error", "message": str(e)}, ensure_ascii=False) + "\n"
+        yield json.dumps({"type": "done"}) + "\n"
+    return StreamingResponse(_gen(), media_type="application/x-ndjson")
 
 
  
@@ -108,7 +102,7 @@ async def rag_query(payload: RAGQuery):
         raise HTTPException(status_code=400, detail="Query is required")
     engine = get_engine()
     uid = None
-    results = engine.retrieve(
+    results = await engine.aretrieve(
         payload.query,
         top_k=payload.top_k,
         subject_id=payload.subject_id,
@@ -123,7 +117,13 @@ async def rag_query(payload: RAGQuery):
         page_from=payload.page_from,
         page_to=payload.page_to,
     )
-    # Build contexts with citation objects
+    contexts = await _build_contexts(payload, results)
+    answer = await engine.aanswer(payload.query, [c.get("snippet", "") for c in contexts])
+    return RAGAnswer(answer=answer, contexts=contexts)
+
+
+async def _build_contexts(payload: RAGQuery, results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Citation objects for retrieval hits, augmented with Tavily web results when requested."""
     contexts: List[Any] = []
     for r in results:
         cit = r.get("citation") or {}
@@ -139,25 +139,25 @@ async def rag_query(payload: RAGQuery):
         api_key = getattr(settings, "tavily_api_key", None)
         if api_key:
             try:
-                tavily_ctx = _tavily_search(payload.query, api_key=api_key, max_results=max(1, min(int(payload.web_top_k or 3), 8)))
+                tavily_ctx = await _tavily_search(payload.query, api_key=api_key, max_results=max(1, min(int(payload.web_top_k or 3), 8)))
                 # Merge, dedupe by url, then simple rerank
                 contexts.extend(tavily_ctx)
                 contexts = _dedupe_and_rerank_contexts(payload.query, contexts)
             except Exception as e:
                 # Do not fail the whole request because of web search error
                 contexts.append({"title": "Web search error", "snippet": f"{e}"})
-    answer = engine.answer(payload.query, [c.get("snippet", "") for c in contexts])
-    return RAGAnswer(answer=answer, contexts=contexts)
+    return contexts
 
 
 @router.get("/rag/jobs/{doc_id}")
-async def rag_job_status(doc_id: str):
-    # For now, in-memory by doc_id only. Could add user scoping later.
+def rag_job_status(doc_id: str):
+    # Persisted status/queue state by doc_id (rag_jobs.sqlite3). Could add user scoping later.
     return job_store.get(doc_id)
 
 
 @router.post("/rag/index/{doc_id}")
-async def rag_index_now(doc_id: str, background_tasks: BackgroundTasks):
+def rag_index_now(doc_id: str):
+    # plain def: the Supabase query, the enqueue and the job_store writes below all block
     import logging
     logging.getLogger("rag").info("[RAG] IndexNow requested doc_id=%s", doc_id)
     sb = get_supabase()
@@ -170,32 +170,33 @@ async def rag_index_now(doc_id: str, background_tasks: BackgroundTasks):
     if not file_url:
         raise HTTPException(status_code=400, detail="Document has no file_url to index")
 
-    engine = get_engine()
     # Normalize IDs from DB row to ensure numeric strings
     canonical_doc_id = str(row.get("id")) if row.get("id") is not None else str(doc_id)
     subject_id = str(row.get("subject_id")) if row.get("subject_id") is not None else None
     logging.getLogger("rag").info("[RAG] IndexNow doc_id_in_path=%s canonical_doc_id=%s subject_id=%s file_url=%s", doc_id, canonical_doc_id, subject_id, bool(row.get("file_url")))
-    uid = None
-    job_store.start(canonical_doc_id)
-
-    async def _run():
-        try:
-            extra_metadata = {
+    try:
+        outcome = index_queue.enqueue_index(
+            document_id=canonical_doc_id,
+            subject_id=subject_id,
+            user_id=None,
+            file_name=row.get("file_path") or "file.bin",
+            extra_metadata={
                 "author": row.get("author"),
                 "tags": row.get("tags") or [],
                 "created_at": row.get("created_at"),
                 "file_url": row.get("file_url"),
-            }
-            await engine.index_document_from_url(document_id=canonical_doc_id, subject_id=subject_id, user_id=uid, url=file_url, file_name=row.get("file_path") or "file.bin", extra_metadata=extra_metadata, replace=True)
-        except Exception as e:
-            job_store.fail(doc_id, f"Index lỗi: {e}")
-
-    background_tasks.add_task(_run)
-    return {"ok": True, "doc_id": canonical_doc_id}
+            },
+            replace=True,
+            file_url=file_url,
+        )
+    except QueueFull as e:
+        job_store.fail(canonical_doc_id, f"Hàng đợi lập chỉ mục đang đầy: {e}")
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
+    return {"ok": True, "doc_id": canonical_doc_id, "queued": outcome}
 
 
 @router.get("/rag/diag")
-async def rag_diag():
+def rag_diag():
     """Chẩn đoán nhanh: tạo embedding cho 1 câu ngắn và thử insert vào Supabase.
     Trả về kích thước vector, số hàng chèn thử, và lỗi (nếu có)."""
     engine = get_engine()
@@ -203,7 +204,7 @@ async def rag_diag():
         texts = ["chandoan"]
         embs = engine._embed_texts(texts)  # type: ignore
         emb_dim = len(embs[0]) if embs and isinstance(embs[0], list) else None
-        store = SupabaseVectorStore()
+        store = SupabaseVectorStore(precision=engine._vector_precision())  # type: ignore
         # cố gắng chèn 1 hàng thử nghiệm
         store.add_chunks(
             document_id="0",
@@ -219,7 +220,7 @@ async def rag_diag():
         return {"ok": False, "error": str(e)}
 
 
-def _tavily_search(query: str, api_key: str, max_results: int = 3) -> List[Dict[str, Any]]:
+async def _tavily_search(query: str, api_key: str, max_results: int = 3) -> List[Dict[str, Any]]:
     """Call Tavily Search API and return contexts list.
     Docs: https://api.tavily.com
     """
@@ -233,19 +234,15 @@ def _tavily_search(query: str, api_key: str, max_results: int = 3) -> List[Dict[
         # we only need sources, not model-written answer
         "include_answer": False,
     }
-    data = json.dumps(payload).encode("utf-8")
-    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"}, method="POST")
     try:
-        with urllib.request.urlopen(req, timeout=15) as resp:
-            body = resp.read().decode("utf-8")
-    except urllib.error.HTTPError as he:
-        text = he.read().decode("utf-8", errors="ignore") if hasattr(he, 'read') else str(he)
-        raise RuntimeError(f"Tavily HTTP {he.code}: {text}")
+        resp = await llm_clients.async_http_client().post(url, json=payload, timeout=15)
     except Exception as e:
         raise RuntimeError(f"Tavily request failed: {e}")
+    if resp.status_code >= 400:
+        raise RuntimeError(f"Tavily HTTP {resp.status_code}: {resp.text}")
 
     try:
-        obj = json.loads(body)
+        obj = resp.json()
     except Exception as e:
         raise RuntimeError(f"Invalid Tavily response: {e}")
 
@@ -304,7 +301,7 @@ async def rag_suggest_questions(payload: SuggestQuestionsPayload):
     uid = None
     # Use query (if any) to bias retrieval; otherwise retrieve broadly with subject filter
     retrieval_q = (payload.query or "tổng quan").strip()
-    results = engine.retrieve(
+    results = await engine.aretrieve(
         retrieval_q,
         top_k=max(3, min(payload.top_k or 5, 12)),
         subject_id=payload.subject_id,
@@ -11,7 +11,7 @@ def _table_name() -> str:
 
 
 @router.get("/schedules", response_model=List[ScheduleOut])
-async def list_schedules(
+def list_schedules(
     from_: Optional[str] = Query(default=None, alias="from"),
     to: Optional[str] = None,
     subject_id: Optional[str] = None,
@@ -29,7 +29,7 @@ async def list_schedules(
 
 
 @router.post("/schedules", response_model=ScheduleOut)
-async def create_schedule(payload: ScheduleCreate):
+def create_schedule(payload: ScheduleCreate):
     sb = get_supabase()
     data = payload.model_dump(by_alias=True)
     resp = sb.table(_table_name()).insert(data).execute()
@@ -39,7 +39,7 @@ async def create_schedule(payload: ScheduleCreate):
 
 
 @router.patch("/schedules/{schedule_id}", response_model=ScheduleOut)
-async def update_schedule(schedule_id: str, payload: ScheduleUpdate):
+def update_schedule(schedule_id: str, payload: ScheduleUpdate):
     sb = get_supabase()
     data = {k: v for k, v in payload.model_dump(by_alias=True).items() if v is not None}
     q = sb.table(_table_name()).update(data).eq("id", schedule_id)
@@ -50,7 +50,7 @@ async def update_schedule(schedule_id: str, payload: ScheduleUpdate):
 
 
 @router.delete("/schedules/{schedule_id}")
-async def delete_schedule(schedule_id: str):
+def delete_schedule(schedule_id: str):
     sb = get_supabase()
     q = sb.table(_table_name()).delete().eq("id", schedule_id)
     resp = q.execute()
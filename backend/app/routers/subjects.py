@@ -11,7 +11,7 @@ def _table_name() -> str:
 
 
 @router.get("/subjects", response_model=List[SubjectOut])
-async def list_subjects():
+def list_subjects():
     sb = get_supabase()
     query = sb.table(_table_name()).select("*")
     resp = query.order("id").execute()
@@ -19,7 +19,7 @@ async def list_subjects():
 
 
 @router.post("/subjects", response_model=SubjectOut)
-async def create_subject(payload: SubjectCreate):
+def create_subject(payload: SubjectCreate):
     sb = get_supabase()
     data = payload.model_dump()
     resp = sb.table(_table_name()).insert(data).execute()
@@ -29,7 +29,7 @@ async def create_subject(payload: SubjectCreate):
 
 
 @router.patch("/subjects/{subject_id}", response_model=SubjectOut)
-async def update_subject(subject_id: str, payload: SubjectUpdate):
+def update_subject(subject_id: str, payload: SubjectUpdate):
     sb = get_supabase()
     data = {k: v for k, v in payload.model_dump().items() if v is not None}
     q = sb.table(_table_name()).update(data).eq("id", subject_id)
@@ -40,7 +40,7 @@ async def update_subject(subject_id: str, payload: SubjectUpdate):
 
 
 @router.delete("/subjects/{subject_id}")
-async def delete_subject(subject_id: str):
+def delete_subject(subject_id: str):
     sb = get_supabase()
     # First delete dependent documents to avoid FK constraint
     dq = sb.table("documents").delete().eq("subject_id", subject_id)
@@ -1,9 +1,53 @@
 from functools import lru_cache
-from supabase import create_client, Client
+from typing import TYPE_CHECKING, Optional, Tuple
 from .config import get_settings
 
+if TYPE_CHECKING:
+    from supabase import Client
+
 
 @lru_cache()
-def get_supabase() -> Client:
+def get_supabase() -> "Client":
+    # Imported on first use: the supabase SDK is slow to import
+    from supabase import create_client
     settings = get_settings()
     return create_client(str(settings.supabase_url), settings.supabase_service_role_key)
+
+
+def upload_public_file(bucket: str, path: str, content: bytes, content_type: Optional[str]) -> Tuple[str, str]:
+    """Upload to Supabase Storage and return (path, public url). Raises RuntimeError on failure."""
+    storage = get_supabase().storage.from_(bucket)
+    try:
+        upload_resp = storage.upload(
+            file=content,
+            path=path,
+            file_options={"content-type": content_type or "application/octet-stream"},
+        )
+    except Exception as e:
+        raise RuntimeError(f"Upload error: {e}")
+
+    # Supabase v2 may return dict-like response; try to detect error
+    if upload_resp is None:
+        raise RuntimeError("Upload failed (no response)")
+    if isinstance(upload_resp, dict):
+        err = upload_resp.get("error") or upload_resp.get("message")
+        if err:
+            raise RuntimeError(f"Upload failed: {err}")
+
+    # Build public URL (ensure bucket has public policy or signed url)
+    public_result = storage.get_public_url(path)
+    if isinstance(public_result, str):
+        public_url = public_result
+    elif isinstance(public_result, dict):
+        public_url = (
+            public_result.get("publicUrl")
+            or (public_result.get("data") or {}).get("publicUrl")
+            or (public_result.get("data") or {}).get("public_url")
+            or (public_result.get("data") or {}).get("publicURL")
+        )
+        if not isinstance(public_url, str):
+            # Fallback: convert to str if unknown shape
+            public_url = str(public_result)
+    else:
+        public_url = str(public_result)
+    return path, public_url
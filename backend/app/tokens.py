@@ -0,0 +1,9 @@
+"""
+Cheap token estimate shared by the engine (embedding/rerank budgets) and
+conversation memory, without loading a tokenizer.
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    # Conservative for Vietnamese, which tokenizes denser than English
+    return len(text or "") // 3 + 1
@@ -1,5 +1,6 @@
 from __future__ import annotations
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterator, List, Optional
+import json
 import uuid as _uuid
 from .supabase_client import get_supabase
 import logging
@@ -10,19 +11,71 @@ class SupabaseVectorStore:
     Requires the following in your Supabase Postgres:
       - table: rag_chunks (see backend/pgvector.sql)
       - function: match_rag_chunks(query_embedding vector, match_count int, subject_id text, user_id uuid)
+    With precision float16 vectors go to the `embedding_half halfvec` column and are
+    searched via match_rag_chunks_half. Each precision only writes and searches its own
+    column, so switching an existing table needs the backfill in pgvector.sql.
+    Chunks also carry document metadata columns (author, tags, ...) so `query_filtered` can
+    apply every retrieval filter inside match_rag_chunks_filtered. Against an older schema
+    without those columns/RPC the store falls back to the legacy path (pushdown=False).
+    `chunk_key` holds the engine's deterministic chunk id used for incremental re-index.
     """
-    def __init__(self, table_name: str = "rag_chunks", rpc_name: str = "match_rag_chunks") -> None:
+    def __init__(self, table_name: str = "rag_chunks", rpc_name: str = "match_rag_chunks", precision: str = "float32",
+                 filtered_rpc_name: str = "match_rag_chunks_filtered") -> None:
         self.table_name = table_name
         self.rpc_name = rpc_name
+        self.precision = precision or "float32"
+        self.filtered_rpc_name = filtered_rpc_name
+        if self.precision != "float32" and rpc_name == "match_rag_chunks":
+            self.rpc_name = "match_rag_chunks_half"
+        if self.precision != "float32" and filtered_rpc_name == "match_rag_chunks_filtered":
+            self.filtered_rpc_name = "match_rag_chunks_filtered_half"
+        self.pushdown = True
+        self.chunk_keys = True
+        self.positions_rpc = True
         self.sb = get_supabase()
 
+    @staticmethod
+    def filter_fields(meta: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """Map chunk/document metadata to the rag_chunks filter columns."""
+        m = meta or {}
+        out: Dict[str, Any] = {}
+        if "author" in m:
+            out["author"] = m.get("author") or None
+        if "tags" in m:
+            out["tags"] = [str(t) for t in (m.get("tags") or [])]
+        if "created_at" in m:
+            out["doc_created_at"] = m.get("created_at") or None
+        if "file_url" in m:
+            out["file_url"] = m.get("file_url") or None
+            out["source"] = "url" if m.get("file_url") else "local"
+        if m.get("file_ext"):
+            out["file_ext"] = str(m["file_ext"]).lower()
+        if m.get("page") is not None:
+            out["page"] = int(m["page"])
+            out["page_end"] = int(m.get("page_end") if m.get("page_end") is not None else m["page"])
+        return out
+
+    @staticmethod
+    def _is_schema_error(e: Exception) -> bool:
+        msg = str(e)
+        return any(s in msg for s in ("PGRST202", "PGRST204", "Could not find the", "does not exist"))
+
+    def _embedding_field(self, emb: List[float]) -> Dict[str, Any]:
+        if self.precision == "float32":
+            return {"embedding": emb}
+        from .quantize import vector_literal
+        return {"embedding_half": vector_literal(emb, "float16")}
+
     def add_chunks(self, *,
                    document_id: str,
                    subject_id: Optional[str],
                    user_id: Optional[str],
                    file_name: str,
                    chunks: List[str],
-                   embeddings: List[List[float]]) -> None:
+                   embeddings: List[List[float]],
+                   chunk_indexes: Optional[List[int]] = None,
+                   metadatas: Optional[List[Dict[str, Any]]] = None,
+                   chunk_keys: Optional[List[str]] = None) -> None:
         rows: List[Dict[str, Any]] = []
         # Validate user_id as UUID, else set None (to avoid Postgres uuid errors)
         user_uuid: Optional[str] = None
@@ -48,23 +101,49 @@ class SupabaseVectorStore:
                 "subject_id": sid_str,
                 "user_id": user_uuid,
                 "file_name": file_name,
-                "chunk_index": i,
+                "chunk_index": chunk_indexes[i] if chunk_indexes is not None else i,
                 "content": text,
-                "embedding": emb,
+                **self._embedding_field(emb),
+                **(self.filter_fields(metadatas[i]) if metadatas is not None and self.pushdown else {}),
+                **({"chunk_key": chunk_keys[i]} if chunk_keys is not None and self.chunk_keys else {}),
             })
         if rows:
             try:
                 # Log diagnostic info: number of rows and embedding dimension
-                emb_dim = len(rows[0]["embedding"]) if rows and isinstance(rows[0].get("embedding"), list) else None
-                logging.getLogger("rag").info("Supabase insert rag_chunks: rows=%s emb_dim=%s document_id=%s subject_id=%s", len(rows), emb_dim, did_str, sid_str)
-                self.sb.table(self.table_name).insert(rows).execute()
+                emb_dim = len(embeddings[0]) if embeddings else None
+                logging.getLogger("rag").info("Supabase insert rag_chunks: rows=%s emb_dim=%s precision=%s document_id=%s subject_id=%s", len(rows), emb_dim, self.precision, did_str, sid_str)
+                while True:
+                    try:
+                        self.sb.table(self.table_name).insert(rows).execute()
+                        break
+                    except Exception as e:
+                        if not self._is_schema_error(e):
+                            raise
+                        if self.chunk_keys and chunk_keys is not None and "chunk_key" in str(e):
+                            logging.getLogger("rag").warning("rag_chunks has no chunk_key column (run pgvector.sql); re-index falls back to full replace: %s", e)
+                            self.chunk_keys = False
+                            drop: tuple = ("chunk_key",)
+                        elif self.pushdown and metadatas is not None:
+                            logging.getLogger("rag").warning("rag_chunks has no metadata filter columns (run pgvector.sql); disabling filter pushdown: %s", e)
+                            self.pushdown = False
+                            drop = ("author", "tags", "doc_created_at", "file_url", "source", "file_ext", "page", "page_end")
+                        else:
+                            raise
+                        for r in rows:
+                            for k in drop:
+                                r.pop(k, None)
             except Exception as e:
                 # Surface detailed error to caller for logging
                 raise RuntimeError(f"Supabase insert into {self.table_name} failed: {e}")
 
     def query(self, *, query_embedding: List[float], top_k: int, subject_id: Optional[str], user_id: Optional[str]) -> List[Dict[str, Any]]:
+        if self.precision != "float32":
+            from .quantize import vector_literal
+            q_emb: Any = vector_literal(query_embedding, "float16")
+        else:
+            q_emb = query_embedding
         payload: Dict[str, Any] = {
-            "query_embedding": query_embedding,
+            "query_embedding": q_emb,
             "match_count": max(1, min(top_k, 50)),
             # Use canonical string subject_id (UUID-safe). Keep None if empty.
             "subject_id": (str(subject_id).strip() or None) if subject_id is not None else None,
@@ -88,6 +167,79 @@ class SupabaseVectorStore:
             })
         return outs
 
+    def query_filtered(self, *, query_embedding: List[float], top_k: int,
+                       subject_ids: Optional[List[str]] = None,
+                       user_id: Optional[str] = None,
+                       author: Optional[str] = None,
+                       tags: Optional[List[str]] = None,
+                       time_from: Optional[str] = None,
+                       time_to: Optional[str] = None,
+                       source: Optional[str] = None,
+                       file_type: Optional[str] = None,
+                       page_from: Optional[int] = None,
+                       page_to: Optional[int] = None) -> Optional[List[Dict[str, Any]]]:
+        """Similarity search with all filters applied in SQL (one round-trip, full top_k).
+        Returns None when the filtered RPC is not installed; callers then use `query`."""
+        if not self.pushdown:
+            return None
+        if self.precision != "float32":
+            from .quantize import vector_literal
+            q_emb: Any = vector_literal(query_embedding, "float16")
+        else:
+            q_emb = query_embedding
+        payload: Dict[str, Any] = {
+            "query_embedding": q_emb,
+            "match_count": max(1, min(top_k, 50)),
+            "subject_ids": [str(s) for s in subject_ids] if subject_ids else None,
+            "user_id": user_id,
+            "author": author or None,
+            "tags": list(tags) if tags else None,
+            "time_from": time_from or None,
+            "time_to": time_to or None,
+            "source": source if source in ("local", "url") else None,
+            "file_ext": file_type.lower() if file_type else None,
+            "page_from": page_from,
+            "page_to": page_to,
+        }
+        try:
+            res = self.sb.rpc(self.filtered_rpc_name, payload).execute()
+        except Exception as e:
+            if not self._is_schema_error(e):
+                raise
+            logging.getLogger("rag").warning("%s is not installed (run pgvector.sql); falling back to %s: %s", self.filtered_rpc_name, self.rpc_name, e)
+            self.pushdown = False
+            return None
+        outs: List[Dict[str, Any]] = []
+        for r in res.data or []:
+            outs.append({
+                "text": r.get("content", ""),
+                "metadata": {
+                    "file_name": r.get("file_name"),
+                    "chunk_index": r.get("chunk_index"),
+                    "document_id": r.get("document_id"),
+                    "subject_id": r.get("subject_id"),
+                    "user_id": r.get("user_id"),
+                    "author": r.get("author"),
+                    "tags": r.get("tags") or [],
+                    "created_at": r.get("doc_created_at"),
+                    "file_url": r.get("file_url"),
+                    "source": r.get("source"),
+                    "file_ext": r.get("file_ext"),
+                    "page": r.get("page"),
+                    "page_end": r.get("page_end"),
+                },
+                "score": float(1 - (r.get("distance") or 0.0)),
+            })
+        return outs
+
+    def update_document_metadata(self, document_id: str, meta: Dict[str, Any]) -> None:
+        """Copy edited document metadata onto its chunks (no-op on the legacy schema)."""
+        did = str(document_id).strip()
+        fields = self.filter_fields(meta)
+        if not did or not fields or not self.pushdown:
+            return
+        self.sb.table(self.table_name).update(fields).eq("document_id", did).execute()
+
     def get_chunks_by_document(self, document_id: str, limit: int = 100) -> List[str]:
         """Return raw chunk texts for a specific document_id ordered by chunk_index.
         This avoids semantic search when we need all chunks from a document (e.g., quiz generation).
@@ -115,6 +267,147 @@ class SupabaseVectorStore:
             logging.getLogger("rag").exception("SVS.get_chunks_by_document error doc_id=%s: %s", did, e)
             return []
 
+    def list_chunk_ids_by_document(self, document_id: str) -> List[Any]:
+        """Return row ids of all chunks for a document (paged past the PostgREST row cap)."""
+        did = str(document_id).strip()
+        if not did:
+            return []
+        ids: List[Any] = []
+        page = 1000
+        start = 0
+        while True:
+            res = (
+                self.sb
+                .table(self.table_name)
+                .select("id")
+                .eq("document_id", did)
+                .order("id", desc=False)
+                .range(start, start + page - 1)
+                .execute()
+            )
+            rows = res.data or []
+            ids.extend(r["id"] for r in rows if r.get("id") is not None)
+            if len(rows) < page:
+                return ids
+            start += page
+
+    def list_chunk_keys_by_document(self, document_id: str) -> Optional[List[Dict[str, Any]]]:
+        """Rows (id, chunk_key, chunk_index[, page, page_end]) of a document's chunks, or None
+        when the table has no chunk_key column."""
+        if not self.chunk_keys:
+            return None
+        did = str(document_id).strip()
+        if not did:
+            return []
+        cols = "id, chunk_key, chunk_index" + (", page, page_end" if self.pushdown else "")
+        out: List[Dict[str, Any]] = []
+        page = 1000
+        start = 0
+        while True:
+            try:
+                res = (
+                    self.sb
+                    .table(self.table_name)
+                    .select(cols)
+                    .eq("document_id", did)
+                    .order("id", desc=False)
+                    .range(start, start + page - 1)
+                    .execute()
+                )
+            except Exception as e:
+                if not self._is_schema_error(e):
+                    raise
+                logging.getLogger("rag").warning("rag_chunks has no chunk_key column (run pgvector.sql): %s", e)
+                self.chunk_keys = False
+                return None
+            rows = res.data or []
+            out.extend(r for r in rows if r.get("id") is not None)
+            if len(rows) < page:
+                return out
+            start += page
+
+    def get_document_vectors(self, document_id: str) -> List[tuple]:
+        """(content, {chunk_index, page, page_end}, vector) of every chunk of a document."""
+        did = str(document_id).strip()
+        col = "embedding" if self.precision == "float32" else "embedding_half"
+        cols = f"content, chunk_index, {col}" + (", page, page_end" if self.pushdown else "")
+        out: List[tuple] = []
+        page = 500
+        start = 0
+        while did:
+            res = (
+                self.sb
+                .table(self.table_name)
+                .select(cols)
+                .eq("document_id", did)
+                .order("id", desc=False)
+                .range(start, start + page - 1)
+                .execute()
+            )
+            rows = res.data or []
+            for r in rows:
+                vec = r.get(col)
+                # PostgREST returns vector/halfvec columns as their text form "[0.1,...]"
+                if isinstance(vec, str):
+                    vec = json.loads(vec)
+                if vec:
+                    out.append((r.get("content") or "", {"chunk_index": r.get("chunk_index"), "page": r.get("page"), "page_end": r.get("page_end")}, [float(x) for x in vec]))
+            if len(rows) < page:
+                break
+            start += page
+        return out
+
+    def update_chunk_positions(self, rows: List[Dict[str, Any]]) -> None:
+        """Set chunk_index/page/page_end of existing rows ({"id": ..., fields}). Only ever
+        updates: via the update_rag_chunk_positions RPC in batches, or one UPDATE per row
+        against a schema without it (or without the page columns)."""
+        if self.positions_rpc and self.pushdown:
+            try:
+                for i in range(0, len(rows), 500):
+                    part = rows[i:i + 500]
+                    self.sb.rpc("update_rag_chunk_positions", {
+                        "ids": [r["id"] for r in part],
+                        "chunk_indexes": [r.get("chunk_index") for r in part],
+                        "pages": [r.get("page") for r in part],
+                        "page_ends": [r.get("page_end") for r in part],
+                    }).execute()
+                return
+            except Exception as e:
+                if not self._is_schema_error(e):
+                    raise
+                logging.getLogger("rag").warning("update_rag_chunk_positions RPC missing (run pgvector.sql); updating rows one by one: %s", e)
+                self.positions_rpc = False
+        keep = ("chunk_index",) + (("page", "page_end") if self.pushdown else ())
+        for r in rows:
+            self.sb.table(self.table_name).update({k: r.get(k) for k in keep}).eq("id", r["id"]).execute()
+
+    def iter_chunks(self, page: int = 1000) -> Iterator[Dict[str, Any]]:
+        """Yield every stored chunk (without embeddings), paged by id."""
+        start = 0
+        while True:
+            res = (
+                self.sb
+                .table(self.table_name)
+                .select("id, document_id, subject_id, user_id, file_name, chunk_index, content")
+                .order("id", desc=False)
+                .range(start, start + page - 1)
+                .execute()
+            )
+            rows = res.data or []
+            yield from rows
+            if len(rows) < page:
+                return
+            start += page
+
+    def delete_chunks_by_ids(self, ids: List[Any]) -> None:
+        for i in range(0, len(ids), 200):
+            self.sb.table(self.table_name).delete().in_("id", ids[i:i + 200]).execute()
+
+    def delete_chunks_by_keys(self, document_id: str, chunk_keys: List[str]) -> None:
+        did = str(document_id).strip()
+        for i in range(0, len(chunk_keys), 200):
+            self.sb.table(self.table_name).delete().eq("document_id", did).in_("chunk_key", chunk_keys[i:i + 200]).execute()
+
     def delete_chunks_by_document(self, document_id: str) -> None:
         """Delete all chunks for a given document_id (string/UUID-safe)."""
         did = str(document_id).strip()
@@ -62,3 +62,228 @@ create or replace function match_rag_chunks(
   order by rc.embedding <=> query_embedding
   limit match_count;
 $$;
+
+-- ===== Optional: reduced-precision storage (RAGSettings.vector_precision = float16) =====
+-- halfvec stores 2 bytes/dim instead of 4 and halves index size; requires pgvector >= 0.7.
+-- Dimension must match the embedding column above.
+-- Rows are written to one column only (embedding for float32, embedding_half for float16) and
+-- each mode searches only its own column: after switching precision, run the matching backfill
+-- below (or re-index every document), otherwise chunks indexed in the other mode are not found.
+-- Search runs on the stored precision; there is no full-precision rescoring of candidates.
+alter table rag_chunks add column if not exists embedding_half halfvec(768);
+
+-- One-off backfill when switching float32 -> float16:
+-- update rag_chunks set embedding_half = embedding::halfvec(768) where embedding_half is null and embedding is not null;
+-- One-off backfill when switching back float16 -> float32 (the float32 vectors are rounded half values;
+-- re-index for exact ones):
+-- update rag_chunks set embedding = embedding_half::vector(768) where embedding is null and embedding_half is not null;
+
+create index if not exists idx_rag_chunks_embedding_half on rag_chunks using hnsw (embedding_half halfvec_cosine_ops);
+
+create or replace function match_rag_chunks_half(
+  query_embedding halfvec,
+  match_count int,
+  subject_id text default null,
+  user_id uuid default null
+) returns table (
+  id bigint,
+  document_id text,
+  subject_id text,
+  user_id uuid,
+  file_name text,
+  chunk_index int,
+  content text,
+  distance double precision
+) language sql stable as $$
+  select
+    rc.id,
+    rc.document_id,
+    rc.subject_id,
+    rc.user_id,
+    rc.file_name,
+    rc.chunk_index,
+    rc.content,
+    (rc.embedding_half <=> query_embedding) as distance
+  from rag_chunks rc
+  where rc.embedding_half is not null
+    and (match_rag_chunks_half.subject_id is null or rc.subject_id = match_rag_chunks_half.subject_id)
+    and (match_rag_chunks_half.user_id is null or rc.user_id = match_rag_chunks_half.user_id)
+  order by rc.embedding_half <=> query_embedding
+  limit match_count;
+$$;
+
+-- ===== Metadata filter pushdown (match_rag_chunks_filtered) =====
+-- Chunks carry the filterable document metadata so every RAGQuery filter runs inside the
+-- vector search. The backend keeps these columns in sync when a document is edited.
+alter table rag_chunks add column if not exists author text;
+alter table rag_chunks add column if not exists tags text[] not null default '{}';
+alter table rag_chunks add column if not exists doc_created_at timestamptz;
+alter table rag_chunks add column if not exists file_url text;
+alter table rag_chunks add column if not exists source text;      -- local | url
+alter table rag_chunks add column if not exists file_ext text;
+alter table rag_chunks add column if not exists page int;          -- first page of the chunk (PDF)
+alter table rag_chunks add column if not exists page_end int;      -- last page of the chunk
+
+create index if not exists idx_rag_chunks_subject on rag_chunks (subject_id);
+create index if not exists idx_rag_chunks_document on rag_chunks (document_id, chunk_index);
+create index if not exists idx_rag_chunks_tags on rag_chunks using gin (tags);
+
+-- One-off backfill for chunks indexed before these columns existed
+-- (adjust the casts if documents.tags is jsonb instead of text[]):
+-- update rag_chunks rc set
+--   author = d.author,
+--   tags = coalesce(d.tags, '{}'),
+--   doc_created_at = d.created_at,
+--   file_url = d.file_url,
+--   source = case when coalesce(d.file_url, '') <> '' then 'url' else 'local' end,
+--   file_ext = nullif(lower(substring(coalesce(d.file_path, d.name, '') from '\.([^.]+)$')), '')
+-- from documents d
+-- where d.id::text = rc.document_id;
+
+-- Upgrading from an earlier version of these functions (return type changed):
+-- drop function if exists match_rag_chunks_filtered(vector, int, text[], uuid, text, text[], timestamptz, timestamptz, text, text, int, int);
+-- drop function if exists match_rag_chunks_filtered_half(halfvec, int, text[], uuid, text, text[], timestamptz, timestamptz, text, text, int, int);
+
+-- Iterative index scans (pgvector >= 0.8) keep walking the HNSW graph until match_count
+-- rows pass the filters instead of filtering a fixed ef_search candidate list.
+-- relaxed_order may return slightly out-of-order rows, hence the re-sort of the materialized CTE.
+create or replace function match_rag_chunks_filtered(
+  query_embedding vector,
+  match_count int,
+  subject_ids text[] default null,
+  user_id uuid default null,
+  author text default null,
+  tags text[] default null,
+  time_from timestamptz default null,
+  time_to timestamptz default null,
+  source text default null,
+  file_ext text default null,
+  page_from int default null,
+  page_to int default null
+) returns table (
+  id bigint,
+  document_id text,
+  subject_id text,
+  user_id uuid,
+  file_name text,
+  chunk_index int,
+  content text,
+  author text,
+  tags text[],
+  doc_created_at timestamptz,
+  file_url text,
+  source text,
+  file_ext text,
+  page int,
+  page_end int,
+  distance double precision
+) language sql stable
+set hnsw.iterative_scan = 'relaxed_order'
+as $$
+  with candidates as materialized (
+    select
+      rc.id, rc.document_id, rc.subject_id, rc.user_id, rc.file_name, rc.chunk_index, rc.content,
+      rc.author, rc.tags, rc.doc_created_at, rc.file_url, rc.source, rc.file_ext, rc.page, rc.page_end,
+      (rc.embedding <=> query_embedding) as distance
+    from rag_chunks rc
+    where (match_rag_chunks_filtered.subject_ids is null or rc.subject_id = any(match_rag_chunks_filtered.subject_ids))
+      and (match_rag_chunks_filtered.user_id is null or rc.user_id = match_rag_chunks_filtered.user_id)
+      and (match_rag_chunks_filtered.author is null or rc.author = match_rag_chunks_filtered.author)
+      and (match_rag_chunks_filtered.tags is null or rc.tags && match_rag_chunks_filtered.tags)
+      and (match_rag_chunks_filtered.time_from is null or rc.doc_created_at >= match_rag_chunks_filtered.time_from)
+      and (match_rag_chunks_filtered.time_to is null or rc.doc_created_at <= match_rag_chunks_filtered.time_to)
+      and (match_rag_chunks_filtered.source is null or rc.source = match_rag_chunks_filtered.source)
+      and (match_rag_chunks_filtered.file_ext is null or rc.file_ext = match_rag_chunks_filtered.file_ext)
+      -- chunk pages [page, page_end] overlap [page_from, page_to]
+      and (match_rag_chunks_filtered.page_from is null or coalesce(rc.page_end, rc.page) >= match_rag_chunks_filtered.page_from)
+      and (match_rag_chunks_filtered.page_to is null or rc.page <= match_rag_chunks_filtered.page_to)
+    order by rc.embedding <=> query_embedding
+    limit match_count
+  )
+  select * from candidates order by distance;
+$$;
+
+-- Same as above over the halfvec column (vector_precision = float16)
+create or replace function match_rag_chunks_filtered_half(
+  query_embedding halfvec,
+  match_count int,
+  subject_ids text[] default null,
+  user_id uuid default null,
+  author text default null,
+  tags text[] default null,
+  time_from timestamptz default null,
+  time_to timestamptz default null,
+  source text default null,
+  file_ext text default null,
+  page_from int default null,
+  page_to int default null
+) returns table (
+  id bigint,
+  document_id text,
+  subject_id text,
+  user_id uuid,
+  file_name text,
+  chunk_index int,
+  content text,
+  author text,
+  tags text[],
+  doc_created_at timestamptz,
+  file_url text,
+  source text,
+  file_ext text,
+  page int,
+  page_end int,
+  distance double precision
+) language sql stable
+set hnsw.iterative_scan = 'relaxed_order'
+as $$
+  with candidates as materialized (
+    select
+      rc.id, rc.document_id, rc.subject_id, rc.user_id, rc.file_name, rc.chunk_index, rc.content,
+      rc.author, rc.tags, rc.doc_created_at, rc.file_url, rc.source, rc.file_ext, rc.page, rc.page_end,
+      (rc.embedding_half <=> query_embedding) as distance
+    from rag_chunks rc
+    where rc.embedding_half is not null
+      and (match_rag_chunks_filtered_half.subject_ids is null or rc.subject_id = any(match_rag_chunks_filtered_half.subject_ids))
+      and (match_rag_chunks_filtered_half.user_id is null or rc.user_id = match_rag_chunks_filtered_half.user_id)
+      and (match_rag_chunks_filtered_half.author is null or rc.author = match_rag_chunks_filtered_half.author)
+      and (match_rag_chunks_filtered_half.tags is null or rc.tags && match_rag_chunks_filtered_half.tags)
+      and (match_rag_chunks_filtered_half.time_from is null or rc.doc_created_at >= match_rag_chunks_filtered_half.time_from)
+      and (match_rag_chunks_filtered_half.time_to is null or rc.doc_created_at <= match_rag_chunks_filtered_half.time_to)
+      and (match_rag_chunks_filtered_half.source is null or rc.source = match_rag_chunks_filtered_half.source)
+      and (match_rag_chunks_filtered_half.file_ext is null or rc.file_ext = match_rag_chunks_filtered_half.file_ext)
+      -- chunk pages [page, page_end] overlap [page_from, page_to]
+      and (match_rag_chunks_filtered_half.page_from is null or coalesce(rc.page_end, rc.page) >= match_rag_chunks_filtered_half.page_from)
+      and (match_rag_chunks_filtered_half.page_to is null or rc.page <= match_rag_chunks_filtered_half.page_to)
+    order by rc.embedding_half <=> query_embedding
+    limit match_count
+  )
+  select * from candidates order by distance;
+$$;
+
+-- ===== Incremental re-index (chunk_key) =====
+-- Deterministic chunk identity: "<document_id>-<sha1(content)[:16]>[-n]". A re-index only
+-- inserts chunks whose key is new and deletes keys that disappeared. Rows indexed before
+-- this column existed have chunk_key null and are replaced on their next re-index.
+alter table rag_chunks add column if not exists chunk_key text;
+create unique index if not exists idx_rag_chunks_chunk_key on rag_chunks (document_id, chunk_key);
+
+-- Re-index: rewrite the position of unchanged chunks that moved, one round-trip per batch.
+-- Plain UPDATE (never inserts a row, needs no INSERT privilege); ids that were deleted
+-- meanwhile are simply skipped.
+create or replace function update_rag_chunk_positions(
+  ids bigint[],
+  chunk_indexes int[],
+  pages int[],
+  page_ends int[]
+)
+returns void
+language sql
+as $$
+  update rag_chunks rc
+  set chunk_index = u.chunk_index,
+      page = u.page,
+      page_end = u.page_end
+  from unnest(ids, chunk_indexes, pages, page_ends) as u(id, chunk_index, page, page_end)
+  where rc.id = u.id;
+$$;
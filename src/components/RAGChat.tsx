@@ -129,6 +129,8 @@ export default function RAGChat({ subjectId, onClose }: Props) {
           author: f.author,
           time_from: f.timeFrom,
           time_to: f.timeTo,
+          web_search: webSearch,
+          web_top_k: webTopK,
           // chat memory controls
           thread_id: threadIdRef.current,
           memory: memoryEnabled,
@@ -136,23 +138,37 @@ export default function RAGChat({ subjectId, onClose }: Props) {
         signal: controller.signal,
       });
       if (!res.ok || !res.body) throw new Error('stream failed');
+      const appendText = (text: string) => {
+        setMessages((prev) => {
+          const idx = [...prev].map((m, j) => ({ m, j })).reverse().find(x => x.m.role === 'assistant')?.j;
+          if (idx === undefined) return prev;
+          const next = [...prev];
+          next[idx] = { ...next[idx], content: (next[idx].content || '') + text } as ChatMessage;
+          return next;
+        });
+      };
+      // NDJSON events: {type:'contexts'} first (citations), then {type:'token'} pieces, then {type:'done'}
+      const handleLine = (line: string) => {
+        if (!line.trim()) return;
+        let ev: { type?: string; text?: string; contexts?: ContextItem[]; message?: string };
+        try { ev = JSON.parse(line); } catch { return; }
+        if (ev.type === 'contexts') attachContexts(ev.contexts || []);
+        else if (ev.type === 'token' && ev.text) appendText(ev.text);
+        else if (ev.type === 'error') setError(ev.message || 'stream failed');
+      };
       const reader = res.body.getReader();
       const decoder = new TextDecoder();
+      let buffer = '';
       let done = false;
       while (!done) {
         const chunk = await reader.read();
         done = chunk.done;
-        const text = decoder.decode(chunk.value || new Uint8Array(), { stream: !done });
-        if (text) {
-          setMessages((prev) => {
-            const idx = [...prev].map((m, j) => ({ m, j })).reverse().find(x => x.m.role === 'assistant')?.j;
-            if (idx === undefined) return prev;
-            const next = [...prev];
-            next[idx] = { ...next[idx], content: (next[idx].content || '') + text } as ChatMessage;
-            return next;
-          });
-        }
+        buffer += decoder.decode(chunk.value || new Uint8Array(), { stream: !done });
+        const lines = buffer.split('\n');
+        buffer = lines.pop() ?? '';
+        lines.forEach(handleLine);
       }
+      handleLine(buffer);
     } catch (e: unknown) {
       if (e instanceof DOMException && e.name === 'AbortError') {
         // stopped by user
@@ -442,15 +458,8 @@ export default function RAGChat({ subjectId, onClose }: Props) {
       // Default: run RAG
       const f = buildFilterParams();
       if (streamUrl) {
-        // add placeholder assistant then stream
+        // add placeholder assistant then stream (citations arrive as the first stream event)
         setMessages(m => [...m, { id: newId(), role: 'assistant', content: '', showCitations: true, suggestions: buildFollowUps(q) }]);
-        // fetch contexts in background for citations
-        (async () => {
-          try {
-            const resC = await api.ragQuery({ query: q, subjectId: subjectId ?? undefined, topK: 5, ...f, webSearch, webTopK });
-            attachContexts((resC.contexts as ContextItem[]) || []);
-          } catch { /* silent */ }
-        })();
         await streamAnswer(q, subjectId ?? undefined);
       } else {
         const res = await api.ragQuery({ query: q, subjectId: subjectId ?? undefined, topK: 5, ...f, webSearch, webTopK });